@@ -1,5 +1,9 @@
-from fastapi import APIRouter
-from app.api.v1.endpoints import auth, channels, messages, files, video
+from fastapi import APIRouter, Depends
+from app.api.v1.endpoints import auth, channels, messages, files, notifications, sync, video
+from app.api.v1.endpoints.auth import get_current_user
+from app.core.database import mongo_pool_stats
+from app.core.redis import redis_pool_stats
+from app.core.storage import minio_pool_stats
 
 api_router = APIRouter()
 
@@ -8,8 +12,19 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "slack-clone-api"}
 
+@api_router.get("/diagnostics/pools", dependencies=[Depends(get_current_user)])
+async def pool_diagnostics():
+    """Checked-out, idle and waiting connections per pool; exposes internal hosts, so signed-in users only"""
+    return {
+        "mongo": mongo_pool_stats(),
+        "redis": redis_pool_stats(),
+        "minio": minio_pool_stats()
+    }
+
 api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
 api_router.include_router(channels.router, prefix="/channels", tags=["channels"])
 api_router.include_router(messages.router, prefix="/messages", tags=["messages"])
 api_router.include_router(files.router, prefix="/files", tags=["files"])
-api_router.include_router(video.router, prefix="/video", tags=["video"]) 
\ No newline at end of file
+api_router.include_router(video.router, prefix="/video", tags=["video"])
+api_router.include_router(sync.router, prefix="/sync", tags=["sync"])
+api_router.include_router(notifications.router, prefix="/notifications", tags=["notifications"])
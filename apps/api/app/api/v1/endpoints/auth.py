@@ -5,6 +5,7 @@ from bson import ObjectId
 from pydantic import BaseModel
 
 from app.core.database import get_db
+from app.core.read_routing import set_request_user
 from app.core.security import verify_password, get_password_hash, create_access_token, create_refresh_token, verify_token
 from app.models.user import UserCreate, User, UserInDB
 from app.crud.user import get_user_by_email, get_user_by_username, create_user
@@ -25,8 +26,8 @@ def transform_user_data(user_data):
     user_dict["id"] = str(user_dict.pop("_id"))
     return user_dict
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+async def authenticate_token(token: str) -> User:
+    """Resolve an access token to its user; shared by bearer auth and the WebSocket handshake"""
     payload = verify_token(token)
     if not payload:
         raise HTTPException(
@@ -42,6 +43,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    set_request_user(user_id)
     db = get_db()
     user = await db.users.find_one({"_id": ObjectId(user_id)})
     if not user:
@@ -52,6 +54,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
     return User(**transform_user_data(user))
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
 @router.post("/register", response_model=dict)
 async def register(user_data: UserCreate):
     db = get_db()
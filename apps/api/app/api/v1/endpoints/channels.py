@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from typing import List
 from datetime import datetime
 from bson import ObjectId
 
 from app.core.database import get_db
-from app.models.channel import ChannelCreate, Channel, ChannelUpdate
+from app.core.http_cache import conditional, digest_etag, weak_etag
+from app.core.read_routing import get_read_db
+from app.core.singleflight import channel_reads, read_key
+from app.crud.archive import delete_channel_archive
+from app.crud.notifications import delete_channel_notifications
+from app.models.channel import ChannelCreate, Channel, ChannelUpdate, ChannelUnread, ReadMarkerUpdate
 from app.models.user import User
 from app.api.v1.endpoints.auth import get_current_user
+from app.crud.read_state import get_unread_counts, read_markers
+from app.crud.sync import allocate_rev, delete_channel_tombstones
 
 router = APIRouter()
 
@@ -17,17 +24,33 @@ def transform_channel_data(channel_data):
     channel_dict["created_by"] = str(channel_dict["created_by"])
     return channel_dict
 
-@router.get("/", response_model=List[Channel])
-async def get_channels(current_user: User = Depends(get_current_user)):
-    db = get_db()
+async def list_channels(db) -> List[Channel]:
+    """Channels with their message counts"""
     channels = []
-    async for channel in db.channels.find():
+    for channel in await db.channels.find({}, {"gap_seqs": 0}).to_list(None):
         # Get message count
         message_count = await db.messages.count_documents({"channel_id": str(channel["_id"])})
-        channel["message_count"] = message_count
+        channel["message_count"] = message_count + channel.get("archived_count", 0)
         channels.append(Channel(**transform_channel_data(channel)))
     return channels
 
+@router.get("/", response_model=List[Channel])
+async def get_channels(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    db = await get_read_db("get_channels", current_user.id)
+    # Revalidation only reads versions; full documents are loaded on a miss
+    versions = await db.channels.find({}, {"version": 1}).to_list(None)
+    etag = digest_etag("l", sorted((str(channel["_id"]), channel.get("version", 0)) for channel in versions))
+    not_modified = conditional(request, response, etag, "get_channels")
+    if not_modified:
+        return not_modified
+    
+    # Identical concurrent listings share one read and one round of message counts
+    return await channel_reads.do(read_key(db, etag), lambda: list_channels(db))
+
 @router.post("/", response_model=Channel)
 async def create_channel(
     channel_data: ChannelCreate,
@@ -55,12 +78,49 @@ async def create_channel(
     
     return Channel(**transform_channel_data(channel_dict))
 
+@router.get("/unread", response_model=List[ChannelUnread])
+async def get_unread(current_user: User = Depends(get_current_user)):
+    """Unread and mention counts for every channel"""
+    db = await get_read_db("get_unread", current_user.id)
+    counts = await get_unread_counts(db, current_user.id)
+    return [ChannelUnread(**count) for count in counts]
+
+@router.put("/{channel_id}/read")
+async def mark_read(
+    channel_id: str,
+    marker: ReadMarkerUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    db = get_db()
+    
+    if not ObjectId.is_valid(channel_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid channel ID"
+        )
+    
+    channel = await db.channels.find_one({"_id": ObjectId(channel_id)}, {"last_seq": 1})
+    if not channel:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Channel not found"
+        )
+    
+    # Never mark past the newest message
+    last_seq = channel.get("last_seq", 0)
+    seq = last_seq if marker.seq is None else max(0, min(marker.seq, last_seq))
+    read_markers.mark(current_user.id, channel_id, seq)
+    
+    return {"channel_id": channel_id, "last_read_seq": seq}
+
 @router.get("/{channel_id}", response_model=Channel)
 async def get_channel(
     channel_id: str,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
-    db = get_db()
+    db = await get_read_db("get_channel", current_user.id)
     
     if not ObjectId.is_valid(channel_id):
         raise HTTPException(
@@ -68,7 +128,18 @@ async def get_channel(
             detail="Invalid channel ID"
         )
     
-    channel = await db.channels.find_one({"_id": ObjectId(channel_id)})
+    version = await db.channels.find_one({"_id": ObjectId(channel_id)}, {"version": 1})
+    if not version:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Channel not found"
+        )
+    
+    not_modified = conditional(request, response, weak_etag("c", version.get("version", 0)), "get_channel")
+    if not_modified:
+        return not_modified
+    
+    channel = await db.channels.find_one({"_id": ObjectId(channel_id)}, {"gap_seqs": 0})
     if not channel:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -77,7 +148,7 @@ async def get_channel(
     
     # Get message count
     message_count = await db.messages.count_documents({"channel_id": channel_id})
-    channel["message_count"] = message_count
+    channel["message_count"] = message_count + channel.get("archived_count", 0)
     
     return Channel(**transform_channel_data(channel))
 
@@ -112,16 +183,17 @@ async def update_channel(
     # Update channel
     update_data = channel_data.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.utcnow()
+    update_data["meta_rev"] = (await allocate_rev(db, channel_id))["rev"]
     
     await db.channels.update_one(
         {"_id": ObjectId(channel_id)},
-        {"$set": update_data}
+        {"$set": update_data, "$inc": {"version": 1}}
     )
     
     # Get updated channel
     updated_channel = await db.channels.find_one({"_id": ObjectId(channel_id)})
     message_count = await db.messages.count_documents({"channel_id": channel_id})
-    updated_channel["message_count"] = message_count
+    updated_channel["message_count"] = message_count + updated_channel.get("archived_count", 0)
     
     return Channel(**transform_channel_data(updated_channel))
 
@@ -152,8 +224,12 @@ async def delete_channel(
             detail="Only channel creator can delete channel"
         )
     
-    # Delete channel and all its messages
+    # Delete channel, all its messages (hot and archived), everyone's read markers and notifications
     await db.channels.delete_one({"_id": ObjectId(channel_id)})
     await db.messages.delete_many({"channel_id": channel_id})
+    await db.read_markers.delete_many({"channel_id": channel_id})
+    await delete_channel_archive(db, channel_id)
+    await delete_channel_tombstones(db, channel_id)
+    await delete_channel_notifications(db, channel_id)
     
     return {"message": "Channel deleted successfully"} 
\ No newline at end of file
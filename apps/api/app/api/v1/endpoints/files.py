@@ -1,48 +1,77 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import StreamingResponse
-from minio import Minio
+from fastapi import APIRouter, Depends, HTTPException, Request, status, UploadFile, File
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from minio.error import S3Error
-import io
-import uuid
-from typing import List
+from typing import List, Optional
 import logging
 
 from app.core.config import settings
+from app.core.database import get_db
+from app.core.storage import get_minio_client
+from app.core.thumbnails import (
+    THUMBNAIL_CONTENT_TYPE, THUMBNAIL_PREFIX, delete_thumbnails, thumbnail_key, thumbnails, wants_thumbnails
+)
+from app.crud.archive import ARCHIVE_PREFIX
+from app.crud.files import (
+    BLOB_PREFIX, UploadTooLarge, add_reference, blob_key, create_file, delete_file_record, get_file,
+    has_thumbnails, mark_thumbnails, read_upload, release_blob, store_blob, unique_stored_filename, uploads_total
+)
+from app.crud.uploads import UPLOAD_PREFIX, abort_session, complete_session, create_session, get_session, put_part, received_parts
+from app.models.file import FileLink, UploadSessionCreate
 from app.models.user import User
 from app.api.v1.endpoints.auth import get_current_user
+from app.core.ratelimit import rate_limit
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Lazy MinIO client initialization
-_minio_client = None
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
-def get_minio_client():
-    """Get or create MinIO client with lazy initialization"""
-    global _minio_client
-    if _minio_client is None:
-        try:
-            _minio_client = Minio(
-                settings.minio_endpoint,
-                access_key=settings.minio_access_key,
-                secret_key=settings.minio_secret_key,
-                secure=False  # Set to True for HTTPS
-            )
-            
-            # Ensure bucket exists
-            if not _minio_client.bucket_exists(settings.minio_bucket):
-                _minio_client.make_bucket(settings.minio_bucket)
-                logger.info(f"Created MinIO bucket: {settings.minio_bucket}")
-        except Exception as e:
-            logger.error(f"Failed to initialize MinIO client: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="File storage service is not available"
-            )
-    
-    return _minio_client
+def file_info(document, thumbnail_urls=None):
+    stored_filename = document["stored_filename"]
+    return {
+        "filename": document["filename"],
+        "stored_filename": stored_filename,
+        "sha256": document["sha256"],
+        "size": document["size"],
+        "content_type": document["content_type"],
+        "download_url": f"/api/v1/files/download/{stored_filename}",
+        "thumbnail_urls": thumbnail_urls or {},
+        "uploaded_by": document["uploaded_by"]
+    }
 
-@router.post("/upload")
+def thumbnail_urls(stored_filename: str, content_type):
+    if not (settings.thumbnails_enabled and wants_thumbnails(content_type)):
+        return {}
+    return {str(size): f"/api/v1/files/{stored_filename}/thumb/{size}" for size in settings.thumbnail_sizes}
+
+async def schedule_thumbnails(db, document, data: Optional[bytes] = None):
+    """Thumbnail URLs for a new file, queueing the render unless its content already has thumbnails
+
+    Renders happen once per content hash. A render that was dropped or failed leaves the blob
+    unmarked, so the next file referencing the same content queues it again.
+    """
+    digest = document["sha256"]
+    urls = thumbnail_urls(document["stored_filename"], document["content_type"])
+    if not urls or await has_thumbnails(db, digest):
+        return urls
+    if data is None and document["size"] > settings.thumbnail_max_source_bytes:
+        return {}
+    queued = thumbnails.enqueue(
+        digest, data, document["content_type"], source=blob_key(digest),
+        on_stored=lambda: mark_thumbnails(get_db(), digest)
+    )
+    return urls if queued else {}
+
+def content_name(document, filename: str) -> str:
+    """Content hash of a file; files from before content addressing are stored under their own name"""
+    return (document.get("sha256") or filename) if document else filename
+
+def object_name(document, filename: str) -> str:
+    return blob_key(document["sha256"]) if document and document.get("sha256") else filename
+
+@router.post("/upload", dependencies=[Depends(rate_limit("upload_file"))])
 async def upload_file(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
@@ -50,42 +79,39 @@ async def upload_file(
     """Upload a file to MinIO"""
     
     # Validate file size (10MB limit)
-    if file.size and file.size > 10 * 1024 * 1024:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File size too large. Maximum size is 10MB."
-        )
+    too_large = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="File size too large. Maximum size is 10MB."
+    )
+    if file.size and file.size > MAX_UPLOAD_BYTES:
+        raise too_large
     
     # Generate unique filename
-    file_extension = file.filename.split('.')[-1] if '.' in file.filename else ''
-    unique_filename = f"{uuid.uuid4()}.{file_extension}" if file_extension else str(uuid.uuid4())
+    unique_filename = unique_stored_filename(file.filename)
     
-    # Read file content
-    file_content = await file.read()
+    # Read file content, hashing it on the way in
+    try:
+        file_content, digest = await read_upload(file, MAX_UPLOAD_BYTES)
+    except UploadTooLarge:
+        raise too_large
     
     try:
-        minio_client = get_minio_client()
+        db = get_db()
         
-        # Upload to MinIO
-        minio_client.put_object(
-            bucket_name=settings.minio_bucket,
-            object_name=unique_filename,
-            data=io.BytesIO(file_content),
-            length=len(file_content),
-            content_type=file.content_type
-        )
+        # Upload to MinIO unless the same content is already stored
+        deduplicated = await store_blob(db, digest, file_content, file.content_type)
+        try:
+            document = await create_file(
+                db, unique_filename, file.filename, digest, len(file_content), file.content_type, current_user.id
+            )
+        except Exception:
+            await release_blob(db, digest)
+            raise
         
-        # Generate download URL
-        download_url = f"/api/v1/files/download/{unique_filename}"
+        # Previews are rendered in the background, once per content
+        urls = await schedule_thumbnails(db, document, file_content)
         
-        return {
-            "filename": file.filename,
-            "stored_filename": unique_filename,
-            "size": len(file_content),
-            "content_type": file.content_type,
-            "download_url": download_url,
-            "uploaded_by": current_user.id
-        }
+        return {**file_info(document, urls), "deduplicated": deduplicated}
         
     except S3Error as e:
         logger.error(f"MinIO upload error: {e}")
@@ -100,6 +126,139 @@ async def upload_file(
             detail="Failed to upload file"
         )
 
+@router.post("/link", dependencies=[Depends(rate_limit("upload_file"))])
+async def link_file(
+    link: FileLink,
+    current_user: User = Depends(get_current_user)
+):
+    """Share content that is already stored by its SHA-256, without sending the bytes again
+    
+    Every signed-in user can already read every file, so knowing a hash grants nothing new.
+    """
+    
+    db = get_db()
+    digest = link.sha256.lower()
+    blob = await add_reference(db, digest)
+    if not blob:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Content not stored, upload it instead"
+        )
+    uploads_total.inc(("linked",))
+    
+    unique_filename = unique_stored_filename(link.filename)
+    content_type = link.content_type or blob["content_type"]
+    document = await create_file(db, unique_filename, link.filename, digest, blob["size"], content_type, current_user.id)
+    return {**file_info(document, await schedule_thumbnails(db, document)), "deduplicated": True}
+
+def session_info(session, parts):
+    return {
+        "status": "uploading",
+        "upload_id": session["id"],
+        "chunk_size": session["chunk_size"],
+        "parts": session["parts"],
+        "parts_received": sorted(parts),
+        "expires_in": settings.upload_session_ttl_seconds
+    }
+
+@router.post("/uploads", dependencies=[Depends(rate_limit("upload_file"))])
+async def create_upload(
+    upload: UploadSessionCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Start a resumable upload; the response says how to split the file into parts"""
+    
+    if upload.sha256:
+        db = get_db()
+        digest = upload.sha256.lower()
+        blob = await add_reference(db, digest)
+        if blob:
+            uploads_total.inc(("linked",))
+            document = await create_file(
+                db, unique_stored_filename(upload.filename), upload.filename, digest, blob["size"],
+                upload.content_type or blob["content_type"], current_user.id
+            )
+            return {
+                "status": "complete", "file": file_info(document, await schedule_thumbnails(db, document)),
+                "deduplicated": True
+            }
+    
+    session = await create_session(
+        current_user.id, upload.filename, upload.content_type, upload.size, upload.sha256
+    )
+    return session_info(session, {})
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Which parts have arrived, so an interrupted client only sends the rest"""
+    session = await get_session(upload_id, current_user.id)
+    return session_info(session, await received_parts(upload_id))
+
+@router.put("/uploads/{upload_id}/parts/{part_number}")
+async def upload_part(
+    upload_id: str,
+    part_number: int,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Store one part (the raw request body); parts may be sent in parallel and in any order"""
+    session = await get_session(upload_id, current_user.id)
+    
+    # Never buffer more than one chunk, whatever the client sends
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > session["chunk_size"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Parts are at most {session['chunk_size']} bytes"
+            )
+        chunks.append(chunk)
+    
+    try:
+        etag = await put_part(session, part_number, b"".join(chunks))
+    except S3Error as e:
+        logger.error(f"MinIO part upload error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to upload part: {str(e)}"
+        )
+    return {"part": part_number, "etag": etag}
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Assemble the parts into a file"""
+    session = await get_session(upload_id, current_user.id)
+    db = get_db()
+    try:
+        document, deduplicated = await complete_session(db, session)
+    except S3Error as e:
+        logger.error(f"MinIO complete upload error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to complete upload: {str(e)}"
+        )
+    return {
+        "status": "complete", "file": file_info(document, await schedule_thumbnails(db, document)),
+        "deduplicated": deduplicated
+    }
+
+@router.delete("/uploads/{upload_id}")
+async def cancel_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    session = await get_session(upload_id, current_user.id)
+    await abort_session(session)
+    return {"message": "Upload cancelled"}
+
 @router.get("/download/{filename}")
 async def download_file(
     filename: str,
@@ -109,20 +268,31 @@ async def download_file(
     
     try:
         minio_client = get_minio_client()
+        document = await get_file(get_db(), filename)
         
-        # Get object from MinIO
-        obj = minio_client.get_object(settings.minio_bucket, filename)
+        # Get object info for content type
+        if document:
+            content_type, size = document["content_type"], document["size"]
+        else:
+            obj_stat = await run_in_threadpool(minio_client.stat_object, settings.minio_bucket, filename)
+            content_type, size = obj_stat.content_type, obj_stat.size
         
-        # Read object data
-        data = obj.read()
+        # Get object from MinIO
+        obj = await run_in_threadpool(minio_client.get_object, settings.minio_bucket, object_name(document, filename))
         
-        # Get object info for content type
-        obj_stat = minio_client.stat_object(settings.minio_bucket, filename)
+        async def body():
+            # Files can be gigabytes: relay them chunk by chunk, then hand the pooled connection back
+            try:
+                async for chunk in iterate_in_threadpool(obj.stream(DOWNLOAD_CHUNK_SIZE)):
+                    yield chunk
+            finally:
+                obj.close()
+                obj.release_conn()
         
         return StreamingResponse(
-            io.BytesIO(data),
-            media_type=obj_stat.content_type,
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            body(),
+            media_type=content_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}", "Content-Length": str(size)}
         )
         
     except S3Error as e:
@@ -144,18 +314,66 @@ async def download_file(
             detail="Failed to download file"
         )
 
+@router.get("/{filename}/thumb/{size}")
+async def get_thumbnail(
+    filename: str,
+    size: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Serve a rendered thumbnail; 404 until it has been generated"""
+    
+    if size not in settings.thumbnail_sizes:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Unknown thumbnail size"
+        )
+    
+    try:
+        minio_client = get_minio_client()
+        name = content_name(await get_file(get_db(), filename), filename)
+        obj = await run_in_threadpool(minio_client.get_object, settings.minio_bucket, thumbnail_key(name, size))
+        try:
+            data = await run_in_threadpool(obj.read)
+        finally:
+            obj.close()
+            obj.release_conn()
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Thumbnail not found"
+            )
+        logger.error(f"MinIO thumbnail error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get thumbnail: {str(e)}"
+        )
+    
+    # Stored filenames are unique and never rewritten, so thumbnails never change
+    return Response(
+        content=data,
+        media_type=THUMBNAIL_CONTENT_TYPE,
+        headers={"Cache-Control": f"private, max-age={settings.thumbnail_cache_seconds}, immutable"}
+    )
+
 @router.delete("/{filename}")
 async def delete_file(
     filename: str,
     current_user: User = Depends(get_current_user)
 ):
-    """Delete a file from MinIO"""
+    """Delete a file; its content goes from MinIO with the last file referencing it"""
     
     try:
-        minio_client = get_minio_client()
-        
-        # Delete object from MinIO
-        minio_client.remove_object(settings.minio_bucket, filename)
+        db = get_db()
+        document = await delete_file_record(db, filename)
+        if document and document.get("sha256"):
+            if await release_blob(db, document["sha256"]):
+                await delete_thumbnails(document["sha256"])
+        else:
+            # Uploaded before content addressing
+            minio_client = get_minio_client()
+            await run_in_threadpool(minio_client.remove_object, settings.minio_bucket, filename)
+            await delete_thumbnails(filename)
         
         return {"message": "File deleted successfully"}
         
@@ -183,27 +401,43 @@ async def list_files(
     current_user: User = Depends(get_current_user),
     limit: int = 50
 ):
-    """List files in MinIO bucket"""
+    """List uploaded files, newest first, then files from before content addressing"""
     
     try:
+        files = [
+            {
+                "filename": document["stored_filename"],
+                "size": document["size"],
+                "last_modified": document["created_at"].isoformat()
+            }
+            async for document in get_db().files.find().sort("created_at", -1).limit(limit)
+        ]
+        if len(files) >= limit:
+            return {"files": files, "total": len(files)}
+        
         minio_client = get_minio_client()
         
-        objects = minio_client.list_objects(settings.minio_bucket, recursive=True)
-        
-        files = []
-        count = 0
-        for obj in objects:
-            if count >= limit:
-                break
-                
-            files.append({
-                "filename": obj.object_name,
-                "size": obj.size,
-                "last_modified": obj.last_modified.isoformat() if obj.last_modified else None
-            })
-            count += 1
-        
-        return {"files": files, "total": count}
+        def collect_files():
+            # list_objects pages lazily over HTTP, so iterate off the event loop
+            objects = minio_client.list_objects(settings.minio_bucket, recursive=True)
+            
+            for obj in objects:
+                if len(files) >= limit:
+                    break
+                # Content blobs, thumbnails, upload parts and archived messages live in the same bucket
+                derived = (BLOB_PREFIX, THUMBNAIL_PREFIX, UPLOAD_PREFIX, ARCHIVE_PREFIX)
+                if obj.object_name.startswith(tuple(f"{prefix}/" for prefix in derived)):
+                    continue
+                    
+                files.append({
+                    "filename": obj.object_name,
+                    "size": obj.size,
+                    "last_modified": obj.last_modified.isoformat() if obj.last_modified else None
+                })
+        
+        await run_in_threadpool(collect_files)
+        
+        return {"files": files, "total": len(files)}
         
     except S3Error as e:
         logger.error(f"MinIO list error: {e}")
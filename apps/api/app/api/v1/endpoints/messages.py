@@ -1,12 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from typing import List
 from datetime import datetime
 from bson import ObjectId
 
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.group_commit import message_committer, messages_collection
+from app.core.http_cache import conditional, json_response, weak_etag
+from app.core.read_routing import get_read_db
+from app.core.singleflight import history_reads, read_key
+from app.crud.archive import read_archived
 from app.models.message import MessageCreate, Message, MessageUpdate, ReactionCreate
+from app.models.records import MessageRecord, UserRef, encode
 from app.models.user import User
 from app.api.v1.endpoints.auth import get_current_user
+from app.core.ratelimit import rate_limit
+from app.crud.notifications import queue_mentions
+from app.crud.read_state import add_gap_seqs, bump_channel_version, read_markers
+from app.crud.sync import allocate_rev, record_deletions
 
 router = APIRouter()
 
@@ -16,14 +27,65 @@ def transform_message_data(message_data):
     message_dict["id"] = str(message_dict.pop("_id"))
     return message_dict
 
+async def message_rev(db, message) -> dict:
+    """Take a rev in the message's channel for a change to it"""
+    revision = await allocate_rev(db, message["channel_id"])
+    if revision is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Channel not found"
+        )
+    return revision
+
+async def load_history(db, channel_id: str, skip: int, limit: int, archived_count: int) -> List[MessageRecord]:
+    """A page of history with authors and threads, oldest first"""
+    cursor = db.messages.find({"channel_id": channel_id}).sort("created_at", -1).skip(skip).limit(limit)
+    page = [(message, []) async for message in cursor]
+    
+    # Continue into the archive once the page runs past the hot tier
+    if len(page) < limit and archived_count:
+        hot_total = skip + len(page) if page else await db.messages.count_documents({"channel_id": channel_id})
+        page.extend(await read_archived(db, channel_id, max(0, skip - hot_total), limit - len(page)))
+    
+    # Authors repeat within a page; look each one up once
+    authors = {}
+    
+    async def author(user_id):
+        if user_id not in authors:
+            user = await db.users.find_one({"_id": user_id})
+            authors[user_id] = UserRef.from_document(user) if user else None
+        return authors[user_id]
+    
+    messages = []
+    for message, archived_replies in page:
+        # Get thread messages if any
+        thread_messages = []
+        thread_cursor = db.messages.find({"thread_id": message["_id"]}).sort("created_at", 1)
+        replies = archived_replies + [thread_msg async for thread_msg in thread_cursor]
+        for thread_msg in replies:
+            thread_user = await author(thread_msg["user_id"])
+            if thread_user:
+                thread_messages.append(MessageRecord.from_document(thread_msg, thread_user))
+        
+        messages.append(MessageRecord.from_document(message, await author(message["user_id"]), thread_messages))
+    
+    # Reverse to get chronological order
+    messages.reverse()
+    return messages
+
+async def render_history(db, channel_id: str, skip: int, limit: int, archived_count: int) -> bytes:
+    return encode(await load_history(db, channel_id, skip, limit, archived_count))
+
 @router.get("/channels/{channel_id}/messages", response_model=List[Message])
 async def get_messages(
     channel_id: str,
+    request: Request,
+    response: Response,
     limit: int = 50,
     skip: int = 0,
     current_user: User = Depends(get_current_user)
 ):
-    db = get_db()
+    db = await get_read_db("get_messages", current_user.id)
     
     if not ObjectId.is_valid(channel_id):
         raise HTTPException(
@@ -32,48 +94,30 @@ async def get_messages(
         )
     
     # Check if channel exists
-    channel = await db.channels.find_one({"_id": ObjectId(channel_id)})
+    channel = await db.channels.find_one({"_id": ObjectId(channel_id)}, {"version": 1, "archived_count": 1})
     if not channel:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Channel not found"
         )
     
-    # Get messages with user data
-    messages = []
-    cursor = db.messages.find({"channel_id": channel_id}).sort("created_at", -1).skip(skip).limit(limit)
-    
-    async for message in cursor:
-        # Get user data
-        user = await db.users.find_one({"_id": message["user_id"]})
-        if user:
-            message["user"] = {
-                "id": str(user["_id"]),
-                "username": user["username"],
-                "avatar": user.get("avatar")
-            }
-        
-        # Get thread messages if any
-        thread_messages = []
-        thread_cursor = db.messages.find({"thread_id": message["_id"]}).sort("created_at", 1)
-        async for thread_msg in thread_cursor:
-            thread_user = await db.users.find_one({"_id": thread_msg["user_id"]})
-            if thread_user:
-                thread_msg["user"] = {
-                    "id": str(thread_user["_id"]),
-                    "username": thread_user["username"],
-                    "avatar": thread_user.get("avatar")
-                }
-                thread_messages.append(Message(**transform_message_data(thread_msg)))
-        
-        message["thread"] = thread_messages
-        messages.append(Message(**transform_message_data(message)))
+    etag = weak_etag("m", channel.get("version", 0), skip, limit)
+    not_modified = conditional(request, response, etag, "get_messages")
+    if not_modified:
+        return not_modified
     
-    # Reverse to get chronological order
-    messages.reverse()
-    return messages
+    # Identical concurrent page reads share one set of queries and one encoded body
+    key = read_key(db, channel_id, channel.get("version", 0), skip, limit)
+    body = await history_reads.do(
+        key, lambda: render_history(db, channel_id, skip, limit, channel.get("archived_count", 0))
+    )
+    return json_response(body, response)
 
-@router.post("/channels/{channel_id}/messages", response_model=Message)
+@router.post(
+    "/channels/{channel_id}/messages",
+    response_model=Message,
+    dependencies=[Depends(rate_limit("create_message"))]
+)
 async def create_message(
     channel_id: str,
     message_data: MessageCreate,
@@ -87,24 +131,42 @@ async def create_message(
             detail="Invalid channel ID"
         )
     
-    # Check if channel exists
-    channel = await db.channels.find_one({"_id": ObjectId(channel_id)})
-    if not channel:
+    # Allocating the seq doubles as the channel existence check
+    revision = await allocate_rev(db, channel_id, message_seq=True)
+    if revision is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Channel not found"
         )
+    seq = revision["seq"]
     
     # Create message
     message_dict = message_data.dict()
     message_dict["channel_id"] = channel_id
+    message_dict["seq"] = seq
+    message_dict["rev"] = revision["rev"]
+    message_dict["rev_at"] = revision["rev_at"]
     message_dict["user_id"] = ObjectId(current_user.id)
     message_dict["created_at"] = datetime.utcnow()
     message_dict["updated_at"] = datetime.utcnow()
     message_dict["reactions"] = []
     
-    result = await db.messages.insert_one(message_dict)
-    message_dict["_id"] = result.inserted_id
+    try:
+        if settings.group_commit_enabled:
+            message_dict["_id"] = await message_committer.insert(message_dict)
+        else:
+            result = await messages_collection().insert_one(message_dict)
+            message_dict["_id"] = result.inserted_id
+    except Exception:
+        # The seq is spent; it must not count as unread forever
+        await add_gap_seqs(db, channel_id, [seq])
+        raise
+    await bump_channel_version(db, channel_id)
+    
+    # The author has read their own message
+    read_markers.mark(current_user.id, channel_id, seq)
+    # Mention fan-out runs in the notification worker
+    await queue_mentions(channel_id, str(message_dict["_id"]), seq, current_user.id, message_data.content)
     message_dict["user"] = {
         "id": current_user.id,
         "username": current_user.username,
@@ -114,7 +176,11 @@ async def create_message(
     
     return Message(**transform_message_data(message_dict))
 
-@router.post("/messages/{message_id}/reactions", response_model=Message)
+@router.post(
+    "/messages/{message_id}/reactions",
+    response_model=Message,
+    dependencies=[Depends(rate_limit("add_reaction"))]
+)
 async def add_reaction(
     message_id: str,
     reaction_data: ReactionCreate,
@@ -168,10 +234,12 @@ async def add_reaction(
         message["reactions"].append(new_reaction)
     
     # Update message
+    revision = await message_rev(db, message)
     await db.messages.update_one(
         {"_id": ObjectId(message_id)},
-        {"$set": {"reactions": message["reactions"]}}
+        {"$set": {"reactions": message["reactions"], "rev": revision["rev"], "rev_at": revision["rev_at"]}}
     )
+    await bump_channel_version(db, message["channel_id"])
     
     # Get updated message with user data
     updated_message = await db.messages.find_one({"_id": ObjectId(message_id)})
@@ -218,11 +286,15 @@ async def update_message(
     # Update message
     update_data = message_data.dict()
     update_data["updated_at"] = datetime.utcnow()
+    revision = await message_rev(db, message)
+    update_data["rev"] = revision["rev"]
+    update_data["rev_at"] = revision["rev_at"]
     
     await db.messages.update_one(
         {"_id": ObjectId(message_id)},
         {"$set": update_data}
     )
+    await bump_channel_version(db, message["channel_id"])
     
     # Get updated message
     updated_message = await db.messages.find_one({"_id": ObjectId(message_id)})
@@ -265,12 +337,18 @@ async def delete_message(
             detail="Only message author can delete message"
         )
     
-    # Delete message and its thread
-    await db.messages.delete_many({
+    # Delete message and its thread, leaving tombstones for /sync
+    revision = await message_rev(db, message)
+    query = {
         "$or": [
             {"_id": ObjectId(message_id)},
             {"thread_id": ObjectId(message_id)}
         ]
-    })
+    }
+    deleted = await db.messages.find(query, {"_id": 1, "seq": 1}).to_list(None)
+    await db.messages.delete_many(query)
+    await record_deletions(db, message["channel_id"], [doc["_id"] for doc in deleted], revision)
+    await add_gap_seqs(db, message["channel_id"], [doc.get("seq") for doc in deleted])
+    await bump_channel_version(db, message["channel_id"])
     
     return {"message": "Message deleted successfully"} 
\ No newline at end of file
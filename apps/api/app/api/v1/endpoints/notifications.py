@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends, Query
+from typing import List
+
+from app.core.read_routing import get_read_db
+from app.crud.notifications import get_notifications
+from app.models.notification import Notification
+from app.models.user import User
+from app.api.v1.endpoints.auth import get_current_user
+
+router = APIRouter()
+
+@router.get("/", response_model=List[Notification])
+async def list_notifications(
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user)
+):
+    """The user's most recent mentions, newest first"""
+    db = await get_read_db("get_notifications", current_user.id)
+    notifications = await get_notifications(db, current_user.id, limit)
+    return [Notification(id=str(document.pop("_id")), **document) for document in notifications]
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends
+
+from app.core.read_routing import get_read_db
+from app.crud.sync import changes_since
+from app.models.sync import SyncRequest
+from app.models.user import User
+from app.api.v1.endpoints.auth import get_current_user
+
+router = APIRouter()
+
+@router.post("/")
+async def sync(
+    sync_request: SyncRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Everything that changed since the client's per-channel cursors"""
+    db = await get_read_db("sync", current_user.id)
+    return await changes_since(db, sync_request.channels)
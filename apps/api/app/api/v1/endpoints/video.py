@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
-from typing import Optional
-import jwt
-import time
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import BaseModel, Field
+from typing import List
+import httpx
+import logging
 
-from app.core.config import settings
+from app.core.livekit import (
+    WebhookError, channel_for_room, room_index, room_name, room_service, verify_webhook, video_tokens
+)
 from app.models.user import User
 from app.api.v1.endpoints.auth import get_current_user
+from app.websocket.manager import manager
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -15,6 +20,9 @@ class TokenRequest(BaseModel):
     user_id: str
     username: str
 
+class TokenBatchRequest(BaseModel):
+    channel_ids: List[str] = Field(..., min_length=1, max_length=100)
+
 class RoomRequest(BaseModel):
     channel_id: str
     name: str
@@ -34,36 +42,39 @@ async def get_video_token(
         )
     
     # Create room name from channel ID
-    room_name = f"channel_{token_request.channel_id}"
+    name = room_name(token_request.channel_id)
+    token, expires_at = video_tokens.issue(token_request.user_id, token_request.username, name)
     
-    # Create JWT payload for LiveKit
-    now = int(time.time())
-    payload = {
-        "iss": settings.livekit_api_key,
-        "sub": token_request.user_id,
-        "nbf": now,
-        "exp": now + 3600,  # 1 hour
-        "video": {
-            "room": room_name,
-            "roomJoin": True,
-            "canPublish": True,
-            "canSubscribe": True,
-            "canPublishData": True
-        }
+    return {
+        "token": token,
+        "room_name": name,
+        "identity": token_request.user_id,
+        "name": token_request.username,
+        "expires_at": expires_at
     }
+
+@router.post("/tokens")
+async def get_video_tokens(
+    batch: TokenBatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Generate LiveKit access tokens for several channels at once"""
     
-    # Generate token using PyJWT
-    token = jwt.encode(
-        payload,
-        settings.livekit_api_secret,
-        algorithm="HS256"
-    )
+    tokens = []
+    for channel_id in dict.fromkeys(batch.channel_ids):
+        name = room_name(channel_id)
+        token, expires_at = video_tokens.issue(current_user.id, current_user.username, name)
+        tokens.append({
+            "channel_id": channel_id,
+            "token": token,
+            "room_name": name,
+            "expires_at": expires_at
+        })
     
     return {
-        "token": token,
-        "room_name": room_name,
-        "identity": token_request.user_id,
-        "name": token_request.username
+        "identity": current_user.id,
+        "name": current_user.username,
+        "tokens": tokens
     }
 
 @router.post("/room")
@@ -73,14 +84,18 @@ async def create_room(
 ):
     """Create a LiveKit room for a channel"""
     
-    room_name = f"channel_{room_request.channel_id}"
-    
-    # Create room using LiveKit API
-    # Note: In a real implementation, you would use the LiveKit API to create rooms
-    # For now, we'll just return success as LiveKit creates rooms automatically
+    name = room_name(room_request.channel_id)
+    try:
+        await room_service("CreateRoom", name, {"name": name})
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to create room {name}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Video server unavailable"
+        )
     
     return {
-        "room_name": room_name,
+        "room_name": name,
         "channel_id": room_request.channel_id,
         "created_by": current_user.id,
         "status": "created"
@@ -93,13 +108,24 @@ async def delete_room(
 ):
     """Delete a LiveKit room for a channel"""
     
-    room_name = f"channel_{channel_id}"
-    
-    # Delete room using LiveKit API
-    # Note: In a real implementation, you would use the LiveKit API to delete rooms
+    name = room_name(channel_id)
+    try:
+        await room_service("DeleteRoom", name, {"room": name})
+    except httpx.HTTPError as e:
+        # Already gone (or never started) is fine
+        missing = isinstance(e, httpx.HTTPStatusError) and e.response.status_code == status.HTTP_404_NOT_FOUND
+        if not missing:
+            logger.error(f"Failed to delete room {name}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Video server unavailable"
+            )
+    # The room_finished webhook would do the same; clear the index now so the call ends immediately
+    await room_index.forget(name)
+    await push_call_state(name, 0)
     
     return {
-        "room_name": room_name,
+        "room_name": name,
         "channel_id": channel_id,
         "deleted_by": current_user.id,
         "status": "deleted"
@@ -110,15 +136,55 @@ async def get_room_participants(
     channel_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    """Get participants in a LiveKit room"""
-    
-    room_name = f"channel_{channel_id}"
+    """Get participants in a LiveKit room (from the webhook-fed index)"""
     
-    # Get participants using LiveKit API
-    # Note: In a real implementation, you would use the LiveKit API to get participants
+    name = room_name(channel_id)
+    participants = await room_index.participants(name)
     
     return {
-        "room_name": room_name,
+        "room_name": name,
         "channel_id": channel_id,
-        "participants": []  # Placeholder
-    } 
\ No newline at end of file
+        "participants": participants
+    }
+
+@router.get("/rooms")
+async def get_active_rooms(current_user: User = Depends(get_current_user)):
+    """Channels with a call in progress and their participant counts"""
+    
+    rooms = await room_index.active_rooms()
+    return {
+        "rooms": [
+            {"channel_id": channel_for_room(name), "room_name": name, "participant_count": count}
+            for name, count in rooms.items() if channel_for_room(name)
+        ]
+    }
+
+async def push_call_state(name: str, participant_count: int):
+    channel_id = channel_for_room(name)
+    if channel_id:
+        await manager.broadcast_to_channel(channel_id, {
+            "type": "call_updated",
+            "channel_id": channel_id,
+            "room_name": name,
+            "active": participant_count > 0,
+            "participant_count": participant_count,
+        })
+
+@router.post("/webhook", include_in_schema=False)
+async def livekit_webhook(request: Request):
+    """Room and participant events from LiveKit, authenticated by their signature"""
+    
+    body = await request.body()
+    try:
+        event = verify_webhook(body, request.headers.get("authorization"))
+    except WebhookError as e:
+        logger.warning(f"Rejected LiveKit webhook: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid webhook signature"
+        )
+    
+    changed = await room_index.apply(event)
+    if changed:
+        await push_call_state(*changed)
+    return {"status": "ok"}
@@ -4,9 +4,20 @@ from typing import Optional
 class Settings(BaseSettings):
     # Database
     database_url: str = "mongodb://localhost:27017/slack_clone"
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: int = 300000
+    mongo_connect_timeout_ms: int = 5000
+    mongo_socket_timeout_ms: int = 30000
+    mongo_wait_queue_timeout_ms: int = 5000
     
     # Redis
     redis_url: str = "redis://localhost:6379"
+    redis_max_connections: int = 64
+    redis_pool_timeout: float = 5.0
+    redis_socket_timeout: float = 5.0
+    redis_connect_timeout: float = 2.0
+    redis_health_check_interval: int = 30
     
     # JWT
     jwt_secret: str = "your-super-secret-jwt-key-32-bytes-long"
@@ -19,15 +30,156 @@ class Settings(BaseSettings):
     minio_access_key: str = "minioadmin"
     minio_secret_key: str = "minioadmin"
     minio_bucket: str = "slack-clone"
+    minio_num_pools: int = 4
+    minio_max_pool_size: int = 32
+    minio_connect_timeout: float = 5.0
+    minio_read_timeout: float = 60.0
     
     # LiveKit
     livekit_api_key: str = "devkey"
     livekit_api_secret: str = "secret"
     livekit_url: str = "ws://localhost:7880"
+    livekit_api_timeout: float = 5.0
+    video_room_ttl_seconds: int = 24 * 3600
+    video_event_ttl_seconds: int = 3600
+    video_token_ttl_seconds: int = 3600
+    video_token_refresh_seconds: int = 600
+    video_token_cache_size: int = 100000
     
     # CORS
     cors_origins: list = ["http://localhost:3000", "http://localhost:8080"]
     
+    # Message writes (write concern "" keeps the server default)
+    message_write_concern_w: str = ""
+    message_write_concern_j: Optional[bool] = None
+    group_commit_enabled: bool = False
+    group_commit_window_ms: float = 2
+    group_commit_max_batch: int = 256
+    
+    # Read routing (per-endpoint read preference; reads after a user's own write stay consistent)
+    read_routing_enabled: bool = False
+    read_max_staleness_seconds: int = 90
+    read_your_writes_mode: str = "session"  # "session" or "primary"
+    read_your_writes_window_seconds: int = 30
+    read_preference_get_messages: str = "secondaryPreferred"
+    read_preference_get_channels: str = "secondaryPreferred"
+    read_preference_get_channel: str = "secondaryPreferred"
+    read_preference_get_unread: str = "secondaryPreferred"
+    read_preference_sync: str = "primary"  # sync cursors assume writes are visible once settled
+    read_preference_get_notifications: str = "secondaryPreferred"
+    
+    # Message archive (older messages move to compressed segments in MinIO)
+    archive_after_days: int = 90
+    archive_segment_size: int = 1000
+    archive_cache_segments: int = 64
+    
+    # Uploads (content-addressed; retries while the same content is being removed)
+    file_dedup_retries: int = 100
+    
+    # Resumable uploads (5 GiB is the largest object a single server-side copy handles)
+    upload_chunk_size: int = 8 * 1024 * 1024
+    upload_max_bytes: int = 5 * 1024 ** 3
+    upload_session_ttl_seconds: int = 24 * 3600
+    upload_gc_interval_seconds: int = 900
+    
+    # Thumbnails (rendered on a process pool; 0 workers means one per CPU core)
+    thumbnails_enabled: bool = True
+    thumbnail_sizes: list = [64, 320, 960]
+    thumbnail_quality: int = 80
+    thumbnail_workers: int = 2
+    thumbnail_queue_size: int = 32
+    thumbnail_cache_seconds: int = 31536000
+    # Stored content larger than this (e.g. resumable video uploads) is not read back to render previews
+    thumbnail_max_source_bytes: int = 64 * 1024 * 1024
+    ffmpeg_path: str = "ffmpeg"
+    
+    # HTTP caching (ETag revalidation of channel and history reads)
+    http_cache_control: str = "private, no-cache"
+    
+    # Read coalescing (identical concurrent reads share one in-flight query)
+    singleflight_enabled: bool = True
+    
+    # Delta sync (cursors only advance over changes older than the settle window)
+    sync_settle_seconds: int = 30
+    sync_max_changes: int = 500
+    
+    # Read markers
+    read_marker_flush_ms: float = 1000
+    read_marker_max_mentions: int = 100
+    # Seqs per channel left without a message (deleted or failed writes) that unread counts skip
+    read_marker_max_gaps: int = 1000
+    
+    # Background jobs (Redis queues drained by worker processes, e.g. scripts/notification_worker.py)
+    job_visibility_seconds: float = 300
+    job_max_attempts: int = 5
+    job_retry_base_seconds: float = 2.0
+    job_poll_seconds: float = 1.0
+    
+    # Notifications (mention fan-out runs in the notification worker)
+    notification_batch_size: int = 1000
+    notification_claim_size: int = 16
+    notification_preview_chars: int = 200
+    
+    # Production server (serve.py); 0 workers means one per CPU core
+    web_host: str = "0.0.0.0"
+    web_port: int = 8000
+    web_workers: int = 0
+    web_backlog: int = 2048
+    web_keepalive_timeout: int = 5
+    web_forwarded_allow_ips: str = "127.0.0.1"
+    web_access_log: bool = False
+    
+    # WebSocket
+    ws_send_queue_size: int = 256
+    ws_publish_queue_size: int = 10000
+    presence_ttl_seconds: int = 60
+    presence_heartbeat_seconds: int = 20
+    typing_interval_ms: float = 500
+    typing_throttle_ms: float = 2000
+    typing_ttl_seconds: float = 6
+    
+    # Rate limiting ("<requests>/<seconds>", empty to disable a scope)
+    rate_limit_enabled: bool = True
+    rate_limit_local_fraction: float = 0.1
+    rate_limit_lease_seconds: float = 1.0
+    rate_limit_local_max_keys: int = 100000
+    rate_limit_create_message_user: str = "30/10"
+    rate_limit_create_message_channel: str = "500/10"
+    rate_limit_create_message_route: str = ""
+    rate_limit_add_reaction_user: str = "60/10"
+    rate_limit_add_reaction_channel: str = ""
+    rate_limit_add_reaction_route: str = ""
+    rate_limit_upload_file_user: str = "20/60"
+    rate_limit_upload_file_channel: str = ""
+    rate_limit_upload_file_route: str = "1000/60"
+
+    # Load shedding (adaptive concurrency limit shared by all HTTP routes)
+    loadshed_enabled: bool = True
+    loadshed_initial_limit: int = 64
+    loadshed_min_limit: int = 4
+    loadshed_max_limit: int = 512
+    loadshed_backoff: float = 0.9
+    loadshed_max_queue: int = 256
+    loadshed_max_wait_ms: float = 2000
+    loadshed_queue_target_ms: float = 50
+    loadshed_queue_interval_ms: float = 500
+    loadshed_interactive_target_ms: float = 250
+    loadshed_default_target_ms: float = 500
+    loadshed_bulk_target_ms: float = 2000
+    loadshed_large_page: int = 100
+
+    # Metrics (multiprocess: workers share snapshots through Redis so any worker can serve /metrics)
+    metrics_enabled: bool = True
+    metrics_multiprocess: bool = False
+    metrics_snapshot_seconds: int = 5
+    
+    # Profiling
+    profiling_enabled: bool = False
+    profiling_sample_rate: float = 0.01
+    profiling_headers: bool = True
+    profiling_op_budget: int = 20
+    profiling_repeat_threshold: int = 5
+    
     class Config:
         env_file = ".env"
 
@@ -1,26 +1,101 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from typing import Dict
+import threading
 from app.core.config import settings
+from app.core.indexes import check_indexes
+from app.core.metrics import MongoMetricsListener
+from app.core.profiling import MongoCommandListener
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Tracks open, checked-out and waiting connections per server"""
+
+    def __init__(self):
+        self.servers: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _adjust(self, event, field: str, delta: int):
+        address = f"{event.address[0]}:{event.address[1]}"
+        with self._lock:
+            counters = self.servers.setdefault(address, {"open": 0, "checked_out": 0, "waiting": 0})
+            counters[field] += delta
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self.servers.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def connection_created(self, event):
+        self._adjust(event, "open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._adjust(event, "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._adjust(event, "waiting", 1)
+
+    def connection_check_out_failed(self, event):
+        self._adjust(event, "waiting", -1)
+
+    def connection_checked_out(self, event):
+        self._adjust(event, "waiting", -1)
+        self._adjust(event, "checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._adjust(event, "checked_out", -1)
 
 class Database:
     client: AsyncIOMotorClient = None
     db = None
+    pool_listener: MongoPoolListener = None
 
 db = Database()
 
 async def init_db():
-    db.client = AsyncIOMotorClient(settings.database_url)
+    # read_routing builds on get_db, so it is imported here rather than at module level
+    from app.core.read_routing import WriteTimeListener
+
+    db.pool_listener = MongoPoolListener()
+    db.client = AsyncIOMotorClient(
+        settings.database_url,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+        connectTimeoutMS=settings.mongo_connect_timeout_ms,
+        socketTimeoutMS=settings.mongo_socket_timeout_ms,
+        waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+        event_listeners=[MongoCommandListener(), MongoMetricsListener(), WriteTimeListener(), db.pool_listener]
+    )
     db.db = db.client.get_default_database()
     
-    # Create indexes
-    await db.db.users.create_index("email", unique=True)
-    await db.db.users.create_index("username", unique=True)
-    await db.db.channels.create_index("name", unique=True)
-    await db.db.messages.create_index([("channel_id", 1), ("timestamp", -1)])
-    await db.db.messages.create_index("user_id")
+    # Indexes are applied by scripts/migrate_indexes.py; only verify them here
+    await check_indexes(db.db)
 
 async def close_db():
     if db.client:
         db.client.close()
+        db.client = None
+        db.db = None
+
+def mongo_pool_stats() -> dict:
+    if db.pool_listener is None:
+        return {"initialized": False}
+    return {
+        "initialized": True,
+        "max_size": settings.mongo_max_pool_size,
+        "servers": {address: dict(counters) for address, counters in db.pool_listener.servers.items()},
+    }
 
 def get_db():
     return db.db 
\ No newline at end of file
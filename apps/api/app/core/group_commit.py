@@ -0,0 +1,116 @@
+"""
+Group commit for high-rate inserts.
+
+Documents handed to a ``GroupCommitter`` within a short window are written
+with a single unordered ``insert_many``. Ids are assigned client-side, so every
+caller resolves with its own id (or its own write error) exactly as if it had
+called ``insert_one``.
+"""
+import asyncio
+import logging
+from typing import List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.metrics import registry
+from app.core.read_routing import note_write
+
+logger = logging.getLogger(__name__)
+
+group_commit_batch_size = registry.histogram(
+    "group_commit_batch_size", "Documents written per group commit", ("collection",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+
+def message_write_concern() -> Optional[WriteConcern]:
+    """Write concern configured for message inserts, or None for the server default"""
+    w = settings.message_write_concern_w
+    if not w and settings.message_write_concern_j is None:
+        return None
+    kwargs = {}
+    if w:
+        kwargs["w"] = int(w) if w.isdigit() else w
+    if settings.message_write_concern_j is not None:
+        kwargs["j"] = settings.message_write_concern_j
+    return WriteConcern(**kwargs)
+
+def messages_collection():
+    collection = get_db().messages
+    write_concern = message_write_concern()
+    if write_concern is not None:
+        collection = collection.with_options(write_concern=write_concern)
+    return collection
+
+class GroupCommitter:
+    def __init__(self, collection: str, get_collection=None):
+        self.collection = collection
+        self._get_collection = get_collection or (lambda: get_db()[collection])
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def insert(self, document: dict) -> ObjectId:
+        """Queue ``document`` for the next batch and wait for it to be written"""
+        document.setdefault("_id", ObjectId())
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((document, future))
+
+        if len(self._pending) >= settings.group_commit_max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(settings.group_commit_window_ms / 1000, self._start_flush)
+        inserted_id = await future
+        # The batch is written outside this request, so flag it for read-your-writes here
+        note_write()
+        return inserted_id
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        group_commit_batch_size.observe((self.collection,), len(batch))
+        failed = {}
+        try:
+            await self._get_collection().insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = error
+            # Write concern errors leave the outcome of every document unknown
+            if e.details.get("writeConcernErrors"):
+                failed = {index: e for index in range(len(batch))}
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} {self.collection} failed: {e}")
+            failed = {index: e for index in range(len(batch))}
+
+        for index, (document, future) in enumerate(batch):
+            if future.done():
+                # The caller went away; the write itself still happened
+                continue
+            error = failed.get(index)
+            if error is None:
+                future.set_result(document["_id"])
+            elif isinstance(error, Exception):
+                future.set_exception(error)
+            else:
+                future.set_exception(BulkWriteError({"writeErrors": [error]}))
+
+    async def close(self):
+        """Write anything still pending and wait for in-flight batches"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+message_committer = GroupCommitter("messages", messages_collection)
@@ -0,0 +1,59 @@
+"""
+Conditional GETs.
+
+Polled endpoints tag their responses with a weak ETag built from version
+counters they already read (``channels.version``), and answer a matching
+``If-None-Match`` with an empty 304 before counting, hydrating or serializing
+anything. Responses are per user and must be revalidated, so they are sent as
+``private, no-cache``.
+"""
+import hashlib
+from typing import Iterable, Tuple
+
+from fastapi import Request, Response, status
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+not_modified_total = registry.counter(
+    "http_not_modified_total", "Conditional GETs answered with 304 Not Modified", ("endpoint",)
+)
+
+def weak_etag(*parts) -> str:
+    return 'W/"' + ".".join(str(part) for part in parts) + '"'
+
+def digest_etag(prefix: str, versions: Iterable[Tuple[str, int]]) -> str:
+    """A weak ETag for a collection of (id, version) pairs"""
+    hasher = hashlib.blake2b(digest_size=12)
+    for key, version in versions:
+        hasher.update(f"{key}:{version};".encode())
+    return weak_etag(prefix, hasher.hexdigest())
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison against the If-None-Match header"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:]
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": settings.http_cache_control}
+
+def conditional(request: Request, response: Response, etag: str, endpoint: str):
+    """The 304 response if the client's copy is current; otherwise tags ``response`` and returns None"""
+    if etag_matches(request, etag):
+        not_modified_total.inc((endpoint,))
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
+    response.headers.update(cache_headers(etag))
+    return None
+
+def json_response(body: bytes, response: Response) -> Response:
+    """Send pre-encoded JSON with the headers set on the endpoint's injected ``response``.
+
+    FastAPI ignores the injected response once an endpoint returns its own.
+    """
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,205 @@
+"""
+Declarative index registry.
+
+``INDEXES`` lists every index the application relies on and ``QUERIES`` lists
+every query shape issued by the endpoints, so the two can be checked against
+each other. Indexes are applied by ``scripts/migrate_indexes.py``; worker
+startup only verifies them.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever INDEXES or OBSOLETE_INDEXES change
+INDEX_VERSION = 9
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    name: str
+    unique: bool = False
+    options: Dict[str, Any] = {}
+
+    def model(self) -> IndexModel:
+        return IndexModel(self.keys, name=self.name, unique=self.unique, background=True, **self.options)
+
+class QueryShape(NamedTuple):
+    collection: str
+    description: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+
+INDEXES: List[IndexSpec] = [
+    IndexSpec("users", [("email", 1)], "email_1", unique=True),
+    IndexSpec("users", [("username", 1)], "username_1", unique=True),
+    IndexSpec("channels", [("name", 1)], "name_1", unique=True),
+    IndexSpec("messages", [("channel_id", 1), ("created_at", -1)], "channel_id_1_created_at_-1"),
+    IndexSpec(
+        "messages", [("thread_id", 1), ("created_at", 1)], "thread_id_1_created_at_1",
+        options={"partialFilterExpression": {"thread_id": {"$exists": True}}},
+    ),
+    IndexSpec("messages", [("user_id", 1)], "user_id_1"),
+    IndexSpec("read_markers", [("user_id", 1), ("channel_id", 1)], "user_id_1_channel_id_1", unique=True),
+    IndexSpec("read_markers", [("channel_id", 1)], "channel_id_1"),
+    IndexSpec("files", [("stored_filename", 1)], "stored_filename_1", unique=True),
+    IndexSpec("files", [("created_at", -1)], "created_at_-1"),
+    IndexSpec("archive_segments", [("channel_id", 1), ("n", -1)], "channel_id_1_n_-1", unique=True),
+    IndexSpec("archive_segments", [("channel_id", 1), ("thread_ids", 1)], "channel_id_1_thread_ids_1"),
+    IndexSpec(
+        "messages", [("channel_id", 1), ("rev", 1)], "channel_id_1_rev_1",
+        options={"partialFilterExpression": {"rev": {"$exists": True}}},
+    ),
+    IndexSpec("tombstones", [("channel_id", 1), ("rev", 1)], "channel_id_1_rev_1"),
+    IndexSpec("notifications", [("user_id", 1), ("message_id", 1)], "user_id_1_message_id_1", unique=True),
+    IndexSpec("notifications", [("user_id", 1), ("created_at", -1)], "user_id_1_created_at_-1"),
+    IndexSpec("notifications", [("channel_id", 1)], "channel_id_1"),
+    IndexSpec(
+        "file_objects", [("ready", 1), ("created_at", 1)], "ready_1_created_at_1",
+        options={"partialFilterExpression": {"ready": False}},
+    ),
+]
+
+# (collection, index name) pairs left behind by earlier versions
+OBSOLETE_INDEXES: List[Tuple[str, str]] = [
+    # Was on a field the code never writes; replaced by channel_id_1_created_at_-1
+    ("messages", "channel_id_1_timestamp_-1"),
+]
+
+_SAMPLE_ID = ObjectId()
+
+QUERIES: List[QueryShape] = [
+    QueryShape("users", "user by id", {"_id": _SAMPLE_ID}),
+    QueryShape("users", "user by email", {"email": "someone@example.com"}),
+    QueryShape("users", "user by username", {"username": "someone"}),
+    QueryShape("channels", "channel by id", {"_id": _SAMPLE_ID}),
+    QueryShape("channels", "channel by name", {"name": "general"}),
+    QueryShape("messages", "message by id", {"_id": _SAMPLE_ID}),
+    QueryShape("messages", "channel history page", {"channel_id": str(_SAMPLE_ID)}, [("created_at", -1)]),
+    QueryShape("messages", "channel message count / delete", {"channel_id": str(_SAMPLE_ID)}),
+    QueryShape("messages", "thread replies", {"thread_id": _SAMPLE_ID}, [("created_at", 1)]),
+    QueryShape("read_markers", "read markers for user", {"user_id": str(_SAMPLE_ID)}),
+    QueryShape(
+        "read_markers", "read marker update",
+        {"user_id": str(_SAMPLE_ID), "channel_id": str(_SAMPLE_ID)},
+    ),
+    QueryShape("read_markers", "read markers of a deleted channel", {"channel_id": str(_SAMPLE_ID)}),
+    QueryShape("users", "mentioned users", {"username": {"$in": ["someone"]}}),
+    QueryShape(
+        "messages", "message and its thread",
+        {"$or": [{"_id": _SAMPLE_ID}, {"thread_id": _SAMPLE_ID}]},
+    ),
+    QueryShape("files", "file by stored filename", {"stored_filename": "file.png"}),
+    QueryShape("files", "newest files", {}, [("created_at", -1)]),
+    QueryShape("file_objects", "content by sha256", {"_id": "0" * 64}),
+    # Also filtered on deleting
+    QueryShape(
+        "file_objects", "content that never became ready",
+        {"ready": False, "created_at": {"$lt": datetime(2000, 1, 1)}},
+    ),
+    # Also bounded by created_at < cutoff
+    QueryShape("messages", "oldest messages to archive", {"channel_id": str(_SAMPLE_ID)}, [("created_at", 1)]),
+    # Also filtered on pending
+    QueryShape("archive_segments", "archived segments of channel", {"channel_id": str(_SAMPLE_ID)}, [("n", -1)]),
+    # Also filtered on pending and sorted by n; only the few segments holding replies match
+    QueryShape(
+        "archive_segments", "archived segments holding thread replies",
+        {"channel_id": str(_SAMPLE_ID), "thread_ids": {"$in": [_SAMPLE_ID]}},
+    ),
+    # The rev predicate is what lets the partial channel_id_1_rev_1 index on messages serve this
+    QueryShape(
+        "messages", "messages changed since a sync cursor",
+        {"channel_id": str(_SAMPLE_ID), "rev": {"$gt": 0}}, [("rev", 1)],
+    ),
+    QueryShape(
+        "tombstones", "deletions since a sync cursor",
+        {"channel_id": str(_SAMPLE_ID), "rev": {"$gt": 0}}, [("rev", 1)],
+    ),
+    QueryShape("tombstones", "tombstones of a deleted channel", {"channel_id": str(_SAMPLE_ID)}),
+    QueryShape("notifications", "newest notifications for user", {"user_id": str(_SAMPLE_ID)}, [("created_at", -1)]),
+    QueryShape("notifications", "notifications of a deleted channel", {"channel_id": str(_SAMPLE_ID)}),
+]
+
+def registered_indexes(collection: str) -> List[IndexSpec]:
+    return [spec for spec in INDEXES if spec.collection == collection]
+
+async def apply_indexes(db) -> int:
+    """Create every registered index, drop obsolete ones and record the version"""
+    for collection in sorted({spec.collection for spec in INDEXES}):
+        models = [spec.model() for spec in registered_indexes(collection)]
+        created = await db[collection].create_indexes(models)
+        logger.info(f"Ensured indexes on {collection}: {', '.join(created)}")
+
+    for collection, name in OBSOLETE_INDEXES:
+        existing = await db[collection].index_information()
+        if name in existing:
+            await db[collection].drop_index(name)
+            logger.info(f"Dropped obsolete index {collection}.{name}")
+
+    await db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": "indexes"},
+        {"$set": {"version": INDEX_VERSION, "applied_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return INDEX_VERSION
+
+async def missing_indexes(db) -> List[IndexSpec]:
+    missing = []
+    for collection in sorted({spec.collection for spec in INDEXES}):
+        existing = await db[collection].index_information()
+        missing.extend(spec for spec in registered_indexes(collection) if spec.name not in existing)
+    return missing
+
+async def check_indexes(db) -> bool:
+    """Warn about missing indexes or an outdated index version; never modifies anything"""
+    ok = True
+    record = await db[MIGRATIONS_COLLECTION].find_one({"_id": "indexes"})
+    applied = record["version"] if record else 0
+    if applied < INDEX_VERSION:
+        ok = False
+        logger.warning(
+            f"Index version {applied} is behind {INDEX_VERSION}; run scripts/migrate_indexes.py"
+        )
+    for spec in await missing_indexes(db):
+        ok = False
+        logger.warning(f"Missing index {spec.collection}.{spec.name} on {spec.keys}")
+    return ok
+
+def _plan_stages(plan: Any):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+async def explain_query(db, query: QueryShape) -> Dict[str, Any]:
+    cursor = db[query.collection].find(query.filter)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    return await cursor.explain()
+
+async def collscan_queries(db) -> List[QueryShape]:
+    """Return the registered query shapes whose winning plan scans a whole collection"""
+    offenders = []
+    for query in QUERIES:
+        explain = await explain_query(db, query)
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in set(_plan_stages(winning_plan)):
+            offenders.append(query)
+    return offenders
+
+async def assert_no_collscans(db):
+    """Test-mode helper: fail if any registered query shape would scan a collection"""
+    offenders = await collscan_queries(db)
+    if offenders:
+        described = ", ".join(f"{query.collection}: {query.description}" for query in offenders)
+        raise AssertionError(f"Queries without a usable index (COLLSCAN): {described}")
@@ -0,0 +1,128 @@
+"""
+Redis-backed job queues for work that should not run inside a request.
+
+A queue is a Redis list of ready jobs plus one sorted set of jobs that are
+not ready, scored by when they become ready again: jobs a worker has claimed
+(due when their visibility timeout runs out, in case the worker died) and
+jobs waiting to be retried after a failure. Every claim first moves due jobs
+back onto the list, so there is no separate scheduler. Delivery is at least
+once; handlers must tolerate seeing a job twice. Jobs that keep failing end up
+on a capped dead-letter list for inspection.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_LIMIT = 10000
+
+jobs_total = registry.counter(
+    "jobs_total", "Background jobs by queue and outcome", ("queue", "result")
+)
+
+# KEYS[1] ready list, KEYS[2] scheduled set
+# ARGV[1] now, ARGV[2] visibility deadline, ARGV[3] max jobs
+# Requeues due jobs ahead of new ones, then claims up to ARGV[3] jobs.
+CLAIM_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 1000)
+for _, job in ipairs(due) do
+  redis.call('ZREM', KEYS[2], job)
+  redis.call('RPUSH', KEYS[1], job)
+end
+local claimed = {}
+for i = 1, tonumber(ARGV[3]) do
+  local job = redis.call('RPOP', KEYS[1])
+  if not job then
+    break
+  end
+  redis.call('ZADD', KEYS[2], ARGV[2], job)
+  claimed[#claimed + 1] = job
+end
+return claimed
+"""
+
+class JobQueue:
+    def __init__(self, name: str):
+        self.name = name
+        self.ready_key = f"jobs:{name}"
+        self.scheduled_key = f"jobs:{name}:scheduled"
+        self.dead_key = f"jobs:{name}:dead"
+        self._script = None
+
+    def _claim_script(self):
+        client = get_redis()
+        if self._script is None or self._script.registered_client is not client:
+            self._script = client.register_script(CLAIM_LUA)
+        return self._script
+
+    async def enqueue(self, payload: Dict[str, Any]):
+        job = {"id": uuid.uuid4().hex, "attempts": 0, "payload": payload}
+        await get_redis().lpush(self.ready_key, json.dumps(job))
+        jobs_total.inc((self.name, "enqueued"))
+
+    async def claim(self, count: int, visibility_seconds: float) -> List[str]:
+        """Up to ``count`` raw jobs, hidden from other workers for ``visibility_seconds``"""
+        now = time.time()
+        jobs = await self._claim_script()(
+            keys=[self.ready_key, self.scheduled_key], args=[now, now + visibility_seconds, count]
+        )
+        return [job.decode() if isinstance(job, bytes) else job for job in jobs]
+
+    async def ack(self, raw: str):
+        await get_redis().zrem(self.scheduled_key, raw)
+        jobs_total.inc((self.name, "done"))
+
+    async def retry(self, raw: str, error: Exception):
+        """Schedule a failed job again with exponential backoff, or dead-letter it"""
+        job = json.loads(raw)
+        job["attempts"] += 1
+        job["error"] = str(error)
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.zrem(self.scheduled_key, raw)
+        if job["attempts"] >= settings.job_max_attempts:
+            pipe.lpush(self.dead_key, json.dumps(job))
+            pipe.ltrim(self.dead_key, 0, DEAD_LETTER_LIMIT - 1)
+            result = "dead"
+        else:
+            delay = settings.job_retry_base_seconds * 2 ** (job["attempts"] - 1)
+            pipe.zadd(self.scheduled_key, {json.dumps(job): time.time() + delay})
+            result = "retried"
+        await pipe.execute()
+        jobs_total.inc((self.name, result))
+        logger.warning(f"Job {job['id']} on {self.name} failed (attempt {job['attempts']}, {result}): {error}")
+
+    async def work_once(self, handler: Callable[[Dict[str, Any]], Awaitable[None]], count: int) -> int:
+        """Claim and run one batch of jobs concurrently; returns how many were claimed"""
+        claimed = await self.claim(count, settings.job_visibility_seconds)
+
+        async def run(raw: str):
+            try:
+                await handler(json.loads(raw)["payload"])
+            except Exception as e:
+                await self.retry(raw, e)
+            else:
+                await self.ack(raw)
+
+        await asyncio.gather(*(run(raw) for raw in claimed))
+        return len(claimed)
+
+    async def work(self, handler: Callable[[Dict[str, Any]], Awaitable[None]], count: int):
+        """Drain the queue until cancelled"""
+        while True:
+            try:
+                claimed = await self.work_once(handler, count)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to claim jobs from {self.name}: {e}")
+                claimed = 0
+            if not claimed:
+                await asyncio.sleep(settings.job_poll_seconds)
@@ -0,0 +1,285 @@
+"""
+LiveKit room state.
+
+LiveKit posts room and participant events to ``/video/webhook``; each request
+carries a JWT signed with our API secret whose ``sha256`` claim is the hash
+of the body. The events maintain a Redis index of active rooms
+(``video:rooms``) and their participants (``video:room:<room>``), so
+participant lists and "call in progress" indicators never call the media
+server.
+
+Webhooks can be retried and arrive out of order. Event ids are remembered
+for ``video_event_ttl_seconds`` to drop duplicates, and departed participant
+and finished room sids leave tombstones so a late ``participant_joined``
+cannot resurrect them.
+
+Access tokens are cached per (identity, name, room, grants) and reissued
+only when fewer than ``video_token_refresh_seconds`` of their lifetime
+remain. Signing uses an HMAC key schedule and JWT header prepared once, so
+a cache miss costs one hash over the claims.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import jwt
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+ROOM_PREFIX = "channel_"
+ROOMS_KEY = "video:rooms"
+
+PARTICIPANT_GRANTS = {"roomJoin": True, "canPublish": True, "canSubscribe": True, "canPublishData": True}
+
+tokens_issued = registry.counter(
+    "video_tokens_issued_total", "Video access tokens handed out, by whether they were signed or cached", ("result",)
+)
+
+# KEYS: participants, sids, participant tombstone, room tombstone, rooms
+# ARGV: identity, participant sid, participant json, room name, room json, ttl
+JOIN_LUA = """
+if redis.call('EXISTS', KEYS[3]) == 1 or redis.call('EXISTS', KEYS[4]) == 1 then
+    return -1
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('HSETNX', KEYS[5], ARGV[4], ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return redis.call('HLEN', KEYS[1])
+"""
+
+# KEYS: participants, sids, participant tombstone
+# ARGV: identity, participant sid, tombstone ttl
+LEAVE_LUA = """
+redis.call('SET', KEYS[3], 1, 'EX', ARGV[3])
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+return redis.call('HLEN', KEYS[1])
+"""
+
+class WebhookError(Exception):
+    pass
+
+def room_name(channel_id: str) -> str:
+    return f"{ROOM_PREFIX}{channel_id}"
+
+def channel_for_room(room: str) -> Optional[str]:
+    return room[len(ROOM_PREFIX):] if room.startswith(ROOM_PREFIX) else None
+
+def _participants_key(room: str) -> str:
+    return f"video:room:{room}"
+
+def _sids_key(room: str) -> str:
+    return f"video:room:{room}:sids"
+
+def _tombstone_key(sid: str) -> str:
+    return f"video:gone:{sid}"
+
+def verify_webhook(body: bytes, authorization: Optional[str]) -> Dict[str, Any]:
+    """Check the signed Authorization header against the raw body and return the event"""
+    if not authorization:
+        raise WebhookError("Missing Authorization header")
+    token = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else authorization
+    try:
+        claims = jwt.decode(
+            token, settings.livekit_api_secret, algorithms=["HS256"], issuer=settings.livekit_api_key
+        )
+    except jwt.PyJWTError as e:
+        raise WebhookError(f"Invalid webhook token: {e}")
+    expected = base64.b64encode(hashlib.sha256(body).digest()).decode()
+    if not hmac.compare_digest(str(claims.get("sha256", "")), expected):
+        raise WebhookError("Webhook body does not match its signature")
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise WebhookError("Webhook body is not JSON")
+
+class RoomIndex:
+    def __init__(self):
+        self._scripts = {}
+
+    def _script(self, name: str, source: str):
+        client = get_redis()
+        script = self._scripts.get(name)
+        if script is None or script.registered_client is not client:
+            script = self._scripts[name] = client.register_script(source)
+        return script
+
+    async def apply(self, event: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+        """Apply one webhook event; returns (room, participant count) when the room's call state changed"""
+        kind = event.get("event")
+        room = (event.get("room") or {})
+        name = room.get("name")
+        if not name:
+            return None
+
+        redis = get_redis()
+        marker = f"video:event:{event['id']}" if event.get("id") else None
+        if marker and not await redis.set(marker, 1, nx=True, ex=settings.video_event_ttl_seconds):
+            return None
+        try:
+            return await self._apply(redis, kind, name, room, event)
+        except Exception:
+            # Not applied: LiveKit's retry of this event must not be dropped as a duplicate
+            if marker:
+                await redis.delete(marker)
+            raise
+
+    async def _apply(self, redis, kind: str, name: str, room: Dict[str, Any],
+                     event: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+        if kind == "room_started":
+            if room.get("sid") and await redis.exists(_tombstone_key(room["sid"])):
+                return None
+            await redis.hsetnx(ROOMS_KEY, name, json.dumps({"sid": room.get("sid"), "started_at": int(time.time())}))
+            return None
+
+        if kind == "room_finished":
+            pipe = redis.pipeline()
+            if room.get("sid"):
+                pipe.set(_tombstone_key(room["sid"]), 1, ex=settings.video_event_ttl_seconds)
+            pipe.delete(_participants_key(name), _sids_key(name))
+            pipe.hdel(ROOMS_KEY, name)
+            await pipe.execute()
+            return name, 0
+
+        participant = event.get("participant") or {}
+        identity, sid = participant.get("identity"), participant.get("sid")
+        if not identity or not sid:
+            return None
+
+        if kind == "participant_joined":
+            record = {
+                "identity": identity,
+                "name": participant.get("name") or identity,
+                "sid": sid,
+                "joined_at": int(participant.get("joinedAt") or time.time()),
+            }
+            count = await self._script("join", JOIN_LUA)(
+                keys=[_participants_key(name), _sids_key(name), _tombstone_key(sid),
+                      _tombstone_key(room.get("sid") or ""), ROOMS_KEY],
+                args=[identity, sid, json.dumps(record), name,
+                      json.dumps({"sid": room.get("sid"), "started_at": int(time.time())}),
+                      settings.video_room_ttl_seconds],
+            )
+        elif kind == "participant_left":
+            count = await self._script("leave", LEAVE_LUA)(
+                keys=[_participants_key(name), _sids_key(name), _tombstone_key(sid)],
+                args=[identity, sid, settings.video_event_ttl_seconds],
+            )
+        else:
+            return None
+
+        if count < 0:
+            logger.debug(f"Ignored late {kind} for {identity} in {name}")
+            return None
+        return name, int(count)
+
+    async def participants(self, room: str) -> List[Dict[str, Any]]:
+        raw = await get_redis().hgetall(_participants_key(room))
+        return sorted((json.loads(value) for value in raw.values()), key=lambda p: p["joined_at"])
+
+    async def active_rooms(self) -> Dict[str, int]:
+        """Participant count for every room with a call in progress"""
+        redis = get_redis()
+        rooms = [name.decode() for name in await redis.hkeys(ROOMS_KEY)]
+        pipe = redis.pipeline(transaction=False)
+        for name in rooms:
+            pipe.hlen(_participants_key(name))
+        counts = await pipe.execute()
+        return {name: count for name, count in zip(rooms, counts) if count}
+
+    async def forget(self, room: str):
+        pipe = get_redis().pipeline()
+        pipe.delete(_participants_key(room), _sids_key(room))
+        pipe.hdel(ROOMS_KEY, room)
+        await pipe.execute()
+
+room_index = RoomIndex()
+
+def _b64(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+class TokenSigner:
+    """HS256 JWTs with the encoded header and the HMAC key schedule computed once"""
+
+    def __init__(self, secret: str):
+        self._header = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode())
+        self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+    def sign(self, claims: Dict[str, Any]) -> str:
+        signing_input = self._header + b"." + _b64(json.dumps(claims, separators=(",", ":")).encode())
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return (signing_input + b"." + _b64(mac.digest())).decode()
+
+class VideoTokens:
+    def __init__(self):
+        self._cache: "OrderedDict[tuple, Tuple[str, int]]" = OrderedDict()
+        self.prepare()
+
+    def prepare(self):
+        """(Re)load the signing key; cached tokens signed with the old one are dropped"""
+        self._signer = TokenSigner(settings.livekit_api_secret)
+        self._cache.clear()
+
+    def issue(self, identity: str, name: str, room: str,
+              grants: Dict[str, bool] = PARTICIPANT_GRANTS) -> Tuple[str, int]:
+        """A token for ``identity`` to join ``room`` and its expiry (unix seconds)"""
+        now = int(time.time())
+        key = (identity, name, room, tuple(sorted(grants.items())))
+        cached = self._cache.get(key)
+        if cached is not None and cached[1] - now > settings.video_token_refresh_seconds:
+            self._cache.move_to_end(key)
+            tokens_issued.inc(("cached",))
+            return cached
+
+        expires_at = now + settings.video_token_ttl_seconds
+        token = self._signer.sign({
+            "iss": settings.livekit_api_key,
+            "sub": identity,
+            "name": name,
+            "nbf": now,
+            "exp": expires_at,
+            "video": {"room": room, **grants},
+        })
+        self._cache[key] = (token, expires_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > settings.video_token_cache_size:
+            self._cache.popitem(last=False)
+        tokens_issued.inc(("signed",))
+        return token, expires_at
+
+video_tokens = VideoTokens()
+
+def _admin_token(room: str) -> str:
+    now = int(time.time())
+    return jwt.encode(
+        {"iss": settings.livekit_api_key, "nbf": now, "exp": now + 60,
+         "video": {"room": room, "roomCreate": True, "roomAdmin": True}},
+        settings.livekit_api_secret, algorithm="HS256"
+    )
+
+async def room_service(method: str, room: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Call LiveKit's RoomService (Twirp over HTTP)"""
+    base = settings.livekit_url.replace("wss://", "https://").replace("ws://", "http://")
+    async with httpx.AsyncClient(timeout=settings.livekit_api_timeout) as client:
+        response = await client.post(
+            f"{base}/twirp/livekit.RoomService/{method}",
+            json=body,
+            headers={"Authorization": f"Bearer {_admin_token(room)}"},
+        )
+    response.raise_for_status()
+    return response.json()
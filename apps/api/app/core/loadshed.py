@@ -0,0 +1,249 @@
+"""
+Adaptive load shedding for HTTP requests.
+
+All HTTP requests share one concurrency limit that adapts to observed latency
+(AIMD: grow by one per limit's worth of on-target completions, shrink
+multiplicatively when a request misses its class's latency target). Each
+route class may only use a share of that limit, so as the limit shrinks the
+expensive classes are queued and shed first while cheap interactive calls keep
+flowing. Requests that cannot start immediately wait in a bounded per-class
+queue; waiters whose queue delay stays above target for a whole interval are
+dropped CoDel-style rather than served late. CORS preflights are never queued
+or shed. WebSocket commands (app/websocket/rpc.py) are admitted through the
+same limiter; the sockets themselves are not limited.
+"""
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Pattern, Tuple
+from urllib.parse import parse_qs
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+class RouteClass(NamedTuple):
+    name: str
+    # Fraction of the shared limit this class may occupy
+    share: float
+    # Fraction of loadshed_max_queue this class may queue
+    queue_share: float
+
+INTERACTIVE = RouteClass("interactive", 1.0, 1.0)
+DEFAULT = RouteClass("default", 0.8, 0.5)
+BULK = RouteClass("bulk", 0.5, 0.25)
+
+# Queues are served in this order when slots free up
+ROUTE_CLASSES = (INTERACTIVE, DEFAULT, BULK)
+
+_MESSAGES = re.compile(r"^/api/v1/messages/channels/[^/]+/messages/?$")
+
+ROUTE_RULES: List[Tuple[Optional[str], Pattern, RouteClass]] = [
+    ("POST", _MESSAGES, INTERACTIVE),
+    ("POST", re.compile(r"^/api/v1/messages/messages/[^/]+/reactions/?$"), INTERACTIVE),
+    ("GET", re.compile(r"^/api/v1/auth/me/?$"), INTERACTIVE),
+    (None, re.compile(r"^/api/v1/files/"), BULK),
+]
+
+# Observability must keep answering while the API is overloaded
+EXEMPT_PATHS = ("/metrics", "/docs", "/redoc", "/openapi.json", "/api/v1/diagnostics/")
+
+loadshed_requests_total = registry.counter(
+    "loadshed_requests_total", "HTTP admission decisions by route class and result",
+    ("route_class", "result")
+)
+
+def classify(method: str, path: str, query_string: bytes = b"") -> RouteClass:
+    """Map a request onto its route class before routing has happened"""
+    if method == "GET" and _MESSAGES.match(path):
+        # History pages are cheap unless the client asks for a lot of them
+        limit = parse_qs(query_string.decode("latin-1")).get("limit")
+        try:
+            if limit and int(limit[0]) > settings.loadshed_large_page:
+                return BULK
+        except ValueError:
+            pass
+        return DEFAULT
+    for rule_method, pattern, route_class in ROUTE_RULES:
+        if (rule_method is None or rule_method == method) and pattern.match(path):
+            return route_class
+    return DEFAULT
+
+def latency_target(route_class: RouteClass) -> float:
+    return getattr(settings, f"loadshed_{route_class.name}_target_ms") / 1000
+
+class _Waiter:
+    __slots__ = ("future", "enqueued")
+
+    def __init__(self, future: asyncio.Future, enqueued: float):
+        self.future = future
+        self.enqueued = enqueued
+
+class _ClassState:
+    __slots__ = ("queue", "first_above_time")
+
+    def __init__(self):
+        self.queue: Deque[_Waiter] = deque()
+        self.first_above_time = 0.0
+
+class AdaptiveLimiter:
+    def __init__(self):
+        self.limit = float(settings.loadshed_initial_limit)
+        self.in_flight = 0
+        self._classes: Dict[str, _ClassState] = {c.name: _ClassState() for c in ROUTE_CLASSES}
+        self._last_decrease = 0.0
+
+    def queued(self, route_class: Optional[RouteClass] = None) -> int:
+        if route_class is not None:
+            return len(self._classes[route_class.name].queue)
+        return sum(len(state.queue) for state in self._classes.values())
+
+    def _can_admit(self, route_class: RouteClass) -> bool:
+        return self.in_flight < max(1, int(self.limit * route_class.share))
+
+    def _codel_drop(self, state: _ClassState, sojourn: float, now: float) -> bool:
+        """Drop once the queue delay has stayed above target for a whole interval"""
+        if sojourn < settings.loadshed_queue_target_ms / 1000:
+            state.first_above_time = 0.0
+            return False
+        if state.first_above_time == 0.0:
+            state.first_above_time = now + settings.loadshed_queue_interval_ms / 1000
+            return False
+        return now >= state.first_above_time
+
+    def _wake(self):
+        now = time.monotonic()
+        for route_class in ROUTE_CLASSES:
+            state = self._classes[route_class.name]
+            while state.queue and self._can_admit(route_class):
+                waiter = state.queue.popleft()
+                if waiter.future.done():
+                    # Timed out or the client went away
+                    continue
+                if self._codel_drop(state, now - waiter.enqueued, now):
+                    waiter.future.set_result(False)
+                    continue
+                self.in_flight += 1
+                waiter.future.set_result(True)
+
+    async def acquire(self, route_class: RouteClass) -> Tuple[bool, str]:
+        """Wait for a slot; returns (admitted, decision)"""
+        state = self._classes[route_class.name]
+        if not state.queue and self._can_admit(route_class):
+            self.in_flight += 1
+            return True, "admitted"
+
+        max_queue = max(1, int(settings.loadshed_max_queue * route_class.queue_share))
+        if len(state.queue) >= max_queue:
+            return False, "queue_full"
+
+        future = asyncio.get_running_loop().create_future()
+        state.queue.append(_Waiter(future, time.monotonic()))
+        try:
+            admitted = await asyncio.wait_for(future, settings.loadshed_max_wait_ms / 1000)
+        except asyncio.TimeoutError:
+            return False, "timeout"
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.result():
+                self.release(route_class, 0.0)
+            raise
+        return admitted, "queued" if admitted else "codel"
+
+    def release(self, route_class: RouteClass, latency: float):
+        self.in_flight -= 1
+        now = time.monotonic()
+        if latency > latency_target(route_class):
+            # One multiplicative decrease per queue interval, not per slow request
+            if now - self._last_decrease >= settings.loadshed_queue_interval_ms / 1000:
+                self._last_decrease = now
+                self.limit = max(settings.loadshed_min_limit, self.limit * settings.loadshed_backoff)
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Only grow while the limit is actually being used
+            self.limit = min(settings.loadshed_max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+limiter = AdaptiveLimiter()
+
+registry.gauge(
+    "loadshed_concurrency_limit", "Current adaptive concurrency limit",
+    callback=lambda: [((), limiter.limit)]
+)
+registry.gauge(
+    "loadshed_in_flight", "HTTP requests currently admitted",
+    callback=lambda: [((), limiter.in_flight)]
+)
+registry.gauge(
+    "loadshed_queued", "HTTP requests waiting for a slot by route class", ("route_class",),
+    callback=lambda: [((c.name,), limiter.queued(c)) for c in ROUTE_CLASSES]
+)
+
+class _ServerTime:
+    """
+    How long the server took to start responding.
+
+    The slot is held for the whole exchange, but downloads streaming to a slow
+    client or uploads arriving from one say nothing about server load, so the
+    latency signal stops at ``http.response.start`` and leaves out time spent
+    waiting for the request body.
+    """
+
+    def __init__(self, receive, send):
+        self._receive = receive
+        self._send = send
+        self.started = time.monotonic()
+        self.responded: Optional[float] = None
+        self.waiting = 0.0
+
+    async def receive(self):
+        waited_from = time.monotonic()
+        message = await self._receive()
+        if self.responded is None:
+            self.waiting += time.monotonic() - waited_from
+        return message
+
+    async def send(self, message):
+        if message["type"] == "http.response.start" and self.responded is None:
+            self.responded = time.monotonic()
+        await self._send(message)
+
+    def elapsed(self) -> float:
+        responded = self.responded if self.responded is not None else time.monotonic()
+        return max(0.0, responded - self.started - self.waiting)
+
+class LoadSheddingMiddleware:
+    """ASGI middleware admitting HTTP requests through the adaptive limiter"""
+
+    def __init__(self, app, limiter: AdaptiveLimiter = limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"].startswith(EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify(scope["method"], scope["path"], scope.get("query_string", b""))
+        admitted, decision = await self.limiter.acquire(route_class)
+        loadshed_requests_total.inc((route_class.name, decision))
+        if not admitted:
+            # Counted above; a warning per request would flood the log exactly when overloaded
+            logger.debug(f"Shed {scope['method']} {scope['path']} ({route_class.name}, {decision})")
+            response = JSONResponse(
+                {"detail": "Service is overloaded, please retry shortly"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "1"}
+            )
+            await response(scope, receive, send)
+            return
+
+        timing = _ServerTime(receive, send)
+        try:
+            await self.app(scope, timing.receive, timing.send)
+        finally:
+            self.limiter.release(route_class, timing.elapsed())
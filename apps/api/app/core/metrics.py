@@ -0,0 +1,381 @@
+"""
+Minimal Prometheus-style metrics registry.
+
+Counters and histograms are plain dicts keyed by label tuples, so recording a
+sample is a dict lookup and a couple of additions. Gauges that describe live
+state (sockets, pools) are computed from callbacks at scrape time instead of
+being updated on every change.
+"""
+import abc
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+from app.core.multipart import MULTIPART_METHODS
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """Exposition lines for this metric, header included"""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, labels: LabelValues, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, labels: LabelValues = ()):
+        return _Timer(self, labels)
+
+    def count(self, labels: LabelValues = ()) -> int:
+        series = self._values.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def render(self):
+        lines = self.header()
+        for labels, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames + ("le",), labels + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: LabelValues):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(self.labels, time.perf_counter() - self.started)
+
+
+class GaugeFunc(_Metric):
+    """Gauge whose samples are produced by a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Callable[[], Iterable[Tuple[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def render(self):
+        lines = self.header()
+        if self.callback is None:
+            return lines
+        for labels, value in self.callback():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class CounterFunc(GaugeFunc):
+    """Counter maintained elsewhere as a plain integer and read at scrape time"""
+
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None) -> GaugeFunc:
+        return self.register(GaugeFunc(name, documentation, labelnames, callback))
+
+    def counter_func(self, name, documentation, labelnames=(), callback=None) -> CounterFunc:
+        return self.register(CounterFunc(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, List[str]]:
+        """Rendered lines per metric family, for merging across worker processes"""
+        return {name: metric.render() for name, metric in self._metrics.items()}
+
+
+registry = Registry()
+
+# Multiprocess mode: every worker stores its snapshot in one Redis hash
+WORKER_SNAPSHOTS_KEY = "metrics:workers"
+WORKER_ID = f"{os.uname().nodename}:{os.getpid()}"
+
+
+def _add_label(sample: str, label: str) -> str:
+    name, brace, rest = sample.partition("{")
+    if brace:
+        return f"{name}{{{label},{rest}"
+    name, _, value = sample.partition(" ")
+    return f"{name}{{{label}}} {value}"
+
+
+def merge_snapshots(snapshots: Dict[str, Dict[str, List[str]]]) -> str:
+    """Combine per-worker snapshots into one exposition, labelling samples by worker"""
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for worker, families in sorted(snapshots.items()):
+        label = f'worker="{_escape(worker)}"'
+        for name, lines in families.items():
+            headers.setdefault(name, [line for line in lines if line.startswith("#")])
+            samples.setdefault(name, []).extend(
+                _add_label(line, label) for line in lines if not line.startswith("#")
+            )
+    lines: List[str] = []
+    for name, header in headers.items():
+        lines.extend(header)
+        lines.extend(samples[name])
+    return "\n".join(lines) + "\n"
+
+
+async def publish_snapshot(redis_client):
+    await redis_client.hset(
+        WORKER_SNAPSHOTS_KEY, WORKER_ID,
+        json.dumps({"ts": time.time(), "families": registry.snapshot()})
+    )
+
+
+async def render_all_workers(redis_client, max_age: float) -> str:
+    """Exposition covering every worker that published a snapshot within ``max_age`` seconds"""
+    await publish_snapshot(redis_client)
+    snapshots = {}
+    stale = []
+    now = time.time()
+    for worker, raw in (await redis_client.hgetall(WORKER_SNAPSHOTS_KEY)).items():
+        worker = worker.decode() if isinstance(worker, bytes) else worker
+        snapshot = json.loads(raw)
+        if now - snapshot["ts"] > max_age:
+            stale.append(worker)
+        else:
+            snapshots[worker] = snapshot["families"]
+    if stale:
+        await redis_client.hdel(WORKER_SNAPSHOTS_KEY, *stale)
+    return merge_snapshots(snapshots)
+
+# HTTP
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by route template, method and status", ("method", "route", "status")
+)
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+
+# Mongo
+mongo_command_duration_seconds = registry.histogram(
+    "mongo_command_duration_seconds", "Mongo command latency by collection and command", ("collection", "command")
+)
+mongo_command_failures_total = registry.counter(
+    "mongo_command_failures_total", "Failed Mongo commands by collection and command", ("collection", "command")
+)
+
+# Redis
+redis_publish_total = registry.counter(
+    "redis_publish_total", "Redis PUBLISH calls by channel kind", ("kind",)
+)
+
+# MinIO
+minio_operation_duration_seconds = registry.histogram(
+    "minio_operation_duration_seconds", "MinIO client call latency by operation", ("operation",)
+)
+minio_transfer_bytes_total = registry.counter(
+    "minio_transfer_bytes_total", "Bytes transferred to and from MinIO", ("direction",)
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts and latency per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Label by template, never by raw path, to keep cardinality bounded
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration_seconds.observe((method, template), time.perf_counter() - started)
+            http_requests_total.inc((method, template, str(status_code)))
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """pymongo command listener feeding the command latency histogram"""
+
+    def __init__(self):
+        self._pending: Dict[int, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._pending[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._pending.pop(event.request_id, "")
+        mongo_command_duration_seconds.observe((collection, event.command_name), event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        collection = self._pending.pop(event.request_id, "")
+        mongo_command_duration_seconds.observe((collection, event.command_name), event.duration_micros / 1_000_000)
+        mongo_command_failures_total.inc((collection, event.command_name))
+
+
+class _CountingResponse:
+    """Wraps a MinIO object response to count the bytes read from it"""
+
+    def __init__(self, response):
+        self._response = response
+
+    def read(self, *args, **kwargs):
+        data = self._response.read(*args, **kwargs)
+        minio_transfer_bytes_total.inc(("download",), len(data))
+        return data
+
+    def stream(self, *args, **kwargs):
+        for chunk in self._response.stream(*args, **kwargs):
+            minio_transfer_bytes_total.inc(("download",), len(chunk))
+            yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class InstrumentedMinio:
+    """Proxy around the MinIO client recording call latency and transfer bytes"""
+
+    def __init__(self, client):
+        self._client = client
+        self.in_flight = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if (name.startswith("_") and name not in MULTIPART_METHODS) or not callable(attr):
+            return attr
+        histogram = minio_operation_duration_seconds
+        operation = name.lstrip("_")
+
+        def wrapper(*args, **kwargs):
+            self.in_flight += 1
+            try:
+                with histogram.time((operation,)):
+                    result = attr(*args, **kwargs)
+            finally:
+                self.in_flight -= 1
+            if name == "put_object":
+                length = kwargs.get("length", args[3] if len(args) > 3 else 0)
+                if length and length > 0:
+                    minio_transfer_bytes_total.inc(("upload",), length)
+            elif name == "_upload_part":
+                minio_transfer_bytes_total.inc(("upload",), len(args[2]))
+            elif name == "get_object":
+                result = _CountingResponse(result)
+            return result
+
+        return wrapper
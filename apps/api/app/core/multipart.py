@@ -0,0 +1,46 @@
+"""
+S3 multipart upload calls.
+
+The minio SDK only exposes multipart uploads through private ``Minio`` methods
+(``_create_multipart_upload`` and friends), which may change in any release.
+Every call to them goes through this module, minio is pinned to an exact
+version in requirements.txt, and tests/test_multipart.py checks the signatures
+used here against the installed SDK, so an upgrade fails tests instead of
+uploads. The storage proxies (``InstrumentedMinio``, ``ProfiledMinio``) time
+the methods in ``MULTIPART_METHODS`` like public calls.
+"""
+from typing import Any, Dict, Optional
+
+from minio.datatypes import Part
+
+MULTIPART_METHODS = frozenset({
+    "_create_multipart_upload",
+    "_upload_part",
+    "_complete_multipart_upload",
+    "_abort_multipart_upload",
+    "_list_multipart_uploads",
+})
+
+def create_upload(client, bucket: str, key: str, content_type: str) -> str:
+    """Start a multipart upload; returns its upload id"""
+    return client._create_multipart_upload(bucket, key, {"Content-Type": content_type})
+
+def upload_part(client, bucket: str, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+    """Store one part; returns its ETag"""
+    return client._upload_part(bucket, key, data, None, upload_id, part_number)
+
+def complete_upload(client, bucket: str, key: str, upload_id: str, etags: Dict[int, str]):
+    """Assemble the parts, given as part number -> ETag, into ``key``"""
+    return client._complete_multipart_upload(
+        bucket, key, upload_id, [Part(number, etags[number]) for number in sorted(etags)]
+    )
+
+def abort_upload(client, bucket: str, key: str, upload_id: str):
+    return client._abort_multipart_upload(bucket, key, upload_id)
+
+def list_uploads(client, bucket: str, prefix: str, key_marker: Optional[str] = None,
+                 upload_id_marker: Optional[str] = None) -> Any:
+    """One page of in-progress uploads under ``prefix``"""
+    return client._list_multipart_uploads(
+        bucket, prefix=prefix, key_marker=key_marker, upload_id_marker=upload_id_marker
+    )
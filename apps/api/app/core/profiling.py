@@ -0,0 +1,243 @@
+"""
+Per-request database operation profiler.
+
+Every Mongo, Redis and MinIO call made while handling a sampled request is
+attributed to that request through a context variable. Motor runs pymongo on
+an executor but copies the context, so the command listener sees the same
+profile as the endpoint that issued the query.
+"""
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+import redis.asyncio as redis
+from pymongo import monitoring
+
+from app.core.config import settings
+from app.core.multipart import MULTIPART_METHODS
+
+logger = logging.getLogger(__name__)
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+# Commands whose first value is not a collection name
+_NON_COLLECTION_COMMANDS = {"ping", "hello", "isMaster", "ismaster", "endSessions", "buildInfo", "saslStart", "saslContinue"}
+
+
+def query_shape(value: Any) -> Any:
+    """Replace literal values with placeholders, keeping keys and operators"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = [query_shape(item) for item in value]
+        # $in lists and similar vary in length, not in shape
+        return shapes[:1] if shapes and all(shape == shapes[0] for shape in shapes) else shapes
+    return "?"
+
+
+def mongo_command_shape(command_name: str, command: Dict[str, Any]) -> Tuple[str, str]:
+    """Return (collection, shape) for a pymongo command document"""
+    if command_name in _NON_COLLECTION_COMMANDS:
+        return "", command_name
+    collection = command.get(command_name)
+    collection = collection if isinstance(collection, str) else ""
+    if command_name == "find":
+        spec = {"filter": command.get("filter", {}), "sort": command.get("sort")}
+    elif command_name == "aggregate":
+        spec = {"pipeline": command.get("pipeline", [])}
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        spec = {"q": statements[0].get("q", {})}
+    elif command_name in ("count", "distinct", "findAndModify"):
+        spec = {"query": command.get("query", {})}
+    else:
+        spec = {}
+    shape = json.dumps(query_shape(spec), sort_keys=True, default=str) if spec else ""
+    return collection, f"mongo {command_name} {collection} {shape}".rstrip()
+
+
+class RequestProfile:
+    """Operations attributed to a single HTTP request"""
+
+    __slots__ = ("method", "path", "count", "total_time", "slowest", "slowest_time", "shapes", "pending", "_lock")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest = ""
+        self.slowest_time = 0.0
+        self.shapes: Counter = Counter()
+        self.pending: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def record(self, shape: str, duration: float):
+        with self._lock:
+            self.count += 1
+            self.total_time += duration
+            self.shapes[shape] += 1
+            if duration >= self.slowest_time:
+                self.slowest = shape
+                self.slowest_time = duration
+
+    def repeated_shapes(self) -> Dict[str, int]:
+        threshold = settings.profiling_repeat_threshold
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+    def flags(self):
+        flags = []
+        if self.count > settings.profiling_op_budget:
+            flags.append("budget")
+        if self.repeated_shapes():
+            flags.append("repeated")
+        return flags
+
+    def summary(self, status_code: Optional[int] = None, duration: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 3) if duration is not None else None,
+            "db_ops": self.count,
+            "db_time_ms": round(self.total_time * 1000, 3),
+            "slowest_op": self.slowest,
+            "slowest_op_ms": round(self.slowest_time * 1000, 3),
+            "flags": self.flags(),
+            "repeated": self.repeated_shapes(),
+        }
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+def record_operation(shape: str, duration: float):
+    """Attribute an operation to the current request, if it is being profiled"""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.record(shape, duration)
+
+
+@contextmanager
+def timed_operation(shape: str):
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record(shape, time.perf_counter() - started)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """pymongo command-monitoring listener feeding the current request profile"""
+
+    def started(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            _, shape = mongo_command_shape(event.command_name, event.command)
+            profile.pending[event.request_id] = shape
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            shape = profile.pending.pop(event.request_id, f"mongo {event.command_name}")
+            profile.record(shape, event.duration_micros / 1_000_000)
+
+
+class ProfiledRedis(redis.Redis):
+    """Redis client that reports each command to the current request profile"""
+
+    async def execute_command(self, *args, **options):
+        profile = _current_profile.get()
+        if profile is None:
+            return await super().execute_command(*args, **options)
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            profile.record(f"redis {args[0]}", time.perf_counter() - started)
+
+
+class ProfiledMinio:
+    """Proxy around the MinIO client that times every public call"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if (name.startswith("_") and name not in MULTIPART_METHODS) or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            with timed_operation(f"minio {name.lstrip('_')}"):
+                return attr(*args, **kwargs)
+
+        return wrapper
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a sample of requests.
+
+    The summary is exposed through ``X-DB-*`` response headers (when enabled)
+    and logged as a single JSON line; requests over the operation budget or
+    repeating the same query shape are logged at warning level.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= settings.profiling_sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.profiling_headers:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-ops", str(profile.count).encode()))
+                    headers.append((b"x-db-time-ms", f"{profile.total_time * 1000:.3f}".encode()))
+                    if profile.slowest:
+                        headers.append((b"x-db-slowest", f"{profile.slowest_time * 1000:.3f}ms {profile.slowest}"[:256].encode()))
+                    flags = profile.flags()
+                    if flags:
+                        headers.append((b"x-db-flags", ",".join(flags).encode()))
+                    message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            summary = profile.summary(status_code, time.perf_counter() - started)
+            if summary["flags"]:
+                logger.warning("db_profile %s", json.dumps(summary))
+            else:
+                logger.info("db_profile %s", json.dumps(summary))
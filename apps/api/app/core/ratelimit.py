@@ -0,0 +1,197 @@
+"""
+Redis-backed token-bucket rate limiting.
+
+Buckets live in Redis and are updated atomically by a Lua script. To keep most
+decisions off the network, each worker leases a small batch of tokens per
+bucket and spends them locally, and remembers denials until the bucket is due
+to refill; Redis is only consulted when the local lease runs out. Keys start
+with single-token leases and only lease a batch once a lease runs dry before it
+expires, and tokens left in an expired lease go back to the bucket on the next
+call, so sparse callers are not charged for tokens they never spent.
+"""
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request, status
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.redis import get_redis
+from app.models.user import User
+from app.api.v1.endpoints.auth import get_current_user
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] bucket key
+# ARGV[1] capacity, ARGV[2] refill rate (tokens/s), ARGV[3] tokens wanted,
+# ARGV[4] unspent tokens returned from an expired lease
+# Returns ARGV[4] tokens (capped at capacity), grants up to ARGV[3] whole
+# tokens (at least one or none) and returns
+# {granted, milliseconds until one token is available}
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local wanted = tonumber(ARGV[3])
+local returned = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+  tokens = capacity
+  ts = now
+end
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000 + returned)
+local granted = math.min(wanted, math.floor(tokens))
+tokens = tokens - granted
+
+local retry_after = 0
+if granted == 0 then
+  retry_after = math.ceil((1 - tokens) * 1000 / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return {granted, retry_after}
+"""
+
+rate_limit_decisions_total = registry.counter(
+    "rate_limit_decisions_total", "Rate limit decisions by route, scope, result and source",
+    ("route", "scope", "result", "source")
+)
+
+def parse_limit(spec: str) -> Optional[Tuple[int, float]]:
+    """Parse "<requests>/<seconds>" into (capacity, refill rate per second)"""
+    if not spec:
+        return None
+    count, _, seconds = spec.partition("/")
+    capacity = int(count)
+    period = float(seconds or 1)
+    if capacity <= 0 or period <= 0:
+        return None
+    return capacity, capacity / period
+
+class _LocalBucket:
+    __slots__ = ("tokens", "lease_expires", "denied_until")
+
+    def __init__(self):
+        self.tokens = 0
+        self.lease_expires = 0.0
+        self.denied_until = 0.0
+
+class TokenBucketLimiter:
+    def __init__(self):
+        self._local: Dict[str, _LocalBucket] = {}
+        self._script = None
+
+    def _lease_size(self, capacity: int) -> int:
+        return max(1, int(capacity * settings.rate_limit_local_fraction))
+
+    async def _take_remote(
+        self, key: str, capacity: int, rate: float, wanted: int, returned: int = 0
+    ) -> Tuple[int, float]:
+        client = get_redis()
+        if self._script is None or self._script.registered_client is not client:
+            self._script = client.register_script(TOKEN_BUCKET_LUA)
+        granted, retry_after_ms = await self._script(keys=[key], args=[capacity, rate, wanted, returned])
+        return int(granted), int(retry_after_ms) / 1000
+
+    async def acquire(self, key: str, capacity: int, rate: float) -> Tuple[bool, float, str]:
+        """Take one token; returns (allowed, retry_after_seconds, decision source)"""
+        now = time.monotonic()
+        local = self._local.get(key)
+        if local is None:
+            local = self._local[key] = _LocalBucket()
+
+        if now < local.denied_until:
+            return False, local.denied_until - now, "local"
+        if local.tokens > 0 and now < local.lease_expires:
+            local.tokens -= 1
+            return True, 0.0, "local"
+
+        # A lease spent before it expired marks the key hot; otherwise lease one token
+        # and hand back whatever the expired lease did not use
+        returned = local.tokens
+        wanted = self._lease_size(capacity) if now < local.lease_expires else 1
+        local.tokens = 0
+        try:
+            granted, retry_after = await self._take_remote(key, capacity, rate, wanted, returned)
+        except Exception as e:
+            # Fail open: an unavailable Redis must not take posting down with it
+            logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+            local.tokens = returned
+            return True, 0.0, "error"
+
+        if granted <= 0:
+            local.tokens = 0
+            local.denied_until = now + retry_after
+            return False, retry_after, "redis"
+
+        local.tokens = granted - 1
+        local.lease_expires = now + settings.rate_limit_lease_seconds
+        return True, 0.0, "redis"
+
+    def prune(self):
+        """Drop local state that no longer affects decisions"""
+        now = time.monotonic()
+        for key in [key for key, local in self._local.items()
+                    if now >= local.denied_until and (local.tokens == 0 or now >= local.lease_expires)]:
+            del self._local[key]
+
+limiter = TokenBucketLimiter()
+
+def _route_limits(route: str) -> List[Tuple[str, str]]:
+    """(scope, spec) pairs configured for a route"""
+    return [
+        ("user", getattr(settings, f"rate_limit_{route}_user", "")),
+        ("channel", getattr(settings, f"rate_limit_{route}_channel", "")),
+        ("route", getattr(settings, f"rate_limit_{route}_route", "")),
+    ]
+
+async def enforce(route: str, user_id: str, channel_id: Optional[str] = None):
+    """Raise 429 if any configured bucket for this request is empty"""
+    if not settings.rate_limit_enabled:
+        return
+    if len(limiter._local) > settings.rate_limit_local_max_keys:
+        limiter.prune()
+
+    limited = False
+    retry_after = 0.0
+    for scope, spec in _route_limits(route):
+        limit = parse_limit(spec)
+        if limit is None:
+            continue
+        if scope == "user":
+            key = f"rl:{route}:user:{user_id}"
+        elif scope == "channel":
+            if not channel_id:
+                continue
+            key = f"rl:{route}:channel:{channel_id}"
+        else:
+            key = f"rl:{route}"
+
+        allowed, wait, source = await limiter.acquire(key, *limit)
+        rate_limit_decisions_total.inc((route, scope, "allowed" if allowed else "limited", source))
+        if not allowed:
+            limited = True
+            retry_after = max(retry_after, wait)
+
+    if limited:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+def rate_limit(route: str):
+    """Route dependency applying the per-user, per-channel and per-route limits for ``route``"""
+
+    async def dependency(request: Request, current_user: User = Depends(get_current_user)):
+        await enforce(route, current_user.id, request.path_params.get("channel_id"))
+
+    return dependency
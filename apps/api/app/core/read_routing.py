@@ -0,0 +1,236 @@
+"""
+Read routing to Mongo secondaries.
+
+Each read endpoint has a read preference in Settings
+(``read_preference_<endpoint>``); non-primary preferences carry
+``read_max_staleness_seconds``. To keep read-your-writes for the author, every
+request that writes records the cluster time of its last write for the
+current user in Redis. For ``read_your_writes_window_seconds`` afterwards that
+user's routed reads either go to the primary (``read_your_writes_mode =
+"primary"``) or run in a causally consistent session advanced past that write,
+so a secondary only answers once it has caught up (``"session"``).
+"""
+import contextlib
+import contextvars
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import bson
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.metrics import registry
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+WRITE_COMMANDS = {"insert", "update", "delete", "findAndModify"}
+
+_current_request: contextvars.ContextVar[Optional["RequestReads"]] = contextvars.ContextVar(
+    "read_routing_request", default=None
+)
+
+routed_reads_total = registry.counter(
+    "mongo_routed_reads_total", "Routed read requests by endpoint and chosen preference",
+    ("endpoint", "preference")
+)
+
+class RequestReads:
+    """Per-request state: who is calling, the last write seen, sessions to close"""
+
+    __slots__ = ("user_id", "wrote", "operation_time", "cluster_time", "sessions")
+
+    def __init__(self):
+        self.user_id: Optional[str] = None
+        self.wrote = False
+        self.operation_time = None
+        self.cluster_time = None
+        self.sessions: List[Any] = []
+
+def read_preference(name: str):
+    staleness = settings.read_max_staleness_seconds
+    preferences = {
+        "primary": lambda: Primary(),
+        "primaryPreferred": lambda: PrimaryPreferred(max_staleness=staleness),
+        "secondary": lambda: Secondary(max_staleness=staleness),
+        "secondaryPreferred": lambda: SecondaryPreferred(max_staleness=staleness),
+        "nearest": lambda: Nearest(max_staleness=staleness),
+    }
+    if name not in preferences:
+        raise ValueError(f"Unknown read preference: {name}")
+    return preferences[name]()
+
+def set_request_user(user_id: str):
+    """Called by authentication so writes in this request are attributed to the user"""
+    request = _current_request.get()
+    if request is not None:
+        request.user_id = user_id
+
+class WriteTimeListener(monitoring.CommandListener):
+    """Remembers the operation and cluster time of the current request's writes"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name not in WRITE_COMMANDS:
+            return
+        request = _current_request.get()
+        if request is None:
+            return
+        request.wrote = True
+        reply = event.reply
+        if "operationTime" in reply:
+            request.operation_time = reply["operationTime"]
+        if "$clusterTime" in reply:
+            request.cluster_time = reply["$clusterTime"]
+
+    def failed(self, event):
+        pass
+
+def note_write():
+    """Mark the current request as writing when the write itself runs elsewhere (e.g. group commit)"""
+    request = _current_request.get()
+    if request is not None:
+        request.wrote = True
+
+def _write_key(user_id: str) -> str:
+    return f"rw:{user_id}"
+
+async def record_write(request: RequestReads):
+    token = {"at": time.time()}
+    if request.operation_time is not None:
+        token["operationTime"] = request.operation_time
+    if request.cluster_time is not None:
+        token["clusterTime"] = request.cluster_time
+    await get_redis().set(
+        _write_key(request.user_id), bson.encode(token), ex=settings.read_your_writes_window_seconds
+    )
+
+async def recent_write(user_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        raw = await get_redis().get(_write_key(user_id))
+    except Exception as e:
+        # Without the marker we cannot prove the read is safe on a secondary
+        logger.warning(f"Read routing unavailable, reading from primary: {e}")
+        return {"at": time.time()}
+    return bson.decode(raw) if raw else None
+
+class _SessionCollection:
+    """Collection proxy that runs every call inside a causally consistent session"""
+
+    def __init__(self, collection, session):
+        self._collection = collection
+        self._session = session
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            kwargs.setdefault("session", self._session)
+            return attr(*args, **kwargs)
+
+        return call
+
+class SessionDatabase:
+    def __init__(self, database, session):
+        self._database = database
+        self._session = session
+
+    def __getattr__(self, name):
+        return _SessionCollection(getattr(self._database, name), self._session)
+
+    def __getitem__(self, name):
+        return _SessionCollection(self._database[name], self._session)
+
+async def get_read_db(endpoint: str, user_id: Optional[str] = None):
+    """Database handle for the reads of ``endpoint``, honouring read-your-writes for ``user_id``"""
+    db = get_db()
+    if not settings.read_routing_enabled:
+        return db
+
+    name = getattr(settings, f"read_preference_{endpoint}", "primary")
+    if name == "primary":
+        routed_reads_total.inc((endpoint, name))
+        return db
+
+    token = await recent_write(user_id) if user_id else None
+    if token is not None and (
+        settings.read_your_writes_mode == "primary" or "clusterTime" not in token
+    ):
+        routed_reads_total.inc((endpoint, "primary_after_write"))
+        return db
+
+    routed = db.with_options(read_preference=read_preference(name))
+    if token is None:
+        routed_reads_total.inc((endpoint, name))
+        return routed
+
+    session = await db.client.start_session(causal_consistency=True)
+    session.advance_cluster_time(token["clusterTime"])
+    session.advance_operation_time(token.get("operationTime", token["clusterTime"]["clusterTime"]))
+    request = _current_request.get()
+    if request is not None:
+        request.sessions.append(session)
+    routed_reads_total.inc((endpoint, f"{name}_causal"))
+    return SessionDatabase(routed, session)
+
+class ReadRoutingMiddleware:
+    """ASGI middleware tracking writes per request and recording them for their author"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestReads()
+        token = _current_request.set(request)
+
+        async def send_wrapper(message):
+            # Record before the client sees the response, so its next read is routed correctly
+            if message["type"] == "http.response.start" and request.wrote and request.user_id:
+                try:
+                    await record_write(request)
+                except Exception as e:
+                    logger.warning(f"Failed to record write for {request.user_id}: {e}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            for session in request.sessions:
+                await session.end_session()
+
+@contextlib.asynccontextmanager
+async def tracked_writes(user_id: str):
+    """What ReadRoutingMiddleware does for an HTTP request, for work outside one (WebSocket RPCs).
+
+    The write is recorded on exit, so callers reply after leaving the block.
+    """
+    if not settings.read_routing_enabled:
+        yield None
+        return
+
+    request = RequestReads()
+    request.user_id = user_id
+    token = _current_request.set(request)
+    try:
+        yield request
+    finally:
+        _current_request.reset(token)
+        for session in request.sessions:
+            await session.end_session()
+        if request.wrote:
+            try:
+                await record_write(request)
+            except Exception as e:
+                logger.warning(f"Failed to record write for {user_id}: {e}")
@@ -0,0 +1,58 @@
+from redis.asyncio import BlockingConnectionPool
+from app.core.config import settings
+from app.core.profiling import ProfiledRedis
+
+class TrackedConnectionPool(BlockingConnectionPool):
+    """Blocking pool that counts callers waiting for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+
+    async def get_connection(self, command_name, *keys, **options):
+        self.waiting += 1
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_connections,
+            "checked_out": len(self._in_use_connections),
+            "idle": len(self._available_connections),
+            "waiting": self.waiting,
+        }
+
+class RedisState:
+    client: ProfiledRedis = None
+    pool: TrackedConnectionPool = None
+
+redis_state = RedisState()
+
+def get_redis():
+    """Get or create the shared Redis client with lazy initialization"""
+    if redis_state.client is None:
+        redis_state.pool = TrackedConnectionPool.from_url(
+            settings.redis_url,
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_connect_timeout,
+            health_check_interval=settings.redis_health_check_interval,
+        )
+        redis_state.client = ProfiledRedis(connection_pool=redis_state.pool)
+    return redis_state.client
+
+async def close_redis():
+    if redis_state.client is not None:
+        await redis_state.client.close()
+        if redis_state.pool is not None:
+            await redis_state.pool.disconnect()
+        redis_state.client = None
+        redis_state.pool = None
+
+def redis_pool_stats() -> dict:
+    if redis_state.pool is None:
+        return {"initialized": False}
+    return {"initialized": True, **redis_state.pool.stats()}
@@ -0,0 +1,71 @@
+"""
+Single-flight read coalescing.
+
+When many clients ask for the same thing at once (a channel's latest page right
+after an announcement), only the first caller runs the database reads; callers
+with the same key that arrive while it is in flight wait for it and get the
+same result object. Nothing is kept once the flight lands, so this never
+serves anything older than a read that was already running.
+
+Keys carry the version counters the caller has just read itself (see
+app/core/http_cache.py), so a caller never joins a flight that started before
+a write it has already seen. Results are shared between callers and must not
+be mutated. Access checks stay with each caller, before or after the flight.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.read_routing import SessionDatabase
+
+logger = logging.getLogger(__name__)
+
+singleflight_calls_total = registry.counter(
+    "singleflight_calls_total", "Coalescable reads by flight and whether they ran or joined one", ("flight", "result")
+)
+
+def read_key(db, *parts) -> Optional[tuple]:
+    """Flight key for reads on ``db``, or None when they must not be shared.
+
+    Causally consistent sessions belong to one user's read-your-writes window.
+    """
+    if isinstance(db, SessionDatabase):
+        return None
+    preference = getattr(db, "read_preference", None)
+    return (getattr(preference, "name", None),) + parts
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Optional[Hashable], fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``fn``, or wait for the identical call already in flight under ``key``"""
+        if key is None or not settings.singleflight_enabled:
+            singleflight_calls_total.inc((self.name, "bypassed"))
+            return await fn()
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            singleflight_calls_total.inc((self.name, "shared"))
+        else:
+            singleflight_calls_total.inc((self.name, "leader"))
+            # A task of its own, so a leader whose client disconnects does not fail the others
+            flight = asyncio.ensure_future(fn())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._land(key, done))
+        return await asyncio.shield(flight)
+
+    def _land(self, key: Hashable, flight: asyncio.Task):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled() and flight.exception() is not None:
+            logger.debug(f"Shared read {self.name} failed: {flight.exception()}")
+
+channel_reads = SingleFlight("get_channels")
+history_reads = SingleFlight("get_messages")
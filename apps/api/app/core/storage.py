@@ -0,0 +1,93 @@
+from fastapi import HTTPException, status
+from minio import Minio
+import urllib3
+import logging
+
+from app.core.config import settings
+from app.core.metrics import InstrumentedMinio
+from app.core.profiling import ProfiledMinio
+
+logger = logging.getLogger(__name__)
+
+class StorageState:
+    client = None
+    http_client: urllib3.PoolManager = None
+
+storage = StorageState()
+
+def _create_http_client() -> urllib3.PoolManager:
+    """Pooled HTTP client sized for the worker instead of the MinIO SDK defaults"""
+    return urllib3.PoolManager(
+        num_pools=settings.minio_num_pools,
+        maxsize=settings.minio_max_pool_size,
+        block=True,
+        timeout=urllib3.Timeout(
+            connect=settings.minio_connect_timeout,
+            read=settings.minio_read_timeout,
+        ),
+        retries=urllib3.Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504],
+        ),
+    )
+
+def get_minio_client():
+    """Get or create MinIO client with lazy initialization"""
+    if storage.client is None:
+        try:
+            storage.http_client = _create_http_client()
+            client = Minio(
+                settings.minio_endpoint,
+                access_key=settings.minio_access_key,
+                secret_key=settings.minio_secret_key,
+                secure=False,  # Set to True for HTTPS
+                http_client=storage.http_client
+            )
+
+            # Ensure bucket exists
+            if not client.bucket_exists(settings.minio_bucket):
+                client.make_bucket(settings.minio_bucket)
+                logger.info(f"Created MinIO bucket: {settings.minio_bucket}")
+
+            storage.client = ProfiledMinio(InstrumentedMinio(client))
+        except Exception as e:
+            logger.error(f"Failed to initialize MinIO client: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="File storage service is not available"
+            )
+
+    return storage.client
+
+def close_storage():
+    if storage.http_client is not None:
+        storage.http_client.clear()
+    storage.client = None
+    storage.http_client = None
+
+def minio_pool_stats() -> dict:
+    if storage.http_client is None:
+        return {"initialized": False}
+    checked_out = 0
+    idle = 0
+    opened = 0
+    for key in list(storage.http_client.pools.keys()):
+        pool = storage.http_client.pools.get(key)
+        if pool is None or pool.pool is None:
+            continue
+        # The LIFO queue holds idle connections plus never-opened slots (None);
+        # whatever is missing from it is checked out
+        slots = list(pool.pool.queue)
+        idle += sum(1 for conn in slots if conn is not None)
+        checked_out += pool.pool.maxsize - len(slots)
+        opened += pool.num_connections
+    in_flight = getattr(storage.client, "in_flight", 0)
+    return {
+        "initialized": True,
+        "max_size": settings.minio_max_pool_size,
+        "checked_out": checked_out,
+        "idle": idle,
+        "opened_total": opened,
+        "waiting": max(0, in_flight - checked_out),
+    }
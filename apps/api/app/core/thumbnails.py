@@ -0,0 +1,189 @@
+"""
+Thumbnail and preview generation for uploaded images and videos.
+
+Image (and video) uploads are handed to ``thumbnails.enqueue``, which never
+waits: a bounded queue feeds a few consumer tasks that render every size in
+``thumbnail_sizes`` on a process pool, so decoding and resizing never run on
+the event loop or hold the GIL of a web worker. Jobs carry the bytes when the
+caller has them and otherwise read the stored object. Results are stored next
+to the original as ``thumbs/<name>/<size>.webp``, where the name is the
+content's SHA-256 (or the stored filename of older uploads).
+Video posters come from the first frame via ffmpeg when it is installed.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.storage import get_minio_client
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_PREFIX = "thumbs"
+THUMBNAIL_CONTENT_TYPE = "image/webp"
+
+thumbnail_jobs_total = registry.counter(
+    "thumbnail_jobs_total", "Thumbnail jobs by outcome", ("outcome",)
+)
+thumbnail_render_seconds = registry.histogram(
+    "thumbnail_render_seconds", "Time to render every size of one upload", ("kind",)
+)
+
+def thumbnail_key(name: str, size: int) -> str:
+    return f"{THUMBNAIL_PREFIX}/{name}/{size}.webp"
+
+def wants_thumbnails(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    return content_type.startswith("image/") or (
+        content_type.startswith("video/") and shutil.which(settings.ffmpeg_path) is not None
+    )
+
+def _video_poster(data: bytes, ffmpeg: str) -> bytes:
+    # Containers often keep their index at the end, so ffmpeg needs a seekable file
+    with tempfile.NamedTemporaryFile(suffix=".video") as source:
+        source.write(data)
+        source.flush()
+        result = subprocess.run(
+            [ffmpeg, "-v", "error", "-i", source.name, "-frames:v", "1", "-f", "image2", "-c:v", "png", "pipe:1"],
+            capture_output=True, timeout=30, check=True,
+        )
+    return result.stdout
+
+def render_thumbnails(
+    data: bytes, content_type: str, sizes: Sequence[int], quality: int = 80, ffmpeg: str = "ffmpeg"
+) -> Dict[int, bytes]:
+    """Runs in a pool process: every size as WebP, fitted inside a size x size box"""
+    from PIL import Image, ImageOps
+
+    if content_type.startswith("video/"):
+        data = _video_poster(data, ffmpeg)
+
+    rendered = {}
+    with Image.open(io.BytesIO(data)) as image:
+        # Let the JPEG decoder downscale while decoding instead of decoding full size
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        # Largest first, each derived from the previous one
+        for size in sorted(sizes, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "WEBP", quality=quality, method=4)
+            rendered[size] = buffer.getvalue()
+    return rendered
+
+def _read_object(key: str) -> bytes:
+    obj = get_minio_client().get_object(settings.minio_bucket, key)
+    try:
+        return obj.read()
+    finally:
+        obj.close()
+        obj.release_conn()
+
+class ThumbnailPipeline:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._consumers: List[asyncio.Task] = []
+        self._pending: Set[str] = set()
+
+    def _start(self):
+        workers = settings.thumbnail_workers or os.cpu_count() or 1
+        # Spawned workers: forking a process that already runs threads is unsafe
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._queue = asyncio.Queue(maxsize=settings.thumbnail_queue_size)
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(workers)]
+
+    def enqueue(
+        self, name: str, data: Optional[bytes], content_type: str, source: Optional[str] = None,
+        on_stored: Optional[Callable[[], Awaitable[None]]] = None
+    ) -> bool:
+        """Schedule thumbnails for an upload, reading object ``source`` when ``data`` is None;
+        False if the queue is full"""
+        if name in self._pending:
+            return True
+        if self._queue is None:
+            self._start()
+        try:
+            self._queue.put_nowait((name, data, content_type, source, on_stored))
+        except asyncio.QueueFull:
+            thumbnail_jobs_total.inc(("dropped",))
+            logger.warning(f"Thumbnail queue full, skipping {name}")
+            return False
+        self._pending.add(name)
+        return True
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job: Tuple = await self._queue.get()
+            name, data, content_type, source, on_stored = job
+            kind = content_type.split("/", 1)[0]
+            try:
+                if data is None:
+                    data = await run_in_threadpool(_read_object, source)
+                started = loop.time()
+                rendered = await loop.run_in_executor(
+                    self._pool, render_thumbnails, data, content_type,
+                    tuple(settings.thumbnail_sizes), settings.thumbnail_quality, settings.ffmpeg_path
+                )
+                thumbnail_render_seconds.observe((kind,), loop.time() - started)
+                await store_thumbnails(name, rendered)
+                if on_stored is not None:
+                    await on_stored()
+                thumbnail_jobs_total.inc(("ok",))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                thumbnail_jobs_total.inc(("failed",))
+                logger.warning(f"Thumbnail generation failed for {name}: {e}")
+            finally:
+                self._pending.discard(name)
+                self._queue.task_done()
+
+    async def join(self):
+        """Wait until every queued job has finished"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        for consumer in self._consumers:
+            consumer.cancel()
+        if self._consumers:
+            await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        self._queue = None
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+async def store_thumbnails(name: str, rendered: Dict[int, bytes]):
+    client = get_minio_client()
+    for size, image in rendered.items():
+        await run_in_threadpool(
+            client.put_object, settings.minio_bucket, thumbnail_key(name, size),
+            io.BytesIO(image), len(image), content_type=THUMBNAIL_CONTENT_TYPE
+        )
+
+async def delete_thumbnails(name: str):
+    client = get_minio_client()
+    for size in settings.thumbnail_sizes:
+        try:
+            await run_in_threadpool(client.remove_object, settings.minio_bucket, thumbnail_key(name, size))
+        except Exception as e:
+            logger.warning(f"Failed to remove thumbnail {size} of {name}: {e}")
+
+thumbnails = ThumbnailPipeline()
@@ -0,0 +1,222 @@
+"""
+Tiered message archival.
+
+Messages older than ``archive_after_days`` are moved out of ``messages`` into
+gzip'd NDJSON segments in the MinIO bucket (``archive/<channel_id>/...``),
+oldest first and at most ``archive_segment_size`` per segment. The
+``archive_segments`` collection indexes them per channel with a running
+segment number ``n``, so history pages that go past the hot tier continue
+into the segments newest first. A reply can land in a later segment than its
+parent, so each segment also lists the ``thread_ids`` its replies belong to.
+Decoded segments are kept in a small in-process LRU. Archived messages are
+read-only.
+"""
+import asyncio
+import gzip
+import io
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId, json_util
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.storage import get_minio_client
+from app.crud.read_state import bump_channel_version
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS_COLLECTION = "archive_segments"
+ARCHIVE_PREFIX = "archive"
+
+archive_cache_total = registry.counter(
+    "archive_segment_cache_total", "Archived segment lookups by result", ("result",)
+)
+archived_messages_total = registry.counter(
+    "archived_messages_total", "Messages moved to the archive tier", ()
+)
+
+def encode_segment(messages: List[Dict[str, Any]]) -> bytes:
+    lines = (json_util.dumps(message, json_options=json_util.RELAXED_JSON_OPTIONS) for message in messages)
+    return gzip.compress("\n".join(lines).encode(), compresslevel=6)
+
+def decode_segment(data: bytes) -> List[Dict[str, Any]]:
+    return [json_util.loads(line) for line in gzip.decompress(data).decode().splitlines() if line]
+
+def segment_key(channel_id: str, n: int) -> str:
+    return f"{ARCHIVE_PREFIX}/{channel_id}/{n:08d}.ndjson.gz"
+
+def _get_object(client, key: str) -> bytes:
+    obj = client.get_object(settings.minio_bucket, key)
+    try:
+        return obj.read()
+    finally:
+        obj.close()
+        obj.release_conn()
+
+class SegmentCache:
+    """LRU of decoded segments; concurrent misses for one key share a single download"""
+
+    def __init__(self, max_segments: Optional[int] = None):
+        self.max_segments = max_segments
+        self._segments: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    async def get(self, key: str) -> List[Dict[str, Any]]:
+        if key in self._segments:
+            self._segments.move_to_end(key)
+            archive_cache_total.inc(("hit",))
+            return self._segments[key]
+        if key in self._loading:
+            archive_cache_total.inc(("hit",))
+            return await asyncio.shield(self._loading[key])
+
+        archive_cache_total.inc(("miss",))
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            data = await run_in_threadpool(_get_object, get_minio_client(), key)
+            messages = decode_segment(data)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures are not reported as never retrieved
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(key, None)
+
+        future.set_result(messages)
+        self._segments[key] = messages
+        limit = self.max_segments or settings.archive_cache_segments
+        while len(self._segments) > limit:
+            self._segments.popitem(last=False)
+        return messages
+
+    def discard(self, key: str):
+        self._segments.pop(key, None)
+
+segment_cache = SegmentCache()
+
+async def _finish_pending(db, channel_id: str):
+    """Delete the hot copies of segments a previous run wrote but did not get to clean up"""
+    async for segment in db[SEGMENTS_COLLECTION].find({"channel_id": channel_id, "pending": True}):
+        messages = await segment_cache.get(segment["key"])
+        await db.messages.delete_many({"_id": {"$in": [message["_id"] for message in messages]}})
+        await db[SEGMENTS_COLLECTION].update_one({"_id": segment["_id"]}, {"$set": {"pending": False}})
+
+async def archive_channel(db, channel_id: str, cutoff: datetime) -> int:
+    """Move the channel's messages created before ``cutoff`` into segments"""
+    await _finish_pending(db, channel_id)
+    client = get_minio_client()
+    size = settings.archive_segment_size
+    last = await db[SEGMENTS_COLLECTION].find_one({"channel_id": channel_id}, sort=[("n", -1)])
+    n = last["n"] + 1 if last else 0
+    archived = 0
+
+    while True:
+        batch = await db.messages.find(
+            {"channel_id": channel_id, "created_at": {"$lt": cutoff}}
+        ).sort("created_at", 1).limit(size).to_list(size)
+        if not batch:
+            break
+
+        key = segment_key(channel_id, n)
+        data = encode_segment(batch)
+        await run_in_threadpool(
+            client.put_object, settings.minio_bucket, key, io.BytesIO(data), len(data),
+            content_type="application/gzip"
+        )
+        # Indexed as pending until the hot copies are gone, so reads never see a message twice
+        segment_id = (await db[SEGMENTS_COLLECTION].insert_one({
+            "channel_id": channel_id,
+            "n": n,
+            "key": key,
+            "count": len(batch),
+            "bytes": len(data),
+            "first_created_at": batch[0]["created_at"],
+            "last_created_at": batch[-1]["created_at"],
+            "thread_ids": list({message["thread_id"] for message in batch if message.get("thread_id")}),
+            "pending": True,
+            "archived_at": datetime.utcnow(),
+        })).inserted_id
+        await db.channels.update_one({"_id": ObjectId(channel_id)}, {"$inc": {"archived_count": len(batch)}})
+        await db.messages.delete_many({"_id": {"$in": [message["_id"] for message in batch]}})
+        await db[SEGMENTS_COLLECTION].update_one({"_id": segment_id}, {"$set": {"pending": False}})
+
+        archived += len(batch)
+        archived_messages_total.inc((), len(batch))
+        n += 1
+        if len(batch) < size:
+            break
+
+    if archived:
+        await bump_channel_version(db, channel_id)
+    return archived
+
+async def archive_messages(db, cutoff: datetime, channel_ids: Optional[List[str]] = None) -> Dict[str, int]:
+    if channel_ids is None:
+        channel_ids = [str(channel["_id"]) async for channel in db.channels.find({}, {"_id": 1})]
+    results = {}
+    for channel_id in channel_ids:
+        results[channel_id] = await archive_channel(db, channel_id, cutoff)
+        if results[channel_id]:
+            logger.info(f"Archived {results[channel_id]} messages of channel {channel_id}")
+    return results
+
+async def read_archived(
+    db, channel_id: str, skip: int, limit: int
+) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """Archived messages newest first, past ``skip``, each with its archived thread replies"""
+    page = []
+    # Parent id -> (its segment, its replies)
+    threads: Dict[ObjectId, Tuple[str, List[Dict[str, Any]]]] = {}
+    segments = db[SEGMENTS_COLLECTION].find(
+        {"channel_id": channel_id, "pending": False}, {"key": 1, "count": 1}
+    ).sort("n", -1)
+    async for segment in segments:
+        if skip >= segment["count"]:
+            skip -= segment["count"]
+            continue
+        messages = await segment_cache.get(segment["key"])
+        newest_first = messages[::-1]
+        for message in newest_first[skip:skip + limit - len(page)]:
+            # Copies, since callers decorate messages and these dicts live in the cache
+            replies = [dict(reply) for reply in messages if reply.get("thread_id") == message["_id"]]
+            page.append((dict(message), replies))
+            threads[message["_id"]] = (segment["key"], replies)
+        skip = 0
+        if len(page) >= limit:
+            break
+
+    if threads:
+        await _add_later_replies(db, channel_id, threads)
+    return page
+
+async def _add_later_replies(db, channel_id: str, threads: Dict[ObjectId, Tuple[str, List[Dict[str, Any]]]]):
+    """Append replies archived into a later segment than their parent"""
+    segments = db[SEGMENTS_COLLECTION].find(
+        {"channel_id": channel_id, "pending": False, "thread_ids": {"$in": list(threads)}}, {"key": 1}
+    ).sort("n", 1)
+    async for segment in segments:
+        for reply in await segment_cache.get(segment["key"]):
+            thread = threads.get(reply.get("thread_id"))
+            # Replies in the parent's own segment were picked up with it
+            if thread is not None and thread[0] != segment["key"]:
+                thread[1].append(dict(reply))
+
+async def delete_channel_archive(db, channel_id: str):
+    """Remove a deleted channel's segments; storage failures leave orphans behind, not errors"""
+    keys = [segment["key"] async for segment in db[SEGMENTS_COLLECTION].find({"channel_id": channel_id}, {"key": 1})]
+    if not keys:
+        return
+    await db[SEGMENTS_COLLECTION].delete_many({"channel_id": channel_id})
+    try:
+        client = get_minio_client()
+        for key in keys:
+            segment_cache.discard(key)
+            await run_in_threadpool(client.remove_object, settings.minio_bucket, key)
+    except Exception as e:
+        logger.warning(f"Failed to remove archived segments of channel {channel_id}: {e}")
@@ -0,0 +1,221 @@
+"""
+Content-addressed file storage.
+
+Every upload gets its own ``files`` document (the handle clients see, keyed
+by ``stored_filename``), while the bytes live once per SHA-256 in
+``blobs/<sha256>`` with a reference count in ``file_objects``. Uploading
+content that is already stored only adds a reference; the object is removed
+when its last reference goes.
+
+A blob being removed is marked ``deleting`` first. Uploaders never take a
+reference on such a blob and never write its object until they own a fresh
+``file_objects`` document, so a removal can never delete bytes that a new
+upload relies on.
+
+A blob stays ``ready: False`` while its first uploaders write it. If they all
+die, their references would keep it forever: after ``STALE_UPLOAD`` the next
+upload of the same content takes the document over with only its own
+reference, and ``collect_stale_blobs`` removes the ones nobody uploads again.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.storage import get_minio_client
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = "blobs"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# A removal that has not finished within this long is assumed to have died
+STALE_DELETE = timedelta(minutes=5)
+# Likewise for the uploaders of content that never became ready
+STALE_UPLOAD = timedelta(hours=1)
+
+uploads_total = registry.counter(
+    "file_uploads_total", "Uploads by whether their content was already stored", ("result",)
+)
+
+class UploadTooLarge(Exception):
+    pass
+
+def blob_key(digest: str) -> str:
+    return f"{BLOB_PREFIX}/{digest}"
+
+def unique_stored_filename(filename: str) -> str:
+    file_extension = filename.split('.')[-1] if '.' in filename else ''
+    return f"{uuid.uuid4()}.{file_extension}" if file_extension else str(uuid.uuid4())
+
+async def read_upload(upload, max_bytes: int) -> Tuple[bytes, str]:
+    """Read an UploadFile in chunks, hashing as it arrives"""
+    hasher = hashlib.sha256()
+    chunks = []
+    size = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge()
+        hasher.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), hasher.hexdigest()
+
+async def add_reference(db, digest: str) -> Optional[Dict[str, Any]]:
+    """Take a reference on stored content, or None if it is not (or no longer) stored"""
+    return await db.file_objects.find_one_and_update(
+        {"_id": digest, "ready": True, "deleting": {"$ne": True}},
+        {"$inc": {"refs": 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def store_blob(db, digest: str, data: bytes, content_type: Optional[str]) -> bool:
+    """Reference ``data`` by digest, uploading it only if it is not stored yet; True if deduplicated"""
+    return await store_content(db, digest, len(data), content_type, lambda: put_blob(digest, data, content_type))
+
+async def store_content(db, digest: str, size: int, content_type: Optional[str],
+                        write: Callable[[], Awaitable[None]]) -> bool:
+    """Reference content by digest, calling ``write`` to create ``blob_key(digest)`` only if needed"""
+    for _ in range(settings.file_dedup_retries):
+        if await add_reference(db, digest):
+            uploads_total.inc(("deduplicated",))
+            return True
+        try:
+            await db.file_objects.insert_one({
+                "_id": digest,
+                "key": blob_key(digest),
+                "size": size,
+                "content_type": content_type,
+                "refs": 1,
+                "ready": False,
+                "created_at": datetime.utcnow(),
+            })
+        except DuplicateKeyError:
+            existing = await db.file_objects.find_one({"_id": digest})
+            if existing and existing.get("deleting") and existing["deleting_at"] < datetime.utcnow() - STALE_DELETE:
+                await db.file_objects.delete_one({"_id": digest, "deleting": True})
+            elif existing and _stale_upload(existing):
+                # Its uploaders died before storing it: drop their references and store it ourselves
+                claimed = await db.file_objects.update_one(
+                    {"_id": digest, "ready": False, "deleting": {"$ne": True}, "created_at": existing["created_at"]},
+                    {"$set": {"refs": 1, "created_at": datetime.utcnow()}}
+                )
+                if claimed.modified_count:
+                    await _write_ready(db, digest, write)
+                    uploads_total.inc(("stored",))
+                    return False
+            elif existing and not existing.get("deleting"):
+                # Another upload of the same bytes is in progress; writing them too is harmless
+                joined = await db.file_objects.update_one(
+                    {"_id": digest, "deleting": {"$ne": True}}, {"$inc": {"refs": 1}}
+                )
+                if joined.modified_count:
+                    await _write_ready(db, digest, write)
+                    uploads_total.inc(("deduplicated",))
+                    return True
+            else:
+                await asyncio.sleep(0.05)
+            continue
+
+        await _write_ready(db, digest, write)
+        uploads_total.inc(("stored",))
+        return False
+    raise RuntimeError(f"Content {digest} stayed locked by a removal")
+
+def _stale_upload(blob: Dict[str, Any]) -> bool:
+    return (
+        not blob.get("ready") and not blob.get("deleting")
+        and blob["created_at"] < datetime.utcnow() - STALE_UPLOAD
+    )
+
+async def _write_ready(db, digest: str, write: Callable[[], Awaitable[None]]):
+    """Write content the caller holds a reference on, then mark it ready"""
+    try:
+        await write()
+    except Exception:
+        await release_blob(db, digest)
+        raise
+    await db.file_objects.update_one({"_id": digest}, {"$set": {"ready": True}})
+
+async def put_blob(digest: str, data: bytes, content_type: Optional[str]):
+    client = get_minio_client()
+    await run_in_threadpool(
+        client.put_object, settings.minio_bucket, blob_key(digest), io.BytesIO(data), len(data),
+        content_type=content_type or "application/octet-stream"
+    )
+
+async def release_blob(db, digest: str) -> bool:
+    """Drop one reference; removes the object with the last one. True if it was removed"""
+    blob = await db.file_objects.find_one_and_update(
+        {"_id": digest}, {"$inc": {"refs": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if blob is None or blob["refs"] > 0:
+        return False
+
+    claimed = await db.file_objects.update_one(
+        {"_id": digest, "refs": {"$lte": 0}, "deleting": {"$ne": True}},
+        {"$set": {"deleting": True, "deleting_at": datetime.utcnow()}},
+    )
+    if not claimed.modified_count:
+        return False
+    client = get_minio_client()
+    await run_in_threadpool(client.remove_object, settings.minio_bucket, blob["key"])
+    await db.file_objects.delete_one({"_id": digest, "deleting": True})
+    return True
+
+async def collect_stale_blobs(db) -> int:
+    """Remove content whose uploaders all died before storing it; returns how many"""
+    cutoff = datetime.utcnow() - STALE_UPLOAD
+    stale = {"ready": False, "deleting": {"$ne": True}, "created_at": {"$lt": cutoff}}
+    removed = 0
+    async for blob in db.file_objects.find(stale, {"key": 1}):
+        # No file references content before it is ready, so nothing else holds it
+        claimed = await db.file_objects.update_one(
+            {"_id": blob["_id"], **stale}, {"$set": {"deleting": True, "deleting_at": datetime.utcnow()}}
+        )
+        if not claimed.modified_count:
+            continue
+        client = get_minio_client()
+        await run_in_threadpool(client.remove_object, settings.minio_bucket, blob["key"])
+        await db.file_objects.delete_one({"_id": blob["_id"], "deleting": True})
+        removed += 1
+    return removed
+
+async def has_thumbnails(db, digest: str) -> bool:
+    return await db.file_objects.count_documents({"_id": digest, "thumbnails": True}, limit=1) > 0
+
+async def mark_thumbnails(db, digest: str):
+    """Record that thumbnails for this content are stored, so later references stop queueing them"""
+    await db.file_objects.update_one({"_id": digest}, {"$set": {"thumbnails": True}})
+
+async def create_file(db, stored_filename: str, filename: str, digest: str, size: int,
+                      content_type: Optional[str], uploaded_by: str) -> Dict[str, Any]:
+    document = {
+        "filename": filename,
+        "stored_filename": stored_filename,
+        "sha256": digest,
+        "size": size,
+        "content_type": content_type,
+        "uploaded_by": uploaded_by,
+        "created_at": datetime.utcnow(),
+    }
+    document["_id"] = (await db.files.insert_one(document)).inserted_id
+    return document
+
+async def get_file(db, stored_filename: str) -> Optional[Dict[str, Any]]:
+    return await db.files.find_one({"stored_filename": stored_filename})
+
+async def delete_file_record(db, stored_filename: str) -> Optional[Dict[str, Any]]:
+    return await db.files.find_one_and_delete({"stored_filename": stored_filename})
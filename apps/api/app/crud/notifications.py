@@ -0,0 +1,134 @@
+"""
+Mention notifications.
+
+Posting a message only parses its mentions and queues one job; resolving
+``@channel`` and ``@here`` to users, storing a notification per user, bumping
+their mention counters and pushing to their sockets happens in
+``scripts/notification_worker.py``. A post costs the same whether it mentions
+one person or a 20k member channel.
+
+Every user can read every channel, so ``@channel`` notifies all users and
+``@here`` those online. Both are announced to sockets with a single broadcast
+frame rather than one frame per user. Jobs can be delivered twice: the unique
+(user_id, message_id) index drops repeated notifications and unread counts
+ignore repeated mention seqs.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.core.jobs import JobQueue
+from app.crud.read_state import add_mention_seqs, parse_mentions
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS_COLLECTION = "notifications"
+BROADCAST_MENTIONS = {"channel", "here"}
+DUPLICATE_KEY = 11000
+
+notification_jobs = JobQueue("notify")
+
+def mention_job(channel_id: str, message_id: str, seq: int, author_id: str, content: str) -> Optional[Dict[str, Any]]:
+    """The fan-out job for a new message, or None if it mentions nobody"""
+    names = parse_mentions(content)
+    if not names:
+        return None
+    return {
+        "channel_id": channel_id,
+        "message_id": message_id,
+        "seq": seq,
+        "author_id": author_id,
+        "usernames": sorted(names - BROADCAST_MENTIONS),
+        "channel": "channel" in names,
+        "here": "here" in names,
+        "preview": content[:settings.notification_preview_chars],
+    }
+
+async def queue_mentions(channel_id: str, message_id: str, seq: int, author_id: str, content: str):
+    job = mention_job(channel_id, message_id, seq, author_id, content)
+    if job is None:
+        return
+    try:
+        await notification_jobs.enqueue(job)
+    except Exception as e:
+        # The message itself is stored; only its notifications are lost
+        logger.error(f"Failed to queue mentions for message {message_id}: {e}")
+
+def _frame(job: Dict[str, Any], reason: str) -> Dict[str, Any]:
+    return {
+        "type": "mention",
+        "reason": reason,
+        "channel_id": job["channel_id"],
+        "message_id": job["message_id"],
+        "seq": job["seq"],
+        "author_id": job["author_id"],
+    }
+
+async def _notify(db, manager, job: Dict[str, Any], recipients: List[Tuple[str, str]]):
+    """Store and count one batch of (user_id, reason) notifications; push the direct ones"""
+    now = datetime.utcnow()
+    try:
+        await db[NOTIFICATIONS_COLLECTION].insert_many([
+            {
+                "user_id": user_id,
+                "channel_id": job["channel_id"],
+                "message_id": job["message_id"],
+                "seq": job["seq"],
+                "author_id": job["author_id"],
+                "reason": reason,
+                "preview": job["preview"],
+                "created_at": now,
+            }
+            for user_id, reason in recipients
+        ], ordered=False)
+    except BulkWriteError as e:
+        # Notifications stored by an earlier delivery of this job
+        if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+    await add_mention_seqs(db, job["channel_id"], job["seq"], [user_id for user_id, _ in recipients])
+    for user_id, reason in recipients:
+        if reason == "mention":
+            await manager.send_to_user(user_id, {**_frame(job, reason), "preview": job["preview"]})
+
+async def deliver_mentions(db, manager, job: Dict[str, Any]):
+    """Run one mention job (see notification_jobs)"""
+    author_id = job["author_id"]
+    reasons: Dict[str, str] = {}
+    if job["usernames"]:
+        async for user in db.users.find({"username": {"$in": job["usernames"]}}, {"_id": 1}):
+            reasons[str(user["_id"])] = "mention"
+    if job["here"] and not job["channel"]:
+        for user_id in await manager.online_users():
+            reasons.setdefault(user_id, "here")
+    reasons.pop(author_id, None)
+
+    size = settings.notification_batch_size
+    recipients = list(reasons.items())
+    for start in range(0, len(recipients), size):
+        await _notify(db, manager, job, recipients[start:start + size])
+
+    if job["channel"]:
+        batch: List[Tuple[str, str]] = []
+        async for user in db.users.find({}, {"_id": 1}):
+            user_id = str(user["_id"])
+            if user_id == author_id or user_id in reasons:
+                continue
+            batch.append((user_id, "channel"))
+            if len(batch) >= size:
+                await _notify(db, manager, job, batch)
+                batch = []
+        if batch:
+            await _notify(db, manager, job, batch)
+
+    if job["channel"] or job["here"]:
+        await manager.broadcast_json(_frame(job, "channel" if job["channel"] else "here"))
+
+async def get_notifications(db, user_id: str, limit: int) -> List[Dict[str, Any]]:
+    cursor = db[NOTIFICATIONS_COLLECTION].find({"user_id": user_id}).sort("created_at", -1).limit(limit)
+    return [document async for document in cursor]
+
+async def delete_channel_notifications(db, channel_id: str):
+    await db[NOTIFICATIONS_COLLECTION].delete_many({"channel_id": channel_id})
@@ -0,0 +1,204 @@
+"""
+Per-user read cursors and mention counters.
+
+Every channel keeps a ``last_seq`` counter that is bumped for each new message,
+and every message stores its ``seq``. A read marker records the highest seq a
+user has read in a channel plus the seqs of messages that mentioned them, so
+unread and mention counts are plain arithmetic over one small document per
+channel instead of counting messages.
+
+Seqs are allocated before the message is written, so a failed insert leaves a
+seq without a message, and deleted messages leave theirs behind. Both are
+pushed onto the channel's ``gap_seqs`` and never count as unread or as
+mentions. Only the newest ``read_marker_max_gaps`` gaps are kept: a reader
+whose cursor is older than all of them may see a slightly high unread count.
+"""
+import asyncio
+import logging
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+channel_version_bumps_total = registry.counter(
+    "channel_version_bumps_total", "Channel version bumps applied, and callers that joined one", ("result",)
+)
+
+MENTION_PATTERN = re.compile(r"(?<![\w@])@([A-Za-z0-9_.-]+)")
+
+def parse_mentions(content: str) -> Set[str]:
+    return {name.rstrip(".") for name in MENTION_PATTERN.findall(content)}
+
+class ChannelVersions:
+    """
+    Coalesces version bumps of the same channel.
+
+    A bump only covers writes that landed before its ``$inc`` started, so
+    callers share the next bump that has not started yet: while one is being
+    applied, everyone who arrives joins the single follow-up. A busy channel's
+    document takes at most one version write per round trip instead of one per
+    message, next to the ``allocate_rev`` write every change already makes.
+    """
+
+    def __init__(self):
+        self._queued: Dict[str, asyncio.Future] = {}
+        self._running: Dict[str, asyncio.Future] = {}
+
+    async def bump(self, db, channel_id: str):
+        queued = self._queued.get(channel_id)
+        if queued is None:
+            queued = self._queued[channel_id] = asyncio.ensure_future(
+                self._apply(db, channel_id, self._running.get(channel_id))
+            )
+        else:
+            channel_version_bumps_total.inc(("coalesced",))
+        await asyncio.shield(queued)
+
+    async def _apply(self, db, channel_id: str, previous: Optional[asyncio.Future]):
+        if previous is not None:
+            await asyncio.wait({previous})
+        task = asyncio.current_task()
+        del self._queued[channel_id]
+        self._running[channel_id] = task
+        try:
+            await db.channels.update_one({"_id": ObjectId(channel_id)}, {"$inc": {"version": 1}})
+            channel_version_bumps_total.inc(("applied",))
+        finally:
+            if self._running.get(channel_id) is task:
+                del self._running[channel_id]
+
+channel_versions = ChannelVersions()
+
+async def bump_channel_version(db, channel_id: str):
+    """Invalidate cached channel and history responses (see app/core/http_cache.py).
+
+    Call it after the write it covers: a reader that sees the new version must also see the new data.
+    """
+    await channel_versions.bump(db, channel_id)
+
+async def add_mention_seqs(db, channel_id: str, seq: int, user_ids: List[str]):
+    """Count message ``seq`` as a mention of each user until they read past it"""
+    if not user_ids:
+        return
+    await db.read_markers.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "channel_id": channel_id},
+            {
+                "$push": {"mention_seqs": {"$each": [seq], "$slice": -settings.read_marker_max_mentions}},
+                "$setOnInsert": {"last_read_seq": 0},
+            },
+            upsert=True
+        )
+        for user_id in user_ids
+    ], ordered=False)
+
+async def add_gap_seqs(db, channel_id: str, seqs: List[int]):
+    """Stop counting ``seqs`` as unread: their messages were deleted or never written"""
+    seqs = [seq for seq in seqs if seq]
+    if not seqs:
+        return
+    await db.channels.update_one(
+        {"_id": ObjectId(channel_id)},
+        {"$push": {"gap_seqs": {"$each": seqs, "$slice": -settings.read_marker_max_gaps}}}
+    )
+
+class ReadMarkerBuffer:
+    """
+    Debounces read marker writes.
+
+    Clients report their position as they scroll; only the highest seq per
+    (user, channel) is kept and written once per flush interval in a single
+    unordered bulk write. ``$max`` makes out-of-order flushes from several
+    workers harmless.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    def mark(self, user_id: str, channel_id: str, seq: int):
+        key = (user_id, channel_id)
+        if seq <= self._pending.get(key, 0):
+            return
+        self._pending[key] = seq
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(settings.read_marker_flush_ms / 1000, self._start_flush)
+
+    def pending_for(self, user_id: str) -> Dict[str, int]:
+        return {channel_id: seq for (uid, channel_id), seq in self._pending.items() if uid == user_id}
+
+    def _start_flush(self):
+        self._timer = None
+        if not self._pending:
+            return
+        task = asyncio.ensure_future(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await get_db().read_markers.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "channel_id": channel_id},
+                    {"$max": {"last_read_seq": seq}, "$pull": {"mention_seqs": {"$lte": seq}}},
+                    upsert=True
+                )
+                for (user_id, channel_id), seq in pending.items()
+            ], ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to flush {len(pending)} read markers: {e}")
+            # Keep the positions for the next attempt unless newer ones arrived
+            for key, seq in pending.items():
+                if seq > self._pending.get(key, 0):
+                    self._pending[key] = seq
+
+    async def close(self):
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+read_markers = ReadMarkerBuffer()
+
+async def get_unread_counts(db, user_id: str) -> List[Dict[str, Any]]:
+    """Unread and mention counts for every channel in two queries"""
+    markers = {
+        marker["channel_id"]: marker
+        async for marker in db.read_markers.find(
+            {"user_id": user_id}, {"channel_id": 1, "last_read_seq": 1, "mention_seqs": 1}
+        )
+    }
+    pending = read_markers.pending_for(user_id)
+
+    counts = []
+    async for channel in db.channels.find({}, {"last_seq": 1, "gap_seqs": 1}):
+        channel_id = str(channel["_id"])
+        last_seq = channel.get("last_seq", 0)
+        marker = markers.get(channel_id, {})
+        last_read_seq = max(marker.get("last_read_seq", 0), pending.get(channel_id, 0))
+        gaps = {seq for seq in channel.get("gap_seqs", []) if last_read_seq < seq <= last_seq}
+        counts.append({
+            "channel_id": channel_id,
+            "last_seq": last_seq,
+            "last_read_seq": last_read_seq,
+            "unread_count": max(0, last_seq - last_read_seq - len(gaps)),
+            # A set: a redelivered mention job may have pushed the same seq twice
+            "mention_count": len({
+                seq for seq in marker.get("mention_seqs", []) if seq > last_read_seq and seq not in gaps
+            }),
+        })
+    return counts
@@ -0,0 +1,156 @@
+"""
+Delta sync.
+
+Every change to a channel's content takes the next value of the channel's
+``change_seq`` counter as its ``rev``: new, edited and reacted messages store
+it on the message (with ``rev_at``), deleted messages leave a row in
+``tombstones``, and metadata updates store it as the channel's ``meta_rev``.
+A client resumes by sending the cursor it was given per channel and gets
+back only documents with a higher rev.
+
+Revs are allocated before the write they belong to, so a higher rev can
+become visible before a lower one. Cursors therefore only advance over revs
+allocated more than ``sync_settle_seconds`` ago, by which time every earlier
+write has landed; anything newer is simply sent again on the next sync.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+
+TOMBSTONES_COLLECTION = "tombstones"
+
+async def allocate_rev(db, channel_id: str, message_seq: bool = False) -> Optional[Dict[str, Any]]:
+    """Take the channel's next rev (and message seq); None if the channel does not exist"""
+    increments = {"change_seq": 1}
+    if message_seq:
+        increments["last_seq"] = 1
+    now = datetime.utcnow()
+    channel = await db.channels.find_one_and_update(
+        {"_id": ObjectId(channel_id)},
+        {"$inc": increments, "$set": {"changed_at": now}},
+        projection={"change_seq": 1, "last_seq": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if channel is None:
+        return None
+    return {"rev": channel["change_seq"], "rev_at": now, "seq": channel.get("last_seq", 0)}
+
+async def record_deletions(db, channel_id: str, message_ids: Iterable[ObjectId], rev: Dict[str, Any]):
+    tombstones = [
+        {"channel_id": channel_id, "message_id": str(message_id), "rev": rev["rev"], "rev_at": rev["rev_at"]}
+        for message_id in message_ids
+    ]
+    if tombstones:
+        await db[TOMBSTONES_COLLECTION].insert_many(tombstones)
+
+async def delete_channel_tombstones(db, channel_id: str):
+    await db[TOMBSTONES_COLLECTION].delete_many({"channel_id": channel_id})
+
+def _serialize_channel(channel: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": str(channel["_id"]),
+        "name": channel.get("name"),
+        "description": channel.get("description"),
+        "created_by": str(channel.get("created_by")),
+        "created_at": channel.get("created_at"),
+        "updated_at": channel.get("updated_at"),
+        "last_seq": channel.get("last_seq", 0),
+    }
+
+def _serialize_message(message: Dict[str, Any], users: Dict[Any, Dict[str, Any]]) -> Dict[str, Any]:
+    user = users.get(message["user_id"])
+    return {
+        "id": str(message["_id"]),
+        "channel_id": message["channel_id"],
+        "thread_id": str(message["thread_id"]) if message.get("thread_id") else None,
+        "content": message["content"],
+        "user": {"id": str(user["_id"]), "username": user["username"], "avatar": user.get("avatar")} if user else None,
+        "reactions": [
+            {"id": str(reaction.get("_id", "")), "emoji": reaction["emoji"],
+             "count": reaction["count"], "users": reaction["users"]}
+            for reaction in message.get("reactions", [])
+        ],
+        "seq": message.get("seq"),
+        "rev": message["rev"],
+        "created_at": message["created_at"],
+        "updated_at": message["updated_at"],
+    }
+
+async def _settled_rev(db, channel_id: str, cutoff: datetime) -> int:
+    """The highest rev written before ``cutoff``; every lower rev has landed too"""
+    latest = 0
+    for collection in ("messages", TOMBSTONES_COLLECTION):
+        document = await db[collection].find_one(
+            {"channel_id": channel_id, "rev": {"$exists": True}, "rev_at": {"$lte": cutoff}},
+            {"rev": 1}, sort=[("rev", -1)]
+        )
+        if document:
+            latest = max(latest, document["rev"])
+    return latest
+
+async def changes_since(db, cursors: Dict[str, int]) -> Dict[str, Any]:
+    """Changeset for a client that last synced each channel in ``cursors`` at the given cursor"""
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=settings.sync_settle_seconds)
+    channels = await db.channels.find({}, {
+        "name": 1, "description": 1, "created_by": 1, "created_at": 1, "updated_at": 1,
+        "last_seq": 1, "change_seq": 1, "changed_at": 1, "meta_rev": 1,
+    }).to_list(None)
+
+    entries: List[Dict[str, Any]] = []
+    changed_messages: List[Dict[str, Any]] = []
+    for channel in channels:
+        channel_id = str(channel["_id"])
+        since = cursors.get(channel_id)
+        change_seq = channel.get("change_seq", 0)
+        if since is not None and since == change_seq:
+            continue
+        settled = channel.get("changed_at") is None or channel["changed_at"] <= cutoff
+        entry = {"channel_id": channel_id, "reset": False, "channel": None, "messages": [], "deleted_message_ids": []}
+
+        messages = tombstones = []
+        if since is not None and since < change_seq:
+            limit = settings.sync_max_changes + 1
+            messages = await db.messages.find(
+                {"channel_id": channel_id, "rev": {"$gt": since}}
+            ).sort("rev", 1).limit(limit).to_list(limit)
+            tombstones = await db[TOMBSTONES_COLLECTION].find(
+                {"channel_id": channel_id, "rev": {"$gt": since}}
+            ).sort("rev", 1).limit(limit).to_list(limit)
+
+        if since is None or since > change_seq or len(messages) + len(tombstones) > settings.sync_max_changes:
+            # New to this client, or too much changed: reload the channel with get_messages
+            entry["reset"] = True
+            entry["channel"] = _serialize_channel(channel)
+            entry["cursor"] = change_seq if settled else await _settled_rev(db, channel_id, cutoff)
+            entries.append(entry)
+            continue
+
+        if channel.get("meta_rev", 0) > since:
+            entry["channel"] = _serialize_channel(channel)
+        entry["deleted_message_ids"] = [tombstone["message_id"] for tombstone in tombstones]
+        entry["messages"] = messages
+        changed_messages.extend(messages)
+        if settled:
+            entry["cursor"] = change_seq
+        else:
+            entry["cursor"] = max([since] + [
+                document["rev"] for document in messages + tombstones if document["rev_at"] <= cutoff
+            ])
+        entries.append(entry)
+
+    user_ids = list({message["user_id"] for message in changed_messages})
+    users = {user["_id"]: user async for user in db.users.find({"_id": {"$in": user_ids}})} if user_ids else {}
+    for entry in entries:
+        entry["messages"] = [_serialize_message(message, users) for message in entry["messages"]]
+
+    known = {str(channel["_id"]) for channel in channels}
+    return {
+        "channels": entries,
+        "deleted_channel_ids": [channel_id for channel_id in cursors if channel_id not in known],
+        "synced_at": now,
+    }
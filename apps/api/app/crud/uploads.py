@@ -0,0 +1,349 @@
+"""
+Resumable uploads.
+
+A session maps onto one S3 multipart upload of ``uploads/<session_id>``.
+Clients PUT fixed-size numbered chunks in any order and in parallel, each
+becoming one part; the parts that arrived are tracked in Redis, so an
+interrupted client asks for that list and only sends the rest. Completing a
+session assembles the parts and hands the result to content-addressed storage
+(app/crud/files.py) with a server-side copy.
+
+Content is addressed by its SHA-256, which cannot be combined from per-part
+digests. Each worker hashes the parts it receives while they arrive in order;
+when one worker saw every part in order (a sequential client), completion uses
+that digest. Otherwise (parallel or out-of-order parts, parts spread over
+several workers, a restarted worker) completion reads the assembled object
+back once to hash it, which costs a full download from the object store.
+``resumable_upload_hashes_total`` counts both cases.
+
+If completion fails after the parts were assembled, the assembled object and
+the session are kept, so the client retries completion instead of re-sending
+the file.
+
+Session keys expire after ``upload_session_ttl_seconds`` without activity,
+and ``collect_abandoned_uploads`` aborts multipart uploads older than that so
+their parts do not linger in the bucket.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from minio.commonconfig import CopySource
+from starlette.concurrency import run_in_threadpool
+
+from app.core import multipart
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.redis import get_redis
+from app.core.storage import get_minio_client
+from app.crud.files import blob_key, create_file, release_blob, store_content, unique_stored_filename
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_PREFIX = "uploads"
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+HASH_CHUNK_SIZE = 1024 * 1024
+# Sessions whose in-order hash this worker keeps; older ones fall back to reading back
+MAX_PART_HASHERS = 1024
+
+resumable_upload_hashes_total = registry.counter(
+    "resumable_upload_hashes_total", "Completed resumable uploads by how their SHA-256 was computed", ("source",)
+)
+
+class _PartHasher:
+    """SHA-256 of a session's parts received in order by this worker, with the ETags it covered"""
+    __slots__ = ("hasher", "etags", "lock")
+
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.etags: List[str] = []
+        self.lock = asyncio.Lock()
+
+    @property
+    def next_part(self) -> int:
+        return len(self.etags) + 1
+
+_part_hashers: "OrderedDict[str, _PartHasher]" = OrderedDict()
+
+def _hasher_for(session_id: str) -> _PartHasher:
+    hasher = _part_hashers.get(session_id)
+    if hasher is None:
+        hasher = _part_hashers[session_id] = _PartHasher()
+        while len(_part_hashers) > MAX_PART_HASHERS:
+            _part_hashers.popitem(last=False)
+    return hasher
+
+async def _hash_in_order(session_id: str, part_number: int, data: bytes, etag: str):
+    hasher = _part_hashers.get(session_id) if part_number > 1 else _hasher_for(session_id)
+    if hasher is None:
+        return
+    async with hasher.lock:
+        if part_number != hasher.next_part:
+            return
+        await run_in_threadpool(hasher.hasher.update, data)
+        hasher.etags.append(etag)
+
+def _session_key(session_id: str) -> str:
+    return f"upload:{session_id}"
+
+def _parts_key(session_id: str) -> str:
+    return f"upload:{session_id}:parts"
+
+def _decode(raw: Dict[bytes, bytes]) -> Dict[str, str]:
+    return {key.decode(): value.decode() for key, value in raw.items()}
+
+def chunk_size_for(size: int) -> int:
+    """The configured chunk size, grown in whole MiB when the file would need too many parts"""
+    chunk_size = max(settings.upload_chunk_size, MIN_PART_SIZE)
+    if math.ceil(size / chunk_size) > MAX_PARTS:
+        mib = 1024 * 1024
+        chunk_size = math.ceil(size / MAX_PARTS / mib) * mib
+    return chunk_size
+
+def expected_part_size(session: Dict[str, Any], part_number: int) -> int:
+    if part_number < session["parts"]:
+        return session["chunk_size"]
+    return session["size"] - session["chunk_size"] * (session["parts"] - 1)
+
+def _touch(pipe, session_id: str):
+    """Queue a TTL refresh: sessions expire after a period without activity, not a fixed lifetime"""
+    ttl = settings.upload_session_ttl_seconds
+    pipe.expire(_session_key(session_id), ttl)
+    pipe.expire(_parts_key(session_id), ttl)
+
+async def create_session(user_id: str, filename: str, content_type: Optional[str],
+                         size: int, sha256: Optional[str]) -> Dict[str, Any]:
+    if size > settings.upload_max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File size too large. Maximum size is {settings.upload_max_bytes} bytes."
+        )
+    chunk_size = chunk_size_for(size)
+    session_id = uuid.uuid4().hex
+    key = f"{UPLOAD_PREFIX}/{session_id}"
+    upload_id = await run_in_threadpool(
+        multipart.create_upload, get_minio_client(), settings.minio_bucket, key,
+        content_type or "application/octet-stream"
+    )
+
+    session = {
+        "id": session_id,
+        "user_id": user_id,
+        "filename": filename,
+        "stored_filename": unique_stored_filename(filename),
+        "content_type": content_type or "",
+        "size": size,
+        "sha256": sha256 or "",
+        "chunk_size": chunk_size,
+        "parts": max(1, math.ceil(size / chunk_size)),
+        "upload_id": upload_id,
+        "key": key,
+    }
+    pipe = get_redis().pipeline()
+    pipe.hset(_session_key(session_id), mapping=session)
+    _touch(pipe, session_id)
+    await pipe.execute()
+    return session
+
+async def get_session(session_id: str, user_id: str) -> Dict[str, Any]:
+    raw = await get_redis().hgetall(_session_key(session_id))
+    if not raw:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload session not found or expired"
+        )
+    session: Dict[str, Any] = _decode(raw)
+    if session["user_id"] != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Upload session belongs to another user"
+        )
+    for field in ("size", "chunk_size", "parts"):
+        session[field] = int(session[field])
+    return session
+
+async def received_parts(session_id: str) -> Dict[int, str]:
+    raw = await get_redis().hgetall(_parts_key(session_id))
+    return {int(number): etag for number, etag in _decode(raw).items()}
+
+async def put_part(session: Dict[str, Any], part_number: int, data: bytes) -> str:
+    if not 1 <= part_number <= session["parts"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Part number must be between 1 and {session['parts']}"
+        )
+    expected = expected_part_size(session, part_number)
+    if len(data) != expected:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Part {part_number} must be {expected} bytes, got {len(data)}"
+        )
+
+    etag = await run_in_threadpool(
+        multipart.upload_part, get_minio_client(), settings.minio_bucket, session["key"],
+        session["upload_id"], part_number, data
+    )
+    pipe = get_redis().pipeline()
+    pipe.hset(_parts_key(session["id"]), str(part_number), etag)
+    _touch(pipe, session["id"])
+    await pipe.execute()
+    await _hash_in_order(session["id"], part_number, data, etag)
+    return etag
+
+def _hash_object(client, key: str) -> str:
+    hasher = hashlib.sha256()
+    obj = client.get_object(settings.minio_bucket, key)
+    try:
+        for chunk in obj.stream(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    finally:
+        obj.close()
+        obj.release_conn()
+    return hasher.hexdigest()
+
+async def _forget(session_id: str):
+    _part_hashers.pop(session_id, None)
+    await get_redis().delete(_session_key(session_id), _parts_key(session_id))
+
+def _digest_from_parts(session_id: str, parts: Dict[int, str]) -> Optional[str]:
+    """The in-order hash, if this worker hashed exactly the parts being assembled"""
+    hasher = _part_hashers.get(session_id)
+    # A re-sent part replaces the stored one; its ETag tells whether the hash still matches
+    if hasher is None or hasher.etags != [parts[number] for number in sorted(parts)]:
+        return None
+    return hasher.hasher.hexdigest()
+
+async def complete_session(db, session: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """Assemble the parts and store the result; returns the file document and whether it was a duplicate"""
+    redis = get_redis()
+    if not await redis.hsetnx(_session_key(session["id"]), "completing", 1):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload is already being completed"
+        )
+
+    parts = await received_parts(session["id"])
+    missing = [number for number in range(1, session["parts"] + 1) if number not in parts]
+    if missing:
+        await redis.hdel(_session_key(session["id"]), "completing")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Upload is missing parts", "missing_parts": missing}
+        )
+
+    client = get_minio_client()
+    bucket, key = settings.minio_bucket, session["key"]
+    session_key = _session_key(session["id"])
+    try:
+        # A retry after a later step failed starts from the assembled object
+        if not await redis.hget(session_key, "assembled"):
+            await run_in_threadpool(multipart.complete_upload, client, bucket, key, session["upload_id"], parts)
+            await redis.hset(session_key, "assembled", 1)
+        digest = _digest_from_parts(session["id"], parts)
+        if digest is not None:
+            resumable_upload_hashes_total.inc(("parts",))
+        else:
+            digest = await run_in_threadpool(_hash_object, client, key)
+            resumable_upload_hashes_total.inc(("read_back",))
+    except Exception:
+        # Nothing was lost: let the client retry without sending the parts again
+        await redis.hdel(session_key, "completing")
+        raise
+
+    if session["sha256"] and session["sha256"].lower() != digest:
+        await _discard(client, session)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Uploaded content does not match the declared sha256"
+        )
+
+    content_type = session["content_type"] or None
+    try:
+        # Copied inside the object store rather than through this worker
+        deduplicated = await store_content(
+            db, digest, session["size"], content_type,
+            lambda: run_in_threadpool(client.copy_object, bucket, blob_key(digest), CopySource(bucket, key))
+        )
+        try:
+            document = await create_file(
+                db, session["stored_filename"], session["filename"], digest, session["size"], content_type,
+                session["user_id"]
+            )
+        except Exception:
+            await release_blob(db, digest)
+            raise
+    except Exception:
+        await redis.hdel(session_key, "completing")
+        raise
+
+    await _discard(client, session)
+    return document, deduplicated
+
+async def _discard(client, session: Dict[str, Any]):
+    """Drop a finished session and its assembled object"""
+    try:
+        await run_in_threadpool(client.remove_object, settings.minio_bucket, session["key"])
+    except Exception as e:
+        # collect_abandoned_uploads removes leftover assembled objects
+        logger.warning(f"Failed to remove assembled upload {session['key']}: {e}")
+    await _forget(session["id"])
+
+async def abort_session(session: Dict[str, Any]):
+    try:
+        await run_in_threadpool(
+            multipart.abort_upload, get_minio_client(), settings.minio_bucket, session["key"], session["upload_id"]
+        )
+    finally:
+        await _forget(session["id"])
+
+def _abandoned(client, cutoff: datetime) -> Tuple[List[Any], List[str]]:
+    uploads, objects = [], []
+    key_marker = upload_id_marker = None
+    while True:
+        result = multipart.list_uploads(
+            client, settings.minio_bucket, f"{UPLOAD_PREFIX}/", key_marker, upload_id_marker
+        )
+        uploads.extend(upload for upload in result.uploads if upload.initiated_time < cutoff)
+        if not result.is_truncated:
+            break
+        key_marker, upload_id_marker = result.next_key_marker, result.next_upload_id_marker
+    # Assembled objects left behind by a completion that never finished
+    for obj in client.list_objects(settings.minio_bucket, prefix=f"{UPLOAD_PREFIX}/", recursive=True):
+        if obj.last_modified and obj.last_modified < cutoff:
+            objects.append(obj.object_name)
+    return uploads, objects
+
+async def collect_abandoned_uploads() -> int:
+    """Abort multipart uploads (and drop temporary objects) idle for longer than the session TTL"""
+    client = get_minio_client()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.upload_session_ttl_seconds)
+    uploads, objects = await run_in_threadpool(_abandoned, client, cutoff)
+
+    # Long uploads that are still sending parts keep their session alive
+    redis = get_redis()
+    live = set()
+    for name in {upload.object_name for upload in uploads} | set(objects):
+        if await redis.exists(_session_key(name.rsplit("/", 1)[-1])):
+            live.add(name)
+    uploads = [upload for upload in uploads if upload.object_name not in live]
+    objects = [name for name in objects if name not in live]
+
+    for upload in uploads:
+        try:
+            await run_in_threadpool(
+                multipart.abort_upload, client, settings.minio_bucket, upload.object_name, upload.upload_id
+            )
+        except Exception as e:
+            logger.warning(f"Failed to abort abandoned upload {upload.object_name}: {e}")
+    for name in objects:
+        await run_in_threadpool(client.remove_object, settings.minio_bucket, name)
+    if uploads or objects:
+        logger.info(f"Collected {len(uploads)} abandoned uploads and {len(objects)} temporary objects")
+    return len(uploads) + len(objects)
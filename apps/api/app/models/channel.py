@@ -1,24 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 from bson import ObjectId
 
-class PyObjectId(ObjectId):
-    @classmethod
-    def __get_pydantic_core_schema__(cls, source_type, handler):
-        from pydantic_core import core_schema
-        return core_schema.with_info_plain_validator_function(
-            cls.validate,
-            serialization=core_schema.plain_serializer_function_ser_schema(
-                lambda x: str(x)
-            ),
-        )
-
-    @classmethod
-    def validate(cls, v):
-        if not ObjectId.is_valid(v):
-            raise ValueError("Invalid ObjectId")
-        return ObjectId(v)
+from app.models.object_id import PyObjectId
 
 class ChannelBase(BaseModel):
     name: str
@@ -31,8 +16,19 @@ class ChannelUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
 
+class ReadMarkerUpdate(BaseModel):
+    # Defaults to the channel's latest message
+    seq: Optional[int] = None
+
+class ChannelUnread(BaseModel):
+    channel_id: str
+    last_seq: int
+    last_read_seq: int
+    unread_count: int
+    mention_count: int
+
 class ChannelInDB(ChannelBase):
-    id: PyObjectId = PyObjectId()
+    id: PyObjectId = Field(default_factory=PyObjectId)
     created_by: PyObjectId
     created_at: datetime
     updated_at: datetime
@@ -47,6 +43,7 @@ class Channel(ChannelBase):
     created_at: datetime
     updated_at: datetime
     message_count: int = 0
+    last_seq: int = 0
 
     class Config:
         json_encoders = {ObjectId: str}
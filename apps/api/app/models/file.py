@@ -0,0 +1,14 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class FileLink(BaseModel):
+    sha256: str = Field(..., pattern="^[0-9a-fA-F]{64}$")
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: Optional[str] = None
+
+class UploadSessionCreate(BaseModel):
+    filename: str = Field(..., min_length=1, max_length=255)
+    size: int = Field(..., gt=0)
+    content_type: Optional[str] = None
+    # Lets the server skip the upload entirely when the content is already stored
+    sha256: Optional[str] = Field(None, pattern="^[0-9a-fA-F]{64}$")
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from datetime import datetime
+
+class Notification(BaseModel):
+    id: str
+    channel_id: str
+    message_id: str
+    seq: int
+    author_id: str
+    # "mention", "channel" or "here"
+    reason: str
+    preview: str
+    created_at: datetime
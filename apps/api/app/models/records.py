@@ -0,0 +1,87 @@
+"""
+Internal records for the read hot path.
+
+The pydantic models in this package validate what clients send and document
+the API. Turning stored documents into responses needs neither: history pages
+build these slotted records straight from Mongo documents and encode them with
+``encode``, producing the same JSON as the ``Message`` schema without a
+validation pass per message, reaction and thread reply.
+"""
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+@dataclass(slots=True, frozen=True)
+class UserRef:
+    id: str
+    username: str
+    avatar: Optional[str]
+
+    @classmethod
+    def from_document(cls, user: Dict[str, Any]) -> "UserRef":
+        return cls(str(user["_id"]), user["username"], user.get("avatar"))
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {"id": self.id, "username": self.username, "avatar": self.avatar}
+
+@dataclass(slots=True)
+class ReactionRecord:
+    id: str
+    emoji: str
+    count: int
+    users: List[str]
+
+    @classmethod
+    def from_document(cls, reaction: Dict[str, Any]) -> "ReactionRecord":
+        return cls(str(reaction.get("_id", "")), reaction["emoji"], reaction.get("count", 1), reaction.get("users", []))
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {"id": self.id, "emoji": self.emoji, "count": self.count, "users": self.users}
+
+@dataclass(slots=True)
+class MessageRecord:
+    id: str
+    content: str
+    channel_id: str
+    user: Optional[UserRef]
+    reactions: List[ReactionRecord]
+    thread: Optional[List["MessageRecord"]]
+    seq: Optional[int]
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_document(
+        cls, message: Dict[str, Any], user: Optional[UserRef], thread: Optional[List["MessageRecord"]] = None
+    ) -> "MessageRecord":
+        return cls(
+            str(message["_id"]),
+            message["content"],
+            message["channel_id"],
+            user,
+            [ReactionRecord.from_document(reaction) for reaction in message.get("reactions", ())],
+            thread,
+            message.get("seq"),
+            message["created_at"],
+            message["updated_at"],
+        )
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "content": self.content,
+            "channel_id": self.channel_id,
+            "user": self.user.to_wire() if self.user else None,
+            "reactions": [reaction.to_wire() for reaction in self.reactions],
+            "thread": [reply.to_wire() for reply in self.thread] if self.thread is not None else None,
+            "seq": self.seq,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+def encode(records: Iterable[Any]) -> bytes:
+    """JSON for a list of records, formatted like FastAPI's own responses"""
+    return json.dumps(
+        [record.to_wire() for record in records], ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+from typing import Dict
+
+class SyncRequest(BaseModel):
+    # Channel id -> the cursor returned for it by the previous sync
+    channels: Dict[str, int] = {}
@@ -1,24 +1,9 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, Field, EmailStr
 from typing import Optional
 from datetime import datetime
 from bson import ObjectId
 
-class PyObjectId(ObjectId):
-    @classmethod
-    def __get_pydantic_core_schema__(cls, source_type, handler):
-        from pydantic_core import core_schema
-        return core_schema.with_info_plain_validator_function(
-            cls.validate,
-            serialization=core_schema.plain_serializer_function_ser_schema(
-                lambda x: str(x)
-            ),
-        )
-
-    @classmethod
-    def validate(cls, v):
-        if not ObjectId.is_valid(v):
-            raise ValueError("Invalid ObjectId")
-        return ObjectId(v)
+from app.models.object_id import PyObjectId
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -33,7 +18,7 @@ class UserUpdate(BaseModel):
     avatar: Optional[str] = None
 
 class UserInDB(UserBase):
-    id: PyObjectId = PyObjectId()
+    id: PyObjectId = Field(default_factory=PyObjectId)
     hashed_password: str
     avatar: Optional[str] = None
     created_at: datetime
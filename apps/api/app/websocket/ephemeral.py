@@ -0,0 +1,124 @@
+"""
+Typing indicators.
+
+Typing is ephemeral: it lives in Redis for a few seconds and is never stored
+or replayed. Clients send ``{"type": "typing", "channel_id": ...}`` as often
+as they like (``"state": "stop"`` clears it), but only for channels the socket
+is subscribed to. Each worker accepts at most one ping per user and channel
+every ``typing_throttle_ms``, and writes the pings it accepted to Redis once
+per tick in a single pipeline.
+
+``typing:<channel>`` is a sorted set of user ids scored by expiry, and
+``typing:active`` scores channels by when their last entry expires. Every
+tick, each worker reads the sets of the active channels its sockets are
+subscribed to and sends them one ``{"type": "typing", "user_ids": [...]}``
+frame per changed channel. A channel therefore costs at most one frame per
+subscriber per tick, however many people are typing in it.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Tuple
+
+from app.core.config import settings
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TYPING_ACTIVE = "typing:active"
+
+typing_pings_total = registry.counter(
+    "ws_typing_pings_total", "Typing pings from clients, by whether they were accepted, throttled or for an unsubscribed channel", ("result",)
+)
+
+def _typing_key(channel_id: str) -> str:
+    return f"typing:{channel_id}"
+
+class TypingAggregator:
+    def __init__(self, manager):
+        self.manager = manager
+        # (channel id, user id) -> when the last ping was accepted (monotonic)
+        self._accepted: Dict[Tuple[str, str], float] = {}
+        # (channel id, user id) -> typing or stopped, waiting for the next tick
+        self._pending: Dict[Tuple[str, str], bool] = {}
+        # Channel id -> the user ids last sent to this worker's subscribers
+        self._shown: Dict[str, Tuple[str, ...]] = {}
+
+    def ping(self, websocket, user_id: str, channel_id: str, typing: bool = True) -> bool:
+        """Record a typing ping; False if it was throttled or the socket is not subscribed to the channel"""
+        # Keeps clients from creating typing keys for arbitrary channel ids
+        if websocket not in self.manager.channel_subscribers.get(channel_id, ()):
+            typing_pings_total.inc(("unsubscribed",))
+            return False
+        key = (channel_id, user_id)
+        now = time.monotonic()
+        if typing:
+            last = self._accepted.get(key)
+            if last is not None and now - last < settings.typing_throttle_ms / 1000:
+                typing_pings_total.inc(("throttled",))
+                return False
+            self._accepted[key] = now
+        else:
+            self._accepted.pop(key, None)
+        self._pending[key] = typing
+        typing_pings_total.inc(("accepted",))
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.typing_interval_ms / 1000)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Typing indicator flush failed: {e}")
+
+    async def flush(self):
+        """Write accepted pings to Redis and send changed typing sets to local subscribers"""
+        now = time.time()
+        ttl = settings.typing_ttl_seconds
+        pending, self._pending = self._pending, {}
+        horizon = time.monotonic() - settings.typing_throttle_ms / 1000
+        self._accepted = {key: at for key, at in self._accepted.items() if at > horizon}
+
+        redis = self.manager.redis_client
+        pipe = redis.pipeline(transaction=False)
+        for (channel_id, user_id), typing in pending.items():
+            key = _typing_key(channel_id)
+            if typing:
+                pipe.zadd(key, {user_id: now + ttl})
+                pipe.expire(key, int(ttl) + 1)
+            else:
+                pipe.zrem(key, user_id)
+            pipe.zadd(TYPING_ACTIVE, {channel_id: now + ttl})
+        pipe.zremrangebyscore(TYPING_ACTIVE, "-inf", now)
+        pipe.zrangebyscore(TYPING_ACTIVE, now, "+inf")
+        active = (await pipe.execute())[-1]
+
+        subscribed = self.manager.channel_subscribers
+        channels = {channel.decode() if isinstance(channel, bytes) else channel for channel in active}
+        channels = [channel_id for channel_id in channels | set(self._shown) if channel_id in subscribed]
+        for channel_id in list(self._shown):
+            if channel_id not in subscribed:
+                del self._shown[channel_id]
+        if not channels:
+            return
+
+        pipe = redis.pipeline(transaction=False)
+        for channel_id in channels:
+            pipe.zrangebyscore(_typing_key(channel_id), now, "+inf")
+        results = await pipe.execute()
+
+        for channel_id, users in zip(channels, results):
+            user_ids = tuple(sorted(user.decode() if isinstance(user, bytes) else user for user in users))
+            if user_ids == self._shown.get(channel_id, ()):
+                continue
+            if user_ids:
+                self._shown[channel_id] = user_ids
+            else:
+                self._shown.pop(channel_id, None)
+            frame = json.dumps({"type": "typing", "channel_id": channel_id, "user_ids": list(user_ids)})
+            for websocket in list(subscribed.get(channel_id, ())):
+                self.manager._enqueue(websocket, frame)
@@ -1,87 +1,433 @@
+"""
+WebSocket connection manager.
+
+Sockets only live in the worker process that accepted them, so every fan-out
+is delivered to local sockets immediately and published to Redis for the other
+workers. Each worker keeps a single pub/sub connection, subscribed to the
+broadcast and presence channels plus one channel per locally connected user
+and per locally subscribed chat channel. Presence (who is online, across all
+workers) is kept in Redis rather than in process memory.
+"""
 from fastapi import WebSocket
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
+import asyncio
 import json
-import redis.asyncio as redis
+import logging
+import time
+import uuid
 from app.core.config import settings
+from app.core.metrics import registry, redis_publish_total
+from app.core.redis import get_redis
+from app.websocket.ephemeral import TypingAggregator
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CHANNEL = "broadcast"
+PRESENCE_CHANNEL = "presence"
+PRESENCE_CONNECTIONS = "presence:connections"
+PRESENCE_SEEN = "presence:seen"
+
+# KEYS[1] connection counts, KEYS[2] last-seen scores
+# ARGV[1] user id, ARGV[2] now, ARGV[3] ttl
+# Returns 1 if the user just came online. A count left behind by a worker that
+# died without cleaning up is reset once its heartbeat has gone stale.
+PRESENCE_CONNECT_LUA = """
+local seen = redis.call('ZSCORE', KEYS[2], ARGV[1])
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+local now = tonumber(ARGV[2])
+redis.call('ZADD', KEYS[2], now, ARGV[1])
+if (not seen) or tonumber(seen) < now - tonumber(ARGV[3]) then
+  if count > 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], 1)
+  end
+  return 1
+end
+if count == 1 then
+  return 1
+end
+return 0
+"""
+
+# KEYS[1] connection counts, KEYS[2] last-seen scores, ARGV[1] user id
+# Returns 1 if the user's last connection (on any worker) just closed
+PRESENCE_DISCONNECT_LUA = """
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count <= 0 then
+  redis.call('HDEL', KEYS[1], ARGV[1])
+  redis.call('ZREM', KEYS[2], ARGV[1])
+  return 1
+end
+return 0
+"""
 
 class ConnectionManager:
     def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
         self.active_connections: List[WebSocket] = []
-        self.user_connections: Dict[str, WebSocket] = {}
-        self.redis_client = redis.from_url(settings.redis_url)
+        self.user_connections: Dict[str, Set[WebSocket]] = {}
+        self.socket_users: Dict[WebSocket, str] = {}
+        self.channel_subscribers: Dict[str, Set[WebSocket]] = {}
+        # Every socket gets a bounded send queue drained by its own task, so a
+        # slow client only ever delays itself and broadcast never awaits I/O
+        self.send_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.sender_tasks: Dict[WebSocket, asyncio.Task] = {}
+        self.frames_sent = 0
+        self.frames_dropped = {"queue_full": 0, "closed": 0, "publish_failed": 0}
+        # Frames for other workers go out in order through one publisher task,
+        # pipelined in batches, so fan-out never waits on Redis either
+        self._outbox: Optional[asyncio.Queue] = None
+        self._publisher_task: Optional[asyncio.Task] = None
+        # One pub/sub connection per worker instead of one per socket
+        self._pubsub = None
+        self._redis_channels: Set[str] = set()
+        self._subscription_lock = asyncio.Lock()
+        self._listener_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Ephemeral typing state, aggregated per channel and sent once per tick
+        self.typing = TypingAggregator(self)
+        self._typing_task: Optional[asyncio.Task] = None
+        self._scripts = {}
+        self._register_metrics()
+
+    @property
+    def redis_client(self):
+        # Shared, pooled client from app.core.redis
+        return get_redis()
+
+    def _register_metrics(self):
+        registry.gauge(
+            "ws_active_connections", "Open WebSocket connections",
+            callback=lambda: [((), len(self.active_connections))]
+        )
+        registry.gauge(
+            "ws_user_connections", "Users with at least one open WebSocket connection on this worker",
+            callback=lambda: [((), len(self.user_connections))]
+        )
+        registry.gauge(
+            "ws_channel_subscribers", "Subscribed sockets per channel", ("channel_id",),
+            callback=lambda: [((channel_id,), len(sockets)) for channel_id, sockets in self.channel_subscribers.items()]
+        )
+        registry.gauge(
+            "ws_send_queue_depth", "Frames waiting in client send queues",
+            callback=lambda: [((), self.pending_frames())]
+        )
+        registry.gauge(
+            "ws_send_queue_max_depth", "Deepest client send queue",
+            callback=lambda: [((), max((queue.qsize() for queue in self.send_queues.values()), default=0))]
+        )
+        registry.counter_func(
+            "ws_frames_sent_total", "Frames written to WebSocket clients",
+            callback=lambda: [((), self.frames_sent)]
+        )
+        registry.counter_func(
+            "ws_frames_dropped_total", "Frames dropped because a send queue was full, the client closed or publishing to Redis failed", ("reason",),
+            callback=lambda: [((reason,), count) for reason, count in self.frames_dropped.items()]
+        )
+        registry.gauge(
+            "ws_redis_subscriptions", "Redis pub/sub channels this worker is subscribed to",
+            callback=lambda: [((), len(self._redis_channels))]
+        )
+
+    def _script(self, name: str, source: str):
+        client = self.redis_client
+        script = self._scripts.get(name)
+        if script is None or script.registered_client is not client:
+            script = self._scripts[name] = client.register_script(source)
+        return script
+
+    def _publish(self, kind: str, channel: str, message: str):
+        """Queue a frame for the other workers, tagged so this worker skips its own echo"""
+        if self._publisher_task is None:
+            self._outbox = asyncio.Queue(maxsize=settings.ws_publish_queue_size)
+            self._publisher_task = asyncio.create_task(self._publisher(self._outbox))
+        try:
+            self._outbox.put_nowait((kind, channel, f"{self.worker_id}|{message}"))
+        except asyncio.QueueFull:
+            self.frames_dropped["publish_failed"] += 1
+
+    async def _publisher(self, outbox: asyncio.Queue):
+        while True:
+            batch = [await outbox.get()]
+            while len(batch) < 100 and not outbox.empty():
+                batch.append(outbox.get_nowait())
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for kind, channel, frame in batch:
+                    pipe.publish(channel, frame)
+                await pipe.execute()
+                for kind, _, _ in batch:
+                    redis_publish_total.inc((kind,))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.frames_dropped["publish_failed"] += len(batch)
+                logger.warning(f"Failed to publish {len(batch)} frames: {e}")
+
+    def _deliver(self, channel: str, message: str):
+        """Enqueue a frame for the local sockets listening on a Redis channel"""
+        if channel in (BROADCAST_CHANNEL, PRESENCE_CHANNEL):
+            targets = self.active_connections
+        elif channel.startswith("user:"):
+            targets = self.user_connections.get(channel[len("user:"):], ())
+        elif channel.startswith("channel:"):
+            targets = self.channel_subscribers.get(channel[len("channel:"):], ())
+        else:
+            return
+        for websocket in list(targets):
+            self._enqueue(websocket, message)
+
+    def _fanout(self, kind: str, channel: str, message: str):
+        self._deliver(channel, message)
+        self._publish(kind, channel, message)
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"]
+                    data = message["data"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    origin, _, frame = data.partition("|")
+                    if origin != self.worker_id:
+                        self._deliver(channel, frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # redis-py resubscribes on reconnect; back off and keep listening
+                logger.warning(f"WebSocket pub/sub listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def _heartbeat(self):
+        """Keep this worker's users marked as online and expire everyone else's stale entries"""
+        while True:
+            await asyncio.sleep(settings.presence_heartbeat_seconds)
+            try:
+                now = time.time()
+                pipe = self.redis_client.pipeline(transaction=False)
+                if self.user_connections:
+                    pipe.zadd(PRESENCE_SEEN, {user_id: now for user_id in self.user_connections})
+                pipe.zremrangebyscore(PRESENCE_SEEN, "-inf", now - settings.presence_ttl_seconds)
+                await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Presence heartbeat failed: {e}")
+
+    async def _ensure_listener(self):
+        async with self._subscription_lock:
+            if self._pubsub is not None:
+                return
+            try:
+                pubsub = self.redis_client.pubsub()
+                await pubsub.subscribe(BROADCAST_CHANNEL, PRESENCE_CHANNEL)
+            except Exception as e:
+                # Local delivery keeps working; cross-worker fan-out resumes on the next connect
+                logger.warning(f"WebSocket pub/sub unavailable, delivering locally only: {e}")
+                return
+            self._pubsub = pubsub
+            self._redis_channels.update((BROADCAST_CHANNEL, PRESENCE_CHANNEL))
+            self._listener_task = asyncio.create_task(self._listen(pubsub))
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+            self._typing_task = asyncio.create_task(self.typing.run())
+
+    async def _sync_subscription(self, channel: str, wanted: bool):
+        """Subscribe the worker to ``channel`` while any local socket needs it"""
+        async with self._subscription_lock:
+            if self._pubsub is None or wanted == (channel in self._redis_channels):
+                return
+            try:
+                if wanted:
+                    await self._pubsub.subscribe(channel)
+                    self._redis_channels.add(channel)
+                else:
+                    self._redis_channels.discard(channel)
+                    await self._pubsub.unsubscribe(channel)
+            except Exception as e:
+                logger.warning(f"Failed to update subscription to {channel}: {e}")
+
+    async def _prune_subscriptions(self):
+        for channel in list(self._redis_channels):
+            if channel.startswith("user:") and channel[len("user:"):] not in self.user_connections:
+                await self._sync_subscription(channel, False)
+            elif channel.startswith("channel:") and channel[len("channel:"):] not in self.channel_subscribers:
+                await self._sync_subscription(channel, False)
+
+    async def _presence_connect(self, user_id: str) -> bool:
+        try:
+            script = self._script("connect", PRESENCE_CONNECT_LUA)
+            came_online = await script(
+                keys=[PRESENCE_CONNECTIONS, PRESENCE_SEEN],
+                args=[user_id, time.time(), settings.presence_ttl_seconds]
+            )
+            return bool(came_online)
+        except Exception as e:
+            logger.warning(f"Failed to record presence for {user_id}: {e}")
+            return False
+
+    async def _presence_disconnect(self, user_id: str) -> bool:
+        try:
+            script = self._script("disconnect", PRESENCE_DISCONNECT_LUA)
+            went_offline = await script(keys=[PRESENCE_CONNECTIONS, PRESENCE_SEEN], args=[user_id])
+            return bool(went_offline)
+        except Exception as e:
+            logger.warning(f"Failed to clear presence for {user_id}: {e}")
+            return False
+
+    async def _sender(self, websocket: WebSocket, queue: asyncio.Queue):
+        try:
+            while True:
+                message = await queue.get()
+                await websocket.send_text(message)
+                self.frames_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Remove broken connections
+            self._forget(websocket)
+
+    def _enqueue(self, websocket: WebSocket, message: str):
+        queue = self.send_queues.get(websocket)
+        if queue is None:
+            self.frames_dropped["closed"] += 1
+            return
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.frames_dropped["queue_full"] += 1
+
+    def pending_frames(self) -> int:
+        return sum(queue.qsize() for queue in self.send_queues.values())
+
+    def _forget(self, websocket: WebSocket):
+        """Drop local state for a socket; Redis state is cleaned up by disconnect()"""
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        user_id = self.socket_users.get(websocket)
+        if user_id is not None:
+            sockets = self.user_connections.get(user_id)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.user_connections[user_id]
+        for channel_id in list(self.channel_subscribers):
+            self._remove_subscriber(channel_id, websocket)
+        queue = self.send_queues.pop(websocket, None)
+        if queue is not None:
+            self.frames_dropped["closed"] += queue.qsize()
+        task = self.sender_tasks.pop(websocket, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    def _remove_subscriber(self, channel_id: str, websocket: WebSocket):
+        subscribers = self.channel_subscribers.get(channel_id)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self.channel_subscribers[channel_id]
+
+    async def shutdown(self):
+        """Release presence, stop the pub/sub listener and sender tasks; called from the app lifespan"""
+        # Each socket holds one presence reference
+        for user_id in list(self.socket_users.values()):
+            if await self._presence_disconnect(user_id):
+                self._publish_presence("user_offline", user_id)
+        self.socket_users.clear()
+        self.user_connections.clear()
+
+        if self._outbox is not None:
+            # Give queued frames (including the offline events above) a chance to go out
+            for _ in range(50):
+                if self._outbox.empty():
+                    break
+                await asyncio.sleep(0.01)
+
+        tasks = list(self.sender_tasks.values())
+        for task in (self._listener_task, self._heartbeat_task, self._typing_task, self._publisher_task):
+            if task is not None:
+                tasks.append(task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.sender_tasks.clear()
+        self.send_queues.clear()
+        self._listener_task = None
+        self._heartbeat_task = None
+        self._typing_task = None
+        self._publisher_task = None
+        self._outbox = None
+
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
+            self._redis_channels.clear()
+
+    def _publish_presence(self, event: str, user_id: str):
+        self._fanout("presence", PRESENCE_CHANNEL, json.dumps({"type": event, "user_id": user_id}))
 
     async def connect(self, websocket: WebSocket, user_id: str = None):
         await websocket.accept()
         self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=settings.ws_send_queue_size)
+        self.send_queues[websocket] = queue
+        self.sender_tasks[websocket] = asyncio.create_task(self._sender(websocket, queue))
+        await self._ensure_listener()
         if user_id:
-            self.user_connections[user_id] = websocket
-            # Publish user online event
-            await self.redis_client.publish(
-                "presence",
-                json.dumps({
-                    "type": "user_online",
-                    "user_id": user_id
-                })
-            )
+            self.socket_users[websocket] = user_id
+            self.user_connections.setdefault(user_id, set()).add(websocket)
+            await self._sync_subscription(f"user:{user_id}", True)
+            if await self._presence_connect(user_id):
+                # Publish user online event
+                self._publish_presence("user_online", user_id)
 
-    async def disconnect(self, websocket: WebSocket, user_id: str = None):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        if user_id and user_id in self.user_connections:
-            del self.user_connections[user_id]
+    async def disconnect(self, websocket: WebSocket):
+        self._forget(websocket)
+        user_id = self.socket_users.pop(websocket, None)
+        await self._prune_subscriptions()
+        if user_id and await self._presence_disconnect(user_id):
             # Publish user offline event
-            await self.redis_client.publish(
-                "presence",
-                json.dumps({
-                    "type": "user_offline",
-                    "user_id": user_id
-                })
-            )
+            self._publish_presence("user_offline", user_id)
+
+    async def online_users(self) -> List[str]:
+        """Users with a live connection on any worker"""
+        cutoff = time.time() - settings.presence_ttl_seconds
+        users = await self.redis_client.zrangebyscore(PRESENCE_SEEN, cutoff, "+inf")
+        return [user.decode() if isinstance(user, bytes) else user for user in users]
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        self._enqueue(websocket, message)
 
     async def send_personal_json(self, data: dict, websocket: WebSocket):
-        await websocket.send_text(json.dumps(data))
+        self._enqueue(websocket, json.dumps(data))
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                # Remove broken connections
-                self.active_connections.remove(connection)
+        self._fanout("broadcast", BROADCAST_CHANNEL, message)
 
     async def broadcast_json(self, data: dict):
         message = json.dumps(data)
         await self.broadcast(message)
 
     async def send_to_user(self, user_id: str, data: dict):
-        if user_id in self.user_connections:
-            try:
-                await self.send_personal_json(data, self.user_connections[user_id])
-            except:
-                # Remove broken connection
-                del self.user_connections[user_id]
+        self._fanout("user", f"user:{user_id}", json.dumps(data))
 
     async def broadcast_to_channel(self, channel_id: str, data: dict):
-        # Publish to Redis for channel-specific broadcasting
-        await self.redis_client.publish(
-            f"channel:{channel_id}",
-            json.dumps(data)
-        )
+        self._fanout("channel", f"channel:{channel_id}", json.dumps(data))
 
     async def subscribe_to_channel(self, channel_id: str, websocket: WebSocket):
-        # Subscribe to Redis channel for real-time updates
-        pubsub = self.redis_client.pubsub()
-        await pubsub.subscribe(f"channel:{channel_id}")
-        
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    await websocket.send_text(message["data"].decode())
-                except:
-                    break
-        
-        await pubsub.unsubscribe(f"channel:{channel_id}")
-        await pubsub.close() 
\ No newline at end of file
+        if websocket not in self.send_queues:
+            return
+        self.channel_subscribers.setdefault(channel_id, set()).add(websocket)
+        await self._sync_subscription(f"channel:{channel_id}", True)
+
+    async def unsubscribe_from_channel(self, channel_id: str, websocket: WebSocket):
+        self._remove_subscriber(channel_id, websocket)
+        if channel_id not in self.channel_subscribers:
+            await self._sync_subscription(f"channel:{channel_id}", False)
+
+# Shared by the WebSocket endpoint and HTTP endpoints that push events
+manager = ConnectionManager()
@@ -0,0 +1,197 @@
+"""
+Commands over the WebSocket.
+
+A socket opened with ``?token=`` is authenticated once, at the handshake; after
+that it can send
+
+    {"type": "rpc", "id": "<client id>", "method": "post", "params": {...}}
+
+and gets exactly one reply per command, carrying the same id:
+
+    {"type": "rpc_result", "id": "<client id>", "ok": true, "result": {...}}
+    {"type": "rpc_result", "id": "<client id>", "ok": false, "error": {"status": 404, "detail": "..."}}
+
+Methods run the REST handlers with the handshake user, so validation, rate
+limits, errors and results match the HTTP API. Each command is also admitted
+through the load-shedding limiter as the route class of its REST route, so an
+overloaded server sheds commands (503 with ``retry_after``) like requests;
+``ws_rpc_*`` metrics stand in for the per-route HTTP ones. Access tokens expire while
+sockets stay open: once the handshake token has expired, commands fail with
+401 until the client sends ``{"type": "auth", "token": "..."}`` with a fresh
+token for the same user.
+"""
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from jose import jwt
+from pydantic import BaseModel, ValidationError
+
+from app.api.v1.endpoints.auth import authenticate_token
+from app.api.v1.endpoints.channels import mark_read
+from app.api.v1.endpoints.messages import add_reaction, create_message, update_message
+from app.core.config import settings
+from app.core.loadshed import RouteClass, classify, limiter, loadshed_requests_total
+from app.core.metrics import registry
+from app.core.ratelimit import enforce
+from app.core.read_routing import tracked_writes
+from app.models.channel import ReadMarkerUpdate
+from app.models.message import MessageCreate, MessageUpdate, ReactionCreate
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+ws_rpc_calls_total = registry.counter(
+    "ws_rpc_calls_total", "WebSocket commands by method and reply status", ("method", "status")
+)
+ws_rpc_duration_seconds = registry.histogram(
+    "ws_rpc_duration_seconds", "WebSocket command latency by method", ("method",)
+)
+
+def _param(params: Dict[str, Any], name: str) -> str:
+    value = params.get(name)
+    if not isinstance(value, str) or not value:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Missing parameter: {name}"
+        )
+    return value
+
+async def _post(user: User, params: Dict[str, Any]):
+    channel_id = _param(params, "channel_id")
+    body = MessageCreate.model_validate(params)
+    await enforce("create_message", user.id, channel_id)
+    return await create_message(channel_id, body, current_user=user)
+
+async def _edit(user: User, params: Dict[str, Any]):
+    message_id = _param(params, "message_id")
+    return await update_message(message_id, MessageUpdate.model_validate(params), current_user=user)
+
+async def _react(user: User, params: Dict[str, Any]):
+    message_id = _param(params, "message_id")
+    body = ReactionCreate.model_validate(params)
+    await enforce("add_reaction", user.id)
+    return await add_reaction(message_id, body, current_user=user)
+
+async def _mark_read(user: User, params: Dict[str, Any]):
+    channel_id = _param(params, "channel_id")
+    return await mark_read(channel_id, ReadMarkerUpdate.model_validate(params), current_user=user)
+
+METHODS: Dict[str, Callable[[User, Dict[str, Any]], Awaitable[Any]]] = {
+    "post": _post,
+    "edit": _edit,
+    "react": _react,
+    "mark_read": _mark_read,
+}
+
+# The REST route each method stands in for, which decides its load-shedding class
+ROUTE_CLASSES: Dict[str, RouteClass] = {
+    "post": classify("POST", "/api/v1/messages/channels/{channel_id}/messages"),
+    "edit": classify("PUT", "/api/v1/messages/messages/{message_id}"),
+    "react": classify("POST", "/api/v1/messages/messages/{message_id}/reactions"),
+    "mark_read": classify("PUT", "/api/v1/channels/{channel_id}/read"),
+}
+
+def _error(status_code: int, detail: Any, retry_after: Optional[str] = None) -> Dict[str, Any]:
+    error = {"status": status_code, "detail": detail}
+    if retry_after is not None:
+        error["retry_after"] = float(retry_after)
+    return error
+
+class RpcSession:
+    """The user a socket authenticated as, and the commands it sends"""
+
+    def __init__(self, user: Optional[User] = None, expires_at: Optional[float] = None):
+        self.user = user
+        self.expires_at = expires_at
+
+    @classmethod
+    async def open(cls, token: str) -> "RpcSession":
+        """Authenticate a handshake token; raises HTTPException like bearer auth"""
+        user = await authenticate_token(token)
+        return cls(user, jwt.get_unverified_claims(token).get("exp"))
+
+    async def authenticate(self, frame: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle an ``auth`` frame renewing the socket's token"""
+        reply = {"type": "auth_result", "ok": False}
+        if self.user is None:
+            reply["error"] = _error(status.HTTP_401_UNAUTHORIZED, "Authenticate with ?token= at the handshake")
+            return reply
+        try:
+            renewed = await RpcSession.open(str(frame.get("token") or ""))
+        except HTTPException as e:
+            reply["error"] = _error(e.status_code, e.detail)
+            return reply
+        if renewed.user.id != self.user.id:
+            reply["error"] = _error(status.HTTP_403_FORBIDDEN, "Token belongs to another user")
+            return reply
+        self.user, self.expires_at = renewed.user, renewed.expires_at
+        reply["ok"] = True
+        reply["expires_at"] = self.expires_at
+        return reply
+
+    async def call(self, frame: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one ``rpc`` frame and build its reply"""
+        reply = {"type": "rpc_result", "id": frame.get("id"), "ok": False}
+        method = frame.get("method")
+        handler = METHODS.get(method)
+        label = method if handler else "unknown"
+        params = frame.get("params") or {}
+        started = time.perf_counter()
+
+        if self.user is None:
+            reply["error"] = _error(status.HTTP_401_UNAUTHORIZED, "Not authenticated")
+        elif self.expires_at is not None and self.expires_at <= time.time():
+            reply["error"] = _error(status.HTTP_401_UNAUTHORIZED, "Token expired")
+        elif handler is None:
+            reply["error"] = _error(status.HTTP_404_NOT_FOUND, f"Unknown method: {method}")
+        elif not isinstance(params, dict):
+            reply["error"] = _error(status.HTTP_400_BAD_REQUEST, "params must be an object")
+        else:
+            await self._admitted(method, handler, params, reply)
+
+        ws_rpc_calls_total.inc((label, str(reply["error"]["status"]) if not reply["ok"] else "200"))
+        ws_rpc_duration_seconds.observe((label,), time.perf_counter() - started)
+        return reply
+
+    async def _admitted(self, method: str, handler, params: Dict[str, Any], reply: Dict[str, Any]):
+        """Run a command once the limiter admits it, like LoadSheddingMiddleware does for requests"""
+        if not settings.loadshed_enabled:
+            await self._run(method, handler, params, reply)
+            return
+        route_class = ROUTE_CLASSES[method]
+        admitted, decision = await limiter.acquire(route_class)
+        loadshed_requests_total.inc((route_class.name, decision))
+        if not admitted:
+            reply["error"] = _error(
+                status.HTTP_503_SERVICE_UNAVAILABLE, "Service is overloaded, please retry shortly", "1"
+            )
+            return
+        started = time.monotonic()
+        try:
+            await self._run(method, handler, params, reply)
+        finally:
+            limiter.release(route_class, time.monotonic() - started)
+
+    async def _run(self, method: str, handler, params: Dict[str, Any], reply: Dict[str, Any]):
+        try:
+            async with tracked_writes(self.user.id):
+                result = await handler(self.user, params)
+            reply["ok"] = True
+            # Message results: pydantic-core's serializer instead of the generic encoder
+            if isinstance(result, BaseModel):
+                reply["result"] = result.model_dump(mode="json")
+            else:
+                reply["result"] = jsonable_encoder(result)
+        except HTTPException as e:
+            reply["error"] = _error(e.status_code, e.detail, (e.headers or {}).get("Retry-After"))
+        except ValidationError as e:
+            reply["error"] = _error(
+                status.HTTP_422_UNPROCESSABLE_ENTITY, json.loads(e.json(include_url=False))
+            )
+        except Exception as e:
+            logger.error(f"WebSocket command {method} failed for {self.user.id}: {e}")
+            reply["error"] = _error(status.HTTP_500_INTERNAL_SERVER_ERROR, "Internal server error")
@@ -0,0 +1,5 @@
+"""
+Hermetic load-testing harness for the API and WebSocket hub.
+
+Run with ``python -m benchmarks.run --help`` from ``apps/api``.
+"""
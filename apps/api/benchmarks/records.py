@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Compare pydantic models with the internal records for history pages.
+
+Builds the same history page (messages with an author, reactions and thread
+replies) both ways and reports per-message memory, construction time and
+construction plus rendering the response body (for the models, the way FastAPI
+renders ``response_model=List[Message]``).
+
+Examples:
+    python -m benchmarks.records
+    python -m benchmarks.records --messages 5000 --replies 3 --output records.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+# Add the app directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app.models.message import Message
+from app.models.records import MessageRecord, UserRef, encode
+
+MESSAGE_LIST = TypeAdapter(List[Message])
+
+
+def sample_documents(count: int, replies: int) -> List[Dict]:
+    """Stored messages shaped like the ones get_messages reads"""
+    user = {"_id": ObjectId(), "username": "alice", "avatar": None}
+    created = datetime(2024, 5, 1)
+
+    def document(i: int) -> Dict:
+        return {
+            "_id": ObjectId(),
+            "channel_id": "665f1c2e9b1e8a0012345678",
+            "user_id": user["_id"],
+            "user": user,
+            "content": f"message {i} with some ordinary chat text in it",
+            "reactions": [
+                {"_id": ObjectId(), "emoji": "👍", "count": 2, "users": ["u1", "u2"]},
+                {"_id": ObjectId(), "emoji": "🎉", "count": 1, "users": ["u3"]},
+            ],
+            "seq": i,
+            "created_at": created + timedelta(seconds=i),
+            "updated_at": created + timedelta(seconds=i),
+        }
+
+    documents = []
+    for i in range(count):
+        message = document(i)
+        message["thread"] = [document(i) for _ in range(replies)]
+        documents.append(message)
+    return documents
+
+
+def build_models(documents: List[Dict]) -> List[Message]:
+    """What get_messages did: one validated model per message and reply"""
+    def model(message, thread):
+        user = message["user"]
+        fields = {key: value for key, value in message.items() if key not in ("_id", "user", "thread")}
+        return Message(
+            id=str(message["_id"]),
+            user={"id": str(user["_id"]), "username": user["username"], "avatar": user.get("avatar")},
+            thread=thread,
+            **fields,
+        )
+
+    return [model(message, [model(reply, None) for reply in message["thread"]]) for message in documents]
+
+
+def render_models(models: List[Message]) -> bytes:
+    """What FastAPI did with them for response_model=List[Message]: validate, serialize, JSONResponse"""
+    return JSONResponse(MESSAGE_LIST.dump_python(MESSAGE_LIST.validate_python(models), mode="json")).body
+
+
+def build_records(documents: List[Dict]) -> List[MessageRecord]:
+    authors: Dict = {}
+
+    def author(user):
+        if user["_id"] not in authors:
+            authors[user["_id"]] = UserRef.from_document(user)
+        return authors[user["_id"]]
+
+    return [
+        MessageRecord.from_document(
+            message, author(message["user"]),
+            [MessageRecord.from_document(reply, author(reply["user"])) for reply in message["thread"]],
+        )
+        for message in documents
+    ]
+
+
+def best_of(fn: Callable[[], object], rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def retained_bytes(fn: Callable[[], object]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+
+def measure(build: Callable, serialize: Callable, documents: List[Dict], rounds: int) -> Dict:
+    count = len(documents)
+    build_s = best_of(lambda: build(documents), rounds)
+    total_s = best_of(lambda: serialize(build(documents)), rounds)
+    return {
+        "bytes_per_message": round(retained_bytes(lambda: build(documents)) / count, 1),
+        "construct_us_per_message": round(build_s / count * 1e6, 3),
+        "construct_and_render_us_per_message": round(total_s / count * 1e6, 3),
+    }
+
+
+def main(args) -> int:
+    documents = sample_documents(args.messages, args.replies)
+    models = measure(build_models, render_models, documents, args.rounds)
+    records = measure(build_records, encode, documents, args.rounds)
+
+    assert json.loads(render_models(build_models(documents[:1])))[0]["content"] == \
+        json.loads(encode(build_records(documents[:1])))[0]["content"]
+
+    report = {
+        "messages": args.messages,
+        "replies_per_message": args.replies,
+        "pydantic": models,
+        "records": records,
+        "ratio": {key: round(models[key] / records[key], 2) for key in records if records[key]},
+    }
+    body = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(body + "\n")
+    else:
+        print(body)
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="Messages per page built")
+    parser.add_argument("--replies", type=int, default=2, help="Thread replies per message")
+    parser.add_argument("--rounds", type=int, default=5, help="Timing rounds; the fastest is reported")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark workloads and report latency percentiles and throughput.
+
+Examples:
+    python -m benchmarks.run
+    python -m benchmarks.run --workloads message_post,reaction_storm --output results.json
+    python -m benchmarks.run --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# Add the app directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from httpx import AsyncClient
+
+from app.core.config import settings
+from benchmarks.standins import install_standins
+from benchmarks.workloads import WORKLOADS, BenchContext, Workload
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    completed = len(values)
+    return {
+        "requests": completed + errors,
+        "errors": errors,
+        "duration_s": round(elapsed, 4),
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(values, 50) * 1000, 3),
+            "p95": round(percentile(values, 95) * 1000, 3),
+            "p99": round(percentile(values, 99) * 1000, 3),
+            "max": round(values[-1] * 1000, 3) if values else 0.0,
+            "mean": round(sum(values) / completed * 1000, 3) if completed else 0.0,
+        },
+    }
+
+
+async def run_workload(workload: Workload, ctx: BenchContext, requests: int, concurrency: int) -> dict:
+    await workload.setup(ctx)
+
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                await workload.operation(ctx, i)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, errors, elapsed)
+    result["concurrency"] = concurrency
+    result.update(workload.extra())
+    await workload.teardown(ctx)
+    return result
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Return a description of every metric that regressed beyond the tolerance"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for pct in ("p95", "p99"):
+            before = previous["latency_ms"][pct]
+            after = current["latency_ms"][pct]
+            if before and after > before * (1 + tolerance):
+                regressions.append(f"{name} {pct} latency {before}ms -> {after}ms")
+        before = previous["throughput_rps"]
+        after = current["throughput_rps"]
+        if before and after < before * (1 - tolerance):
+            regressions.append(f"{name} throughput {before}rps -> {after}rps")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name} errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+async def main(args) -> int:
+    names = args.workloads.split(",") if args.workloads else list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        print(f"Unknown workloads: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    app = await install_standins(mongo_url=args.mongo_url, redis_url=args.redis_url)
+    # Measure the service, not the limiter, unless asked to
+    settings.rate_limit_enabled = args.rate_limit
+    settings.group_commit_enabled = args.group_commit
+
+    results: Dict[str, dict] = {}
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        ctx = BenchContext(client, users=args.users, channels=args.channels, sockets=args.sockets)
+        for name in names:
+            workload = WORKLOADS[name]()
+            requests = args.requests or workload.default_requests
+            concurrency = args.concurrency or workload.default_concurrency
+            print(f"▶ {name}: {requests} ops @ concurrency {concurrency}", file=sys.stderr)
+            results[name] = await run_workload(workload, ctx, requests, concurrency)
+            latency = results[name]["latency_ms"]
+            print(
+                f"  p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms "
+                f"throughput={results[name]['throughput_rps']}/s errors={results[name]['errors']}",
+                file=sys.stderr,
+            )
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongo": args.mongo_url or "mongomock",
+            "redis": args.redis_url or "fakeredis",
+            "users": args.users,
+            "channels": args.channels,
+            "sockets": args.sockets,
+            "rate_limit": args.rate_limit,
+            "group_commit": args.group_commit,
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"✗ regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Hermetic load tests for the Slack clone API")
+    parser.add_argument("--workloads", help=f"Comma separated subset of: {', '.join(WORKLOADS)}")
+    parser.add_argument("--requests", type=int, help="Operations per workload (default: per workload)")
+    parser.add_argument("--concurrency", type=int, help="Concurrent clients (default: per workload)")
+    parser.add_argument("--users", type=int, default=20, help="Users registered for the run")
+    parser.add_argument("--channels", type=int, default=10, help="Channels created for the run")
+    parser.add_argument("--sockets", type=int, default=10_000, help="Sockets used by ws_fanout")
+    parser.add_argument("--mongo-url", help="Use a local mongod instead of the in-memory stand-in")
+    parser.add_argument("--redis-url", help="Use a local Redis instead of fakeredis")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep request rate limiting enabled")
+    parser.add_argument("--group-commit", action="store_true", help="Batch message inserts with group commit")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="Previous JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,136 @@
+"""
+Local stand-ins for the external services used by ``main:app``.
+
+Mongo is served by mongomock-motor (or a local ``mongod`` when a URL is
+given), Redis by fakeredis, and MinIO by a small in-memory object store that
+implements the subset of the MinIO client API used by the file endpoints.
+"""
+import io
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from minio.error import S3Error
+
+
+class _StoredObject:
+    __slots__ = ("data", "content_type", "last_modified")
+
+    def __init__(self, data: bytes, content_type: Optional[str]):
+        self.data = data
+        self.content_type = content_type or "application/octet-stream"
+        self.last_modified = datetime.now(timezone.utc)
+
+
+class _ObjectStat:
+    def __init__(self, object_name: str, stored: _StoredObject):
+        self.object_name = object_name
+        self.size = len(stored.data)
+        self.content_type = stored.content_type
+        self.last_modified = stored.last_modified
+
+
+class _ObjectResponse(io.BytesIO):
+    """Mimics the urllib3 response returned by ``Minio.get_object``"""
+
+    def release_conn(self):
+        pass
+
+    def stream(self, amt: int = 64 * 1024):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                break
+            yield chunk
+
+
+class InMemoryObjectStore:
+    """Thread-safe, in-process substitute for the MinIO client"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Dict[str, _StoredObject]] = {}
+        self._lock = threading.Lock()
+
+    def _no_such_key(self, bucket_name: str, object_name: str):
+        return S3Error(
+            "NoSuchKey",
+            "The specified key does not exist.",
+            f"/{bucket_name}/{object_name}",
+            "standin",
+            "standin",
+            None,
+            bucket_name=bucket_name,
+            object_name=object_name,
+        )
+
+    def bucket_exists(self, bucket_name: str) -> bool:
+        return bucket_name in self._buckets
+
+    def make_bucket(self, bucket_name: str, *args, **kwargs):
+        with self._lock:
+            self._buckets.setdefault(bucket_name, {})
+
+    def put_object(self, bucket_name, object_name, data, length, content_type=None, **kwargs):
+        payload = data.read(length) if length >= 0 else data.read()
+        with self._lock:
+            self._buckets.setdefault(bucket_name, {})[object_name] = _StoredObject(payload, content_type)
+
+    def _get(self, bucket_name: str, object_name: str) -> _StoredObject:
+        stored = self._buckets.get(bucket_name, {}).get(object_name)
+        if stored is None:
+            raise self._no_such_key(bucket_name, object_name)
+        return stored
+
+    def get_object(self, bucket_name, object_name, offset: int = 0, length: int = 0, **kwargs):
+        data = self._get(bucket_name, object_name).data
+        end = offset + length if length else len(data)
+        return _ObjectResponse(data[offset:end])
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        return _ObjectStat(object_name, self._get(bucket_name, object_name))
+
+    def remove_object(self, bucket_name, object_name, **kwargs):
+        with self._lock:
+            self._buckets.get(bucket_name, {}).pop(object_name, None)
+
+    def list_objects(self, bucket_name, prefix: Optional[str] = None, recursive: bool = False, **kwargs):
+        objects = list(self._buckets.get(bucket_name, {}).items())
+        for name, stored in sorted(objects):
+            if prefix and not name.startswith(prefix):
+                continue
+            yield _ObjectStat(name, stored)
+
+
+async def install_standins(mongo_url: Optional[str] = None, redis_url: Optional[str] = None):
+    """
+    Point the application's Mongo, Redis and MinIO clients at local stand-ins.
+
+    Used instead of running the app lifespan, so that nothing reaches for the
+    configured servers. A local ``mongod`` URL goes through the regular
+    ``init_db`` path and must already be migrated.
+    """
+    import main
+    from app.core.config import settings
+    from app.core.database import db, init_db
+    from app.core.redis import redis_state
+    from app.core.storage import storage
+
+    if mongo_url:
+        settings.database_url = mongo_url
+        await init_db()
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        from app.core.indexes import apply_indexes
+        db.client = AsyncMongoMockClient()
+        db.db = db.client["slack_clone_bench"]
+        await apply_indexes(db.db)
+
+    if redis_url:
+        settings.redis_url = redis_url
+    else:
+        from fakeredis import aioredis
+        redis_state.client = aioredis.FakeRedis()
+
+    storage.client = InMemoryObjectStore()
+
+    return main.app
@@ -0,0 +1,324 @@
+"""
+Scripted workloads driven against the in-process application.
+
+Each workload has an async ``setup`` that prepares fixtures through the public
+API and an async ``operation`` that performs one measured unit of work.
+"""
+import abc
+import asyncio
+import itertools
+import json
+import time
+import uuid
+from typing import Dict, List
+
+from httpx import AsyncClient
+
+
+class BenchContext:
+    """State shared by the workloads of one benchmark run"""
+
+    def __init__(self, client: AsyncClient, users: int, channels: int, sockets: int):
+        self.client = client
+        self.user_count = users
+        self.channel_count = channels
+        self.socket_count = sockets
+        self.run_id = uuid.uuid4().hex[:8]
+        self.users: List[Dict[str, str]] = []
+        self.channel_ids: List[str] = []
+        self.message_ids: List[str] = []
+        self._user_cycle = None
+
+    def next_user(self) -> Dict[str, str]:
+        return next(self._user_cycle)
+
+    def auth(self, user: Dict[str, str]) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {user['access_token']}"}
+
+    async def ensure_users(self):
+        if self.users:
+            return
+        for i in range(self.user_count):
+            payload = {
+                "email": f"bench-{self.run_id}-{i}@example.com",
+                "username": f"bench-{self.run_id}-{i}",
+                "password": "password123",
+            }
+            response = await self.client.post("/api/v1/auth/register", json=payload)
+            response.raise_for_status()
+            body = response.json()
+            self.users.append({
+                "email": payload["email"],
+                "password": payload["password"],
+                "id": body["user"]["id"],
+                "access_token": body["access_token"],
+            })
+        self._user_cycle = itertools.cycle(self.users)
+
+    async def ensure_channels(self, messages_per_channel: int = 50):
+        await self.ensure_users()
+        if self.channel_ids:
+            return
+        owner = self.users[0]
+        for i in range(self.channel_count):
+            response = await self.client.post(
+                "/api/v1/channels/",
+                json={"name": f"bench-{self.run_id}-{i}", "description": "benchmark channel"},
+                headers=self.auth(owner),
+            )
+            response.raise_for_status()
+            channel_id = response.json()["id"]
+            self.channel_ids.append(channel_id)
+            for j in range(messages_per_channel):
+                response = await self.client.post(
+                    f"/api/v1/messages/channels/{channel_id}/messages",
+                    json={"content": f"seed message {j}"},
+                    headers=self.auth(self.next_user()),
+                )
+                response.raise_for_status()
+                self.message_ids.append(response.json()["id"])
+
+
+class Workload(abc.ABC):
+    name = ""
+    description = ""
+    default_requests = 500
+    default_concurrency = 32
+
+    async def setup(self, ctx: BenchContext):
+        pass
+
+    @abc.abstractmethod
+    async def operation(self, ctx: BenchContext, i: int):
+        """One measured unit of work"""
+
+    async def teardown(self, ctx: BenchContext):
+        pass
+
+    def extra(self) -> dict:
+        return {}
+
+
+class LoginStorm(Workload):
+    name = "login_storm"
+    description = "POST /auth/login for a rotating pool of users"
+    default_requests = 100
+
+    async def setup(self, ctx):
+        await ctx.ensure_users()
+
+    async def operation(self, ctx, i):
+        user = ctx.users[i % len(ctx.users)]
+        response = await ctx.client.post(
+            "/api/v1/auth/login",
+            json={"email": user["email"], "password": user["password"]},
+        )
+        response.raise_for_status()
+
+
+class ChannelOpenBurst(Workload):
+    name = "channel_open_burst"
+    description = "GET a channel followed by its first history page"
+
+    async def setup(self, ctx):
+        await ctx.ensure_channels()
+
+    async def operation(self, ctx, i):
+        headers = ctx.auth(ctx.next_user())
+        channel_id = ctx.channel_ids[i % len(ctx.channel_ids)]
+        response = await ctx.client.get(f"/api/v1/channels/{channel_id}", headers=headers)
+        response.raise_for_status()
+        response = await ctx.client.get(
+            f"/api/v1/messages/channels/{channel_id}/messages",
+            params={"limit": 50},
+            headers=headers,
+        )
+        response.raise_for_status()
+
+
+class ChannelList(Workload):
+    name = "channel_list"
+    description = "GET /channels/ for the whole workspace"
+
+    async def setup(self, ctx):
+        await ctx.ensure_channels()
+
+    async def operation(self, ctx, i):
+        response = await ctx.client.get("/api/v1/channels/", headers=ctx.auth(ctx.next_user()))
+        response.raise_for_status()
+
+
+class AnnouncementBurst(Workload):
+    name = "announcement_burst"
+    description = "Every client GETs the same channel's first history page at once"
+    default_concurrency = 64
+
+    async def setup(self, ctx):
+        await ctx.ensure_channels()
+        self._before = self._flights()
+
+    async def operation(self, ctx, i):
+        response = await ctx.client.get(
+            f"/api/v1/messages/channels/{ctx.channel_ids[0]}/messages",
+            params={"limit": 50},
+            headers=ctx.auth(ctx.next_user()),
+        )
+        response.raise_for_status()
+
+    @staticmethod
+    def _flights() -> Dict[str, float]:
+        from app.core.singleflight import singleflight_calls_total
+        return {
+            result: singleflight_calls_total.value(("get_messages", result))
+            for result in ("leader", "shared", "bypassed")
+        }
+
+    def extra(self):
+        after = self._flights()
+        counts = {result: after[result] - self._before[result] for result in after}
+        total = sum(counts.values())
+        return {
+            "database_reads": int(counts["leader"] + counts["bypassed"]),
+            "shared_reads": int(counts["shared"]),
+            "shared_fraction": round(counts["shared"] / total, 3) if total else 0.0,
+        }
+
+
+class UnreadBadges(Workload):
+    name = "unread_badges"
+    description = "GET /channels/unread for the sidebar badges"
+
+    async def setup(self, ctx):
+        await ctx.ensure_channels()
+
+    async def operation(self, ctx, i):
+        response = await ctx.client.get("/api/v1/channels/unread", headers=ctx.auth(ctx.next_user()))
+        response.raise_for_status()
+
+
+class MessagePost(Workload):
+    name = "message_post"
+    description = "POST a message into a rotating channel"
+
+    async def setup(self, ctx):
+        await ctx.ensure_channels(messages_per_channel=0)
+        self._before = self._bumps()
+
+    async def operation(self, ctx, i):
+        channel_id = ctx.channel_ids[i % len(ctx.channel_ids)]
+        response = await ctx.client.post(
+            f"/api/v1/messages/channels/{channel_id}/messages",
+            json={"content": f"benchmark message {i}"},
+            headers=ctx.auth(ctx.next_user()),
+        )
+        response.raise_for_status()
+
+    @staticmethod
+    def _bumps() -> Dict[str, float]:
+        from app.crud.read_state import channel_version_bumps_total
+        return {result: channel_version_bumps_total.value((result,)) for result in ("applied", "coalesced")}
+
+    def extra(self):
+        after = self._bumps()
+        applied = after["applied"] - self._before["applied"]
+        posts = applied + after["coalesced"] - self._before["coalesced"]
+        # Channel document writes per post: one allocate_rev plus this share of a version bump
+        return {"version_writes_per_post": round(applied / posts, 3) if posts else 0.0}
+
+
+class ReactionStorm(Workload):
+    name = "reaction_storm"
+    description = "Toggle reactions on a small set of hot messages"
+
+    hot_messages = 5
+    emojis = ["👍", "🎉", "🔥", "👀"]
+
+    async def setup(self, ctx):
+        await ctx.ensure_channels()
+
+    async def operation(self, ctx, i):
+        message_id = ctx.message_ids[i % min(self.hot_messages, len(ctx.message_ids))]
+        response = await ctx.client.post(
+            f"/api/v1/messages/messages/{message_id}/reactions",
+            json={"emoji": self.emojis[i % len(self.emojis)]},
+            headers=ctx.auth(ctx.next_user()),
+        )
+        response.raise_for_status()
+
+
+class VideoTokenBurst(Workload):
+    name = "video_token_burst"
+    description = "POST /video/tokens for every channel, as at the start of an all-hands call"
+
+    async def setup(self, ctx):
+        await ctx.ensure_channels(messages_per_channel=0)
+
+    async def operation(self, ctx, i):
+        response = await ctx.client.post(
+            "/api/v1/video/tokens",
+            json={"channel_ids": ctx.channel_ids[:100]},
+            headers=ctx.auth(ctx.next_user()),
+        )
+        response.raise_for_status()
+
+
+class _BenchSocket:
+    """Minimal WebSocket double that counts delivered frames"""
+
+    __slots__ = ("frames",)
+
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.frames += 1
+
+
+class WebSocketFanout(Workload):
+    name = "ws_fanout"
+    description = "Broadcast one frame through the ConnectionManager to every socket"
+    default_requests = 20
+    default_concurrency = 1
+
+    def __init__(self):
+        self._connected: List[_BenchSocket] = []
+        self._elapsed = 0.0
+
+    async def setup(self, ctx):
+        import main
+        for _ in range(ctx.socket_count):
+            socket = _BenchSocket()
+            await main.manager.connect(socket)
+            self._connected.append(socket)
+
+    async def operation(self, ctx, i):
+        import main
+        started = time.perf_counter()
+        await main.manager.broadcast(json.dumps({"type": "bench", "seq": i}))
+        # Broadcast only enqueues; wait for the per-socket senders to drain
+        while main.manager.pending_frames():
+            await asyncio.sleep(0)
+        self._elapsed += time.perf_counter() - started
+
+    async def teardown(self, ctx):
+        import main
+        for socket in self._connected:
+            await main.manager.disconnect(socket)
+
+    def extra(self):
+        frames = sum(socket.frames for socket in self._connected)
+        return {
+            "sockets": len(self._connected),
+            "frames_delivered": frames,
+            "frames_per_second": round(frames / self._elapsed, 1) if self._elapsed else 0.0,
+        }
+
+
+WORKLOADS = {
+    workload.name: workload
+    for workload in (LoginStorm, ChannelOpenBurst, ChannelList, AnnouncementBurst, UnreadBadges, MessagePost,
+                     ReactionStorm, VideoTokenBurst, WebSocketFanout)
+}
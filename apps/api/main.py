@@ -1,22 +1,73 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
 import redis.asyncio as redis
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import init_db, close_db, get_db
+from app.core.group_commit import message_committer
+from app.core.loadshed import LoadSheddingMiddleware
+from app.core.metrics import MetricsMiddleware, publish_snapshot, registry, render_all_workers
+from app.core.profiling import ProfilingMiddleware
+from app.core.read_routing import ReadRoutingMiddleware
+from app.core.redis import close_redis, get_redis
+from app.core.storage import close_storage
+from app.core.thumbnails import thumbnails
+from app.crud.files import collect_stale_blobs
+from app.crud.read_state import read_markers
+from app.crud.uploads import collect_abandoned_uploads
 from app.api.v1.api import api_router
-from app.websocket.manager import ConnectionManager
+from app.websocket.manager import manager
+from app.websocket.rpc import RpcSession
+
+logger = logging.getLogger(__name__)
+
+async def publish_metrics_snapshots():
+    """Share this worker's metrics so whichever worker is scraped can report all of them"""
+    while True:
+        try:
+            await publish_snapshot(get_redis())
+        except Exception as e:
+            logger.warning(f"Failed to publish metrics snapshot: {e}")
+        await asyncio.sleep(settings.metrics_snapshot_seconds)
+
+async def collect_uploads():
+    """Abort resumable uploads whose clients never came back, and content whose uploaders died"""
+    while True:
+        await asyncio.sleep(settings.upload_gc_interval_seconds)
+        try:
+            await collect_abandoned_uploads()
+            await collect_stale_blobs(get_db())
+        except Exception as e:
+            logger.warning(f"Failed to collect abandoned uploads: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await init_db()
+    snapshots = None
+    if settings.metrics_enabled and settings.metrics_multiprocess:
+        snapshots = asyncio.create_task(publish_metrics_snapshots())
+    uploads_gc = asyncio.create_task(collect_uploads())
     yield
     # Shutdown
+    if snapshots is not None:
+        snapshots.cancel()
+    uploads_gc.cancel()
+    await message_committer.close()
+    await read_markers.close()
+    await thumbnails.close()
+    await manager.shutdown()
+    await close_redis()
+    close_storage()
+    await close_db()
 
 app = FastAPI(
     title="Slack Clone API",
@@ -25,33 +76,100 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# CORS middleware
+# Per-request database operation profiling
+if settings.profiling_enabled:
+    app.add_middleware(ProfilingMiddleware)
+
+# Remember each user's last write so routed reads stay read-your-writes
+if settings.read_routing_enabled:
+    app.add_middleware(ReadRoutingMiddleware)
+
+# Route latency and request count metrics
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+# Adaptive concurrency limit; outside the others so shed requests cost as little as possible
+if settings.loadshed_enabled:
+    app.add_middleware(LoadSheddingMiddleware)
+
+# CORS middleware; outermost so shed responses carry CORS headers and preflights are answered first
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:8080"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
-# WebSocket connection manager
-manager = ConnectionManager()
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    if settings.metrics_multiprocess:
+        body = await render_all_workers(get_redis(), max_age=settings.metrics_snapshot_seconds * 3)
+    else:
+        body = registry.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 # Include API routes
 app.include_router(api_router, prefix="/api/v1")
 
 # WebSocket endpoint
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, token: str = None):
+    # Authenticated sockets (?token=<access token>) count towards presence and may send commands
+    session = RpcSession()
+    if token:
+        try:
+            session = await RpcSession.open(token)
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+    user_id = session.user.id if session.user else None
+    
+    await manager.connect(websocket, user_id)
     try:
         while True:
-            data = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            data = message.get("text")
+            if data is None:
+                # Binary frames carry nothing this endpoint understands
+                continue
+            control = None
+            if data.startswith("{"):
+                try:
+                    control = json.loads(data)
+                except ValueError:
+                    pass
+            if isinstance(control, dict) and control.get("type") in ("subscribe", "unsubscribe") and control.get("channel_id"):
+                if control["type"] == "subscribe":
+                    await manager.subscribe_to_channel(str(control["channel_id"]), websocket)
+                else:
+                    await manager.unsubscribe_from_channel(str(control["channel_id"]), websocket)
+                continue
+            if isinstance(control, dict) and control.get("type") == "typing":
+                # Ephemeral: aggregated per channel, never relayed frame by frame
+                if user_id and control.get("channel_id"):
+                    manager.typing.ping(websocket, user_id, str(control["channel_id"]), control.get("state") != "stop")
+                continue
+            if isinstance(control, dict) and control.get("type") == "rpc":
+                # One at a time, so a client's commands apply in the order it sent them
+                await manager.send_personal_json(await session.call(control), websocket)
+                continue
+            if isinstance(control, dict) and control.get("type") == "auth":
+                await manager.send_personal_json(await session.authenticate(control), websocket)
+                continue
             await manager.broadcast(data)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Whatever ended the loop, the socket must stop counting towards presence
         await manager.disconnect(websocket)
 
 if __name__ == "__main__":
+    # Development server; use serve.py for multi-worker production runs
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Move messages older than ARCHIVE_AFTER_DAYS into compressed MinIO segments.
+
+Safe to run repeatedly (e.g. nightly from cron); an interrupted run is
+finished by the next one.
+"""
+import argparse
+import asyncio
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Add the app directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.core.database import init_db, get_db, close_db
+from app.core.storage import close_storage
+from app.crud.archive import archive_messages
+
+async def archive(days: int, channel_ids) -> int:
+    await init_db()
+    db = get_db()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    try:
+        print(f"📦 Archiving messages created before {cutoff.isoformat()}...")
+        results = await archive_messages(db, cutoff, channel_ids)
+        total = sum(results.values())
+        print(f"✅ Archived {total} messages from {sum(1 for n in results.values() if n)} channels")
+    finally:
+        close_storage()
+        await close_db()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=settings.archive_after_days, help="Archive messages older than this")
+    parser.add_argument("--channel", action="append", dest="channels", help="Only this channel id (repeatable)")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(archive(args.days, args.channels)))
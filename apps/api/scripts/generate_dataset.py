@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Generate a large synthetic workspace for scale testing.
+
+Message volume per channel and per author follows a Zipf distribution, a share
+of messages are thread replies or carry reactions, and file metadata is
+generated alongside. Output is deterministic for a given --seed: ids are
+derived from counters rather than generated randomly, so worker processes can
+reference users, channels and thread parents without querying each other.
+
+Examples:
+    python scripts/generate_dataset.py --drop --messages 10000000
+    python scripts/generate_dataset.py --users 5000 --channels 2000 --workers 16
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+import uuid
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Dict, Iterator, List, Tuple
+
+from bson import ObjectId
+from pymongo import MongoClient, WriteConcern
+
+# Add the app directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.core.database import init_db, get_db, close_db
+from app.core.indexes import MIGRATIONS_COLLECTION, apply_indexes
+from app.core.security import get_password_hash
+from app.crud.archive import SEGMENTS_COLLECTION
+from app.crud.notifications import NOTIFICATIONS_COLLECTION
+from app.crud.sync import TOMBSTONES_COLLECTION
+
+# ObjectId "machine" byte per collection keeps generated ids from colliding
+USER, CHANNEL, MESSAGE, FILE = 1, 2, 3, 4
+
+WORDS = (
+    "deploy release build review merge branch ticket sprint standup demo bug fix "
+    "latency dashboard alert incident rollback config cache index query api client "
+    "server worker queue retry timeout metrics logs trace design doc meeting lunch "
+    "coffee friday weekend thanks please agreed sounds good ship it lgtm nit typo"
+).split()
+EMOJIS = ["👍", "🎉", "🔥", "👀", "✅", "❤️", "😂", "🙏"]
+FILE_TYPES = [
+    ("png", "image/png"), ("jpg", "image/jpeg"), ("pdf", "application/pdf"),
+    ("txt", "text/plain"), ("zip", "application/zip"), ("csv", "text/csv"),
+]
+
+def make_id(kind: int, n: int, at: datetime) -> ObjectId:
+    """Deterministic ObjectId: creation timestamp, collection byte, counter"""
+    return ObjectId(struct.pack(">IB", int(at.timestamp()), kind) + n.to_bytes(7, "big"))
+
+def zipf_weights(n: int, exponent: float) -> List[float]:
+    return [1 / (rank ** exponent) for rank in range(1, n + 1)]
+
+def distribute(total: int, weights: List[float]) -> List[int]:
+    """Split ``total`` proportionally to ``weights`` (largest remainder, no randomness)"""
+    scale = total / sum(weights)
+    exact = [w * scale for w in weights]
+    counts = [int(x) for x in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - counts[i], reverse=True)
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+class Plan:
+    """Everything a worker needs to generate its share of documents"""
+
+    def __init__(self, args):
+        self.seed = args.seed
+        self.users = args.users
+        self.channels = args.channels
+        self.thread_ratio = args.thread_ratio
+        self.reaction_ratio = args.reaction_ratio
+        self.mention_ratio = args.mention_ratio
+        self.end = datetime.fromisoformat(args.end).replace(tzinfo=timezone.utc)
+        self.start = self.end - timedelta(days=args.days)
+        self.span = (self.end - self.start).total_seconds()
+
+        self.channel_counts = distribute(args.messages, zipf_weights(args.channels, args.zipf))
+        # Offset of each channel's first message in the global message counter
+        self.channel_offsets = [0] + list(accumulate(self.channel_counts))[:-1]
+        self.author_cum_weights = list(accumulate(zipf_weights(args.users, args.zipf)))
+
+    def user_created(self, n: int) -> datetime:
+        return self.start - timedelta(days=1, seconds=n)
+
+    def user_id(self, n: int) -> ObjectId:
+        return make_id(USER, n, self.user_created(n))
+
+    def channel_id(self, n: int) -> ObjectId:
+        return make_id(CHANNEL, n, self.start - timedelta(seconds=n))
+
+    def message_time(self, channel: int, seq: int) -> datetime:
+        # Spread a channel's messages evenly across the window, staggered per channel
+        fraction = seq / (self.channel_counts[channel] + 1)
+        return self.start + timedelta(seconds=self.span * fraction + channel % 60)
+
+    def message_id(self, channel: int, seq: int) -> ObjectId:
+        return make_id(MESSAGE, self.channel_offsets[channel] + seq, self.message_time(channel, seq))
+
+    def random_author(self, rng: random.Random) -> int:
+        return bisect(self.author_cum_weights, rng.random() * self.author_cum_weights[-1])
+
+    def rng(self, *parts) -> random.Random:
+        # str seeds hash with SHA-512, so this is stable across processes and runs
+        return random.Random(":".join(str(part) for part in (self.seed, *parts)))
+
+def generate_users(plan: Plan, password_hash: str) -> List[Dict]:
+    return [
+        {
+            "_id": plan.user_id(n),
+            "email": f"user{n}@example.com",
+            "username": f"user{n}",
+            "hashed_password": password_hash,
+            "avatar": None,
+            "created_at": plan.user_created(n),
+            "updated_at": plan.user_created(n),
+        }
+        for n in range(plan.users)
+    ]
+
+def generate_channels(plan: Plan) -> List[Dict]:
+    channels = []
+    for n in range(plan.channels):
+        created = plan.start - timedelta(seconds=n)
+        channels.append({
+            "_id": plan.channel_id(n),
+            "name": "general" if n == 0 else f"channel-{n}",
+            "description": f"Synthetic channel {n}",
+            "created_by": plan.user_id(n % plan.users),
+            "last_seq": plan.channel_counts[n],
+            "created_at": created,
+            "updated_at": created,
+        })
+    return channels
+
+def generate_messages(plan: Plan, channel: int, first_seq: int, last_seq: int) -> List[Dict]:
+    rng = plan.rng("messages", channel, first_seq)
+    channel_id = str(plan.channel_id(channel))
+    messages = []
+    for seq in range(first_seq, last_seq + 1):
+        created = plan.message_time(channel, seq)
+        words = rng.choices(WORDS, k=rng.randint(3, 30))
+        if rng.random() < plan.mention_ratio:
+            words.insert(0, f"@user{plan.random_author(rng)}")
+        message = {
+            "_id": plan.message_id(channel, seq),
+            "content": " ".join(words),
+            "channel_id": channel_id,
+            "user_id": plan.user_id(plan.random_author(rng)),
+            "seq": seq,
+            "reactions": [],
+            "created_at": created,
+            "updated_at": created,
+        }
+        if seq > 1 and rng.random() < plan.thread_ratio:
+            message["thread_id"] = plan.message_id(channel, rng.randint(max(1, seq - 50), seq - 1))
+        if rng.random() < plan.reaction_ratio:
+            for emoji in rng.sample(EMOJIS, rng.randint(1, 3)):
+                users = sorted({str(plan.user_id(plan.random_author(rng))) for _ in range(rng.randint(1, 5))})
+                message["reactions"].append({
+                    "_id": ObjectId(rng.getrandbits(96).to_bytes(12, "big")),
+                    "emoji": emoji,
+                    "count": len(users),
+                    "users": users,
+                })
+        messages.append(message)
+    return messages
+
+def generate_files(plan: Plan, first: int, last: int) -> List[Dict]:
+    rng = plan.rng("files", first)
+    files = []
+    for n in range(first, last):
+        extension, content_type = rng.choice(FILE_TYPES)
+        channel = rng.randrange(plan.channels)
+        created = plan.start + timedelta(seconds=rng.random() * plan.span)
+        files.append({
+            "_id": make_id(FILE, n, created),
+            "filename": f"{rng.choice(WORDS)}-{n}.{extension}",
+            "stored_filename": f"{uuid.UUID(int=rng.getrandbits(128), version=4)}.{extension}",
+            "size": min(10 * 1024 * 1024, int(rng.lognormvariate(11, 1.5))),
+            "content_type": content_type,
+            "uploaded_by": str(plan.user_id(plan.random_author(rng))),
+            "channel_id": str(plan.channel_id(channel)),
+            "created_at": created,
+        })
+    return files
+
+def message_tasks(plan: Plan, batch: int) -> Iterator[Tuple]:
+    for channel, count in enumerate(plan.channel_counts):
+        for first in range(1, count + 1, batch):
+            yield ("messages", channel, first, min(count, first + batch - 1))
+
+def file_tasks(total: int, batch: int) -> Iterator[Tuple]:
+    for first in range(0, total, batch):
+        yield ("files", first, min(total, first + batch))
+
+_worker = {}
+
+def _init_worker(url: str, plan: Plan):
+    client = MongoClient(url, w=1, journal=False)
+    _worker["db"] = client.get_default_database("slack_clone")
+    _worker["plan"] = plan
+
+def _run_task(task: Tuple) -> Tuple[str, int]:
+    kind, *args = task
+    plan = _worker["plan"]
+    if kind == "messages":
+        documents = generate_messages(plan, *args)
+    else:
+        documents = generate_files(plan, *args)
+    collection = _worker["db"].get_collection(kind, write_concern=WriteConcern(w=1, j=False))
+    collection.insert_many(documents, ordered=False)
+    return kind, len(documents)
+
+def generate(args) -> int:
+    plan = Plan(args)
+    client = MongoClient(args.mongo_url)
+    db = client.get_default_database("slack_clone")
+
+    if args.drop:
+        # Ids are deterministic, so anything left over would refer to the regenerated documents
+        for name in (
+            "users", "channels", "messages", "files", "file_objects", "read_markers",
+            SEGMENTS_COLLECTION, TOMBSTONES_COLLECTION, NOTIFICATIONS_COLLECTION, MIGRATIONS_COLLECTION,
+        ):
+            db.drop_collection(name)
+        print("🧹 Dropped existing collections")
+
+    # One bcrypt call for every user instead of one each
+    password_hash = get_password_hash(args.password)
+    db.users.insert_many(generate_users(plan, password_hash), ordered=False)
+    db.channels.insert_many(generate_channels(plan), ordered=False)
+    print(f"👥 {args.users} users, 📨 {args.channels} channels "
+          f"(largest has {max(plan.channel_counts)} messages)")
+
+    tasks = list(message_tasks(plan, args.batch_size)) + list(file_tasks(args.files, args.batch_size))
+    started = time.perf_counter()
+    written = {"messages": 0, "files": 0}
+    with multiprocessing.Pool(args.workers, _init_worker, (args.mongo_url, plan)) as pool:
+        for kind, count in pool.imap_unordered(_run_task, tasks):
+            written[kind] += count
+            total = written["messages"] + written["files"]
+            if total % (args.batch_size * 20) < args.batch_size:
+                rate = total / (time.perf_counter() - started)
+                print(f"  {written['messages']:,} messages, {written['files']:,} files ({rate:,.0f} docs/s)")
+    elapsed = time.perf_counter() - started
+    print(f"✅ Wrote {written['messages']:,} messages and {written['files']:,} files in {elapsed:.1f}s")
+    client.close()
+
+    if not args.skip_indexes:
+        # Building indexes once after the load is much faster than maintaining them per insert
+        settings.database_url = args.mongo_url
+        asyncio.run(_apply_indexes())
+        print("✅ Indexes applied")
+    return 0
+
+async def _apply_indexes():
+    await init_db()
+    try:
+        await apply_indexes(get_db())
+    finally:
+        await close_db()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic workspace for scale testing")
+    parser.add_argument("--mongo-url", default=settings.database_url, help="Target database URL")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Skew of message volume per channel and author")
+    parser.add_argument("--thread-ratio", type=float, default=0.05, help="Share of messages that are thread replies")
+    parser.add_argument("--reaction-ratio", type=float, default=0.1, help="Share of messages with reactions")
+    parser.add_argument("--mention-ratio", type=float, default=0.05, help="Share of messages with an @mention")
+    parser.add_argument("--days", type=int, default=365, help="History length")
+    parser.add_argument("--end", default="2025-01-01", help="Timestamp of the newest message (ISO date)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="password123", help="Password shared by every generated user")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-size", type=int, default=5000, help="Documents per insert_many")
+    parser.add_argument("--drop", action="store_true", help="Drop existing collections first")
+    parser.add_argument("--skip-indexes", action="store_true", help="Do not apply the index registry afterwards")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    sys.exit(generate(parse_args()))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Apply the index registry in app/core/indexes.py to the configured database
+"""
+import argparse
+import asyncio
+import sys
+import os
+
+# Add the app directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.database import init_db, get_db, close_db
+from app.core.indexes import INDEX_VERSION, apply_indexes, check_indexes, collscan_queries
+
+async def migrate(check_only: bool, explain: bool) -> int:
+    """Apply (or just verify) registered indexes"""
+    
+    await init_db()
+    db = get_db()
+    status = 0
+    
+    try:
+        if check_only:
+            if await check_indexes(db):
+                print(f"✅ Indexes are up to date (version {INDEX_VERSION})")
+            else:
+                print("❌ Indexes are missing or outdated, see warnings above")
+                status = 1
+        else:
+            print(f"🔧 Applying index version {INDEX_VERSION}...")
+            await apply_indexes(db)
+            print("✅ Indexes applied")
+        
+        if explain:
+            offenders = await collscan_queries(db)
+            for query in offenders:
+                print(f"❌ COLLSCAN: {query.collection}: {query.description}")
+            if offenders:
+                status = 1
+            else:
+                print("✅ Every registered query uses an index")
+    finally:
+        await close_db()
+    
+    return status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--check", action="store_true", help="Only report missing indexes")
+    parser.add_argument("--explain", action="store_true", help="Run explain() on every registered query")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(migrate(args.check, args.explain)))
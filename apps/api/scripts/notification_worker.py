@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Drain the mention notification queue (see app/crud/notifications.py).
+
+Run one or more next to the API workers; they share the queue through Redis.
+Failed jobs are retried with backoff (JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS)
+and jobs held by a worker that died are picked up again after
+JOB_VISIBILITY_SECONDS.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import os
+
+# Add the app directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.core.database import init_db, get_db, close_db
+from app.core.redis import close_redis
+from app.crud.notifications import deliver_mentions, notification_jobs
+from app.websocket.manager import manager
+
+async def run(claim_size: int) -> int:
+    await init_db()
+    db = get_db()
+
+    async def handle(job):
+        await deliver_mentions(db, manager, job)
+
+    worker = asyncio.create_task(notification_jobs.work(handle, claim_size))
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.cancel)
+
+    print(f"📨 Delivering notifications from {notification_jobs.ready_key} ({claim_size} jobs per claim)...")
+    try:
+        await worker
+    except asyncio.CancelledError:
+        pass
+    finally:
+        # Flushes pushes still queued for the API workers
+        await manager.shutdown()
+        await close_redis()
+        await close_db()
+    print("👋 Notification worker stopped")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--claim-size", type=int, default=settings.notification_claim_size,
+                        help="Jobs claimed and run concurrently per round trip")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.claim_size)))
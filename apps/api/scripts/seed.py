@@ -12,6 +12,7 @@ from bson import ObjectId
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from app.core.database import init_db, get_db
+from app.core.indexes import apply_indexes
 from app.core.security import get_password_hash
 
 async def seed_database():
@@ -20,6 +21,7 @@ async def seed_database():
     # Initialize database connection
     await init_db()
     db = get_db()
+    await apply_indexes(db)
     
     print("🌱 Seeding database...")
     
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Production entry point: one uvicorn worker per core with uvloop and httptools.
+
+Workers share nothing in memory. WebSocket fan-out and presence go through
+Redis (see app/websocket/manager.py) and /metrics merges every worker's
+snapshot, so any worker can serve any request.
+
+    WEB_WORKERS=8 python serve.py
+"""
+import multiprocessing
+import os
+
+import uvicorn
+
+from app.core.config import settings
+
+def worker_count() -> int:
+    return settings.web_workers or multiprocessing.cpu_count()
+
+def main():
+    workers = worker_count()
+    if workers > 1:
+        # Read by each worker's Settings; a scrape only ever reaches one worker
+        os.environ["METRICS_MULTIPROCESS"] = "true"
+
+    uvicorn.run(
+        "main:app",
+        host=settings.web_host,
+        port=settings.web_port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        backlog=settings.web_backlog,
+        timeout_keep_alive=settings.web_keepalive_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.web_forwarded_allow_ips,
+        access_log=settings.web_access_log,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Shared fixtures: in-memory stand-ins for MongoDB and Redis, and the
+read-marker buffer the message and channel endpoints write through.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from fakeredis import aioredis
+from mongomock_motor import AsyncMongoMockClient
+
+from app.api.v1.endpoints import channels as channels_endpoint
+from app.api.v1.endpoints import messages as messages_endpoint
+from app.core.config import settings
+from app.core.database import db as database
+from app.core.redis import redis_state
+from app.crud.read_state import ReadMarkerBuffer
+
+@pytest.fixture
+def mongo(monkeypatch, request):
+    monkeypatch.setattr(database, "db", AsyncMongoMockClient()[f"{request.module.__name__}_db"])
+    return database.db
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = aioredis.FakeRedis()
+    monkeypatch.setattr(redis_state, "client", client)
+    return client
+
+@pytest_asyncio.fixture
+async def marker_buffer(monkeypatch):
+    buffer = ReadMarkerBuffer()
+    monkeypatch.setattr(messages_endpoint, "read_markers", buffer)
+    monkeypatch.setattr(channels_endpoint, "read_markers", buffer)
+    yield buffer
+    await buffer.close()
+
+@pytest.fixture
+def messaging(mongo, marker_buffer, monkeypatch):
+    """Message endpoints writing straight to the in-memory database"""
+    monkeypatch.setattr(settings, "group_commit_enabled", False)
+    return mongo
+
+@pytest_asyncio.fixture
+async def channel(messaging):
+    """#general and alice, who created it"""
+    user_id = (await messaging.users.insert_one({"username": "alice", "avatar": None})).inserted_id
+    channel_id = (await messaging.channels.insert_one({
+        "name": "general", "created_by": user_id, "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+    })).inserted_id
+    return str(channel_id), SimpleNamespace(id=str(user_id), username="alice", avatar=None)
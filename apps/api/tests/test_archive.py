@@ -0,0 +1,118 @@
+import io
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import Request, Response
+
+from app.api.v1.endpoints.messages import get_messages
+from app.core.config import settings
+from app.core.storage import storage
+from app.crud import archive
+from app.crud.archive import SegmentCache, archive_channel, decode_segment, encode_segment, read_archived
+
+class FakeObject(io.BytesIO):
+    def release_conn(self):
+        pass
+
+class FakeMinio:
+    def __init__(self):
+        self.objects = {}
+        self.gets = 0
+
+    def put_object(self, bucket, key, data, length, content_type=None):
+        self.objects[key] = data.read()
+
+    def get_object(self, bucket, key):
+        self.gets += 1
+        return FakeObject(self.objects[key])
+
+    def remove_object(self, bucket, key):
+        self.objects.pop(key, None)
+
+@pytest.fixture
+def env(mongo, monkeypatch):
+    monkeypatch.setattr(storage, "client", FakeMinio())
+    monkeypatch.setattr(settings, "archive_segment_size", 4)
+    monkeypatch.setattr(archive, "segment_cache", SegmentCache())
+    return mongo, storage.client
+
+async def make_channel(db, count, start):
+    channel_id = str((await db.channels.insert_one({"name": "general"})).inserted_id)
+    user_id = (await db.users.insert_one({"username": "alice"})).inserted_id
+    for i in range(count):
+        await db.messages.insert_one({
+            "content": f"m{i}",
+            "channel_id": channel_id,
+            "user_id": user_id,
+            "created_at": start + timedelta(minutes=i),
+            "updated_at": start + timedelta(minutes=i),
+            "reactions": [],
+        })
+    return channel_id
+
+def test_segment_round_trip():
+    messages = [{"_id": ObjectId(), "created_at": datetime(2020, 1, 1, 12, 0, 0, 123000), "reactions": []}]
+    assert decode_segment(encode_segment(messages)) == messages
+
+@pytest.mark.asyncio
+async def test_old_messages_move_to_segments(env):
+    db, minio = env
+    start = datetime(2020, 1, 1)
+    channel_id = await make_channel(db, 10, start)
+
+    archived = await archive_channel(db, channel_id, start + timedelta(minutes=7))
+    assert archived == 7
+    assert await db.messages.count_documents({"channel_id": channel_id}) == 3
+    assert len(minio.objects) == 2
+    assert (await db.channels.find_one({}))["archived_count"] == 7
+
+    # A second run only picks up what has aged since
+    assert await archive_channel(db, channel_id, start + timedelta(minutes=7)) == 0
+    assert await archive_channel(db, channel_id, start + timedelta(minutes=9)) == 2
+    segments = await db.archive_segments.find({}).sort("n", 1).to_list(None)
+    assert [segment["n"] for segment in segments] == [0, 1, 2]
+    assert [segment["count"] for segment in segments] == [4, 3, 2]
+
+    page = await read_archived(db, channel_id, 2, 5)
+    assert [message["content"] for message, _ in page] == ["m6", "m5", "m4", "m3", "m2"]
+
+@pytest.mark.asyncio
+async def test_history_falls_through_to_archive(env):
+    db, minio = env
+    start = datetime(2020, 1, 1)
+    channel_id = await make_channel(db, 10, start)
+    await archive_channel(db, channel_id, start + timedelta(minutes=6))
+    user = SimpleNamespace(id=str(ObjectId()))
+
+    pages = []
+    for skip in (0, 3, 6, 9):
+        messages = await get_messages(
+            channel_id, Request({"type": "http", "headers": []}), Response(), limit=3, skip=skip, current_user=user
+        )
+        pages.append([message["content"] for message in json.loads(messages.body)])
+    assert pages == [["m7", "m8", "m9"], ["m4", "m5", "m6"], ["m1", "m2", "m3"], ["m0"]]
+
+    # Segments are cached after the first read
+    gets = minio.gets
+    await get_messages(channel_id, Request({"type": "http", "headers": []}), Response(), limit=3, skip=6, current_user=user)
+    assert minio.gets == gets
+
+@pytest.mark.asyncio
+async def test_replies_archived_after_their_parent_stay_in_the_thread(env):
+    db, minio = env
+    start = datetime(2020, 1, 1)
+    channel_id = await make_channel(db, 6, start)
+    parent = await db.messages.find_one({"content": "m0"})
+    await db.messages.insert_one({
+        "content": "late reply", "channel_id": channel_id, "user_id": parent["user_id"], "thread_id": parent["_id"],
+        "created_at": start + timedelta(minutes=5, seconds=30), "reactions": [],
+    })
+    await archive_channel(db, channel_id, start + timedelta(minutes=10))
+    assert await db.archive_segments.count_documents({}) == 2
+
+    page = await read_archived(db, channel_id, 0, 10)
+    threads = {message["content"]: [reply["content"] for reply in replies] for message, replies in page}
+    assert threads["m0"] == ["late reply"]
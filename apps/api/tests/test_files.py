@@ -0,0 +1,188 @@
+import hashlib
+import io
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.endpoints import files as files_endpoint
+from app.api.v1.endpoints.files import delete_file, download_file, link_file, upload_file
+from app.core.config import settings
+from app.core.storage import storage
+from app.crud.files import blob_key, collect_stale_blobs, release_blob, store_blob
+from app.models.file import FileLink
+
+class FakeMinio:
+    def __init__(self):
+        self.objects = {}
+        self.puts = 0
+
+    def put_object(self, bucket, key, data, length, content_type=None):
+        self.puts += 1
+        self.objects[key] = data.read()
+
+    def remove_object(self, bucket, key):
+        self.objects.pop(key, None)
+
+    def get_object(self, bucket, key):
+        self.opened = FakeObject(self.objects[key])
+        return self.opened
+
+class FakeObject(io.BytesIO):
+    released = False
+
+    def stream(self, amount):
+        while chunk := self.read(amount):
+            yield chunk
+
+    def release_conn(self):
+        self.released = True
+
+class FakeUpload:
+    def __init__(self, filename, data, content_type="application/pdf"):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = len(data)
+        self._data = io.BytesIO(data)
+
+    async def read(self, size=-1):
+        return self._data.read(size)
+
+@pytest.fixture
+def env(mongo, monkeypatch):
+    monkeypatch.setattr(storage, "client", FakeMinio())
+    monkeypatch.setattr(settings, "thumbnails_enabled", False)
+    return mongo, storage.client
+
+USER = SimpleNamespace(id="user-1")
+
+@pytest.mark.asyncio
+async def test_duplicate_uploads_share_one_object(env):
+    db, minio = env
+    data = b"%PDF quarterly report"
+    digest = hashlib.sha256(data).hexdigest()
+
+    first = await upload_file(FakeUpload("report.pdf", data), current_user=USER)
+    second = await upload_file(FakeUpload("copy.pdf", data), current_user=USER)
+
+    assert first["sha256"] == second["sha256"] == digest
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    assert first["stored_filename"] != second["stored_filename"]
+    assert minio.puts == 1
+    assert (await db.file_objects.find_one({"_id": digest}))["refs"] == 2
+
+    await delete_file(first["stored_filename"], current_user=USER)
+    assert blob_key(digest) in minio.objects
+    await delete_file(second["stored_filename"], current_user=USER)
+    assert blob_key(digest) not in minio.objects
+    assert await db.file_objects.count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_link_skips_sending_bytes(env):
+    db, minio = env
+    data = b"screenshot"
+    digest = hashlib.sha256(data).hexdigest()
+
+    with pytest.raises(HTTPException) as error:
+        await link_file(FileLink(sha256=digest, filename="shot.png"), current_user=USER)
+    assert error.value.status_code == 404
+
+    await upload_file(FakeUpload("shot.png", data, "image/png"), current_user=USER)
+    linked = await link_file(FileLink(sha256=digest.upper(), filename="again.png"), current_user=USER)
+    assert linked["size"] == len(data)
+    assert linked["content_type"] == "image/png"
+    assert minio.puts == 1
+
+@pytest.mark.asyncio
+async def test_abandoned_removal_does_not_block_uploads(env):
+    db, minio = env
+    data = b"bytes"
+    digest = hashlib.sha256(data).hexdigest()
+
+    assert await store_blob(db, digest, data, None) is False
+    # A removal that claimed the blob long ago and never finished
+    await db.file_objects.update_one(
+        {"_id": digest}, {"$set": {"refs": 0, "deleting": True, "deleting_at": datetime(2020, 1, 1)}}
+    )
+    assert await store_blob(db, digest, data, None) is False
+    assert minio.puts == 2
+
+    assert await release_blob(db, digest) is True
+    assert await release_blob(db, digest) is False
+
+@pytest.mark.asyncio
+async def test_downloads_stream_in_chunks(env, monkeypatch):
+    db, minio = env
+    monkeypatch.setattr(files_endpoint, "DOWNLOAD_CHUNK_SIZE", 4)
+    data = b"0123456789"
+    stored = await upload_file(FakeUpload("big.bin", data), current_user=USER)
+
+    response = await download_file(stored["stored_filename"], current_user=USER)
+    assert response.headers["content-length"] == "10"
+    assert not minio.opened.released
+    assert [chunk async for chunk in response.body_iterator] == [b"0123", b"4567", b"89"]
+    assert minio.opened.released
+
+class FakePipeline:
+    def __init__(self):
+        self.jobs = []
+        self.accept = True
+
+    def enqueue(self, name, data, content_type, source=None, on_stored=None):
+        self.jobs.append((name, data, source, on_stored))
+        return self.accept
+
+@pytest.mark.asyncio
+async def test_missing_thumbnails_are_queued_again(env, monkeypatch):
+    db, minio = env
+    monkeypatch.setattr(settings, "thumbnails_enabled", True)
+    pipeline = FakePipeline()
+    monkeypatch.setattr(files_endpoint, "thumbnails", pipeline)
+    data = b"png bytes"
+    digest = hashlib.sha256(data).hexdigest()
+
+    # The first render was dropped, so no URLs that would 404
+    pipeline.accept = False
+    assert (await upload_file(FakeUpload("a.png", data, "image/png"), current_user=USER))["thumbnail_urls"] == {}
+
+    # A duplicate upload queues it again
+    pipeline.accept = True
+    second = await upload_file(FakeUpload("b.png", data, "image/png"), current_user=USER)
+    assert second["deduplicated"] and second["thumbnail_urls"]
+    assert [(name, job_data) for name, job_data, _, _ in pipeline.jobs] == [(digest, data), (digest, data)]
+
+    # Links have no bytes in hand and read the stored blob
+    await link_file(FileLink(sha256=digest, filename="c.png"), current_user=USER)
+    assert pipeline.jobs[-1][1:3] == (None, blob_key(digest))
+
+    # Once stored, later references just advertise them
+    await pipeline.jobs[-1][3]()
+    linked = await link_file(FileLink(sha256=digest, filename="d.png"), current_user=USER)
+    assert linked["thumbnail_urls"] and len(pipeline.jobs) == 3
+
+@pytest.mark.asyncio
+async def test_content_whose_uploaders_died_is_reclaimed(env):
+    db, minio = env
+    data = b"bytes"
+    digest = hashlib.sha256(data).hexdigest()
+    # Two uploaders took references and died before the object was stored
+    await db.file_objects.insert_one({
+        "_id": digest, "key": blob_key(digest), "size": 5, "content_type": None,
+        "refs": 2, "ready": False, "created_at": datetime(2020, 1, 1),
+    })
+
+    assert await store_blob(db, digest, data, None) is False
+    assert (await db.file_objects.find_one({"_id": digest}))["refs"] == 1
+    assert await release_blob(db, digest) is True
+    assert minio.objects == {}
+
+    other = hashlib.sha256(b"other").hexdigest()
+    await db.file_objects.insert_many([
+        {"_id": other, "key": blob_key(other), "refs": 1, "ready": False, "created_at": datetime(2020, 1, 1)},
+        {"_id": digest, "key": blob_key(digest), "refs": 1, "ready": False, "created_at": datetime.utcnow()},
+    ])
+    minio.objects[blob_key(other)] = b"oth"
+    assert await collect_stale_blobs(db) == 1
+    assert [blob["_id"] for blob in await db.file_objects.find({}).to_list(None)] == [digest]
+    assert minio.objects == {}
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.core.group_commit import GroupCommitter, message_write_concern
+
+class FakeCollection:
+    def __init__(self, fail_indexes=()):
+        self.batches = []
+        self.fail_indexes = set(fail_indexes)
+
+    async def insert_many(self, documents, ordered=True):
+        assert ordered is False
+        self.batches.append(list(documents))
+        if self.fail_indexes:
+            raise BulkWriteError({
+                "writeErrors": [{"index": i, "code": 11000, "errmsg": "duplicate"} for i in self.fail_indexes],
+                "writeConcernErrors": [],
+            })
+
+@pytest.mark.asyncio
+async def test_concurrent_inserts_share_one_batch(monkeypatch):
+    monkeypatch.setattr(settings, "group_commit_window_ms", 5)
+    collection = FakeCollection()
+    committer = GroupCommitter("messages", lambda: collection)
+
+    documents = [{"content": f"m{i}"} for i in range(10)]
+    ids = await asyncio.gather(*(committer.insert(doc) for doc in documents))
+
+    assert len(collection.batches) == 1
+    assert ids == [doc["_id"] for doc in collection.batches[0]]
+    assert len(set(ids)) == 10
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_without_waiting_for_the_window(monkeypatch):
+    monkeypatch.setattr(settings, "group_commit_window_ms", 10_000)
+    monkeypatch.setattr(settings, "group_commit_max_batch", 3)
+    collection = FakeCollection()
+    committer = GroupCommitter("messages", lambda: collection)
+
+    ids = await asyncio.wait_for(
+        asyncio.gather(*(committer.insert({"n": i}) for i in range(3))), timeout=1
+    )
+
+    assert len(ids) == 3
+    assert len(collection.batches) == 1
+
+@pytest.mark.asyncio
+async def test_write_errors_only_fail_their_own_callers(monkeypatch):
+    monkeypatch.setattr(settings, "group_commit_window_ms", 5)
+    collection = FakeCollection(fail_indexes=[1])
+    committer = GroupCommitter("messages", lambda: collection)
+
+    results = await asyncio.gather(
+        *(committer.insert({"n": i}) for i in range(3)), return_exceptions=True
+    )
+
+    assert isinstance(results[1], BulkWriteError)
+    assert not isinstance(results[0], Exception)
+    assert not isinstance(results[2], Exception)
+
+def test_write_concern_from_settings(monkeypatch):
+    assert message_write_concern() is None
+
+    monkeypatch.setattr(settings, "message_write_concern_w", "majority")
+    monkeypatch.setattr(settings, "message_write_concern_j", True)
+    assert message_write_concern().document == {"w": "majority", "j": True}
+
+    monkeypatch.setattr(settings, "message_write_concern_w", "1")
+    monkeypatch.setattr(settings, "message_write_concern_j", None)
+    assert message_write_concern().document == {"w": 1}
@@ -0,0 +1,109 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Request, Response
+
+from app.api.v1.endpoints.channels import get_channel, get_channels, update_channel
+from app.api.v1.endpoints.messages import create_message, get_messages
+from app.core.config import settings
+from app.core.database import db as database
+from app.crud.read_state import ChannelVersions
+from app.models.channel import ChannelUpdate
+from app.models.message import MessageCreate
+
+def request(etag=None):
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "headers": headers})
+
+@pytest.mark.asyncio
+async def test_history_revalidates_until_a_message_is_posted(channel):
+    channel_id, user = channel
+    response = Response()
+    await get_messages(channel_id, request(), response, current_user=user)
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"') and response.headers["cache-control"] == settings.http_cache_control
+
+    not_modified = await get_messages(channel_id, request(etag), Response(), current_user=user)
+    assert not_modified.status_code == 304 and not_modified.body == b""
+    assert not_modified.headers["etag"] == etag
+
+    await create_message(channel_id, MessageCreate(content="hello"), current_user=user)
+    page = await get_messages(channel_id, request(etag), Response(), current_user=user)
+    assert [message["content"] for message in json.loads(page.body)] == ["hello"]
+
+@pytest.mark.asyncio
+async def test_channel_and_list_tags_follow_channel_updates(channel):
+    channel_id, user = channel
+    single, listing = Response(), Response()
+    await get_channel(channel_id, request(), single, current_user=user)
+    await get_channels(request(), listing, current_user=user)
+    assert (await get_channel(channel_id, request(single.headers["etag"]), Response(), current_user=user)).status_code == 304
+    assert (await get_channels(request(listing.headers["etag"]), Response(), current_user=user)).status_code == 304
+
+    await update_channel(channel_id, ChannelUpdate(description="renamed"), current_user=user)
+    updated = await get_channel(channel_id, request(single.headers["etag"]), Response(), current_user=user)
+    assert updated.description == "renamed"
+    channels = await get_channels(request(listing.headers["etag"]), Response(), current_user=user)
+    assert [c.description for c in channels] == ["renamed"]
+
+@pytest.mark.asyncio
+async def test_revalidation_reads_only_channel_versions(channel, monkeypatch):
+    channel_id, user = channel
+    single, listing = Response(), Response()
+    await get_channel(channel_id, request(), single, current_user=user)
+    await get_channels(request(), listing, current_user=user)
+
+    channels = type(database.db.channels)
+    reads = []
+
+    def spy(name):
+        original = getattr(channels, name)
+
+        def read(self, query=None, projection=None, *args, **kwargs):
+            if self.name == "channels":
+                reads.append((name, dict(projection or {})))
+            return original(self, query, projection, *args, **kwargs)
+        return read
+
+    monkeypatch.setattr(channels, "find", spy("find"))
+    monkeypatch.setattr(channels, "find_one", spy("find_one"))
+    assert (await get_channel(channel_id, request(single.headers["etag"]), Response(), current_user=user)).status_code == 304
+    assert (await get_channels(request(listing.headers["etag"]), Response(), current_user=user)).status_code == 304
+    assert reads == [("find_one", {"version": 1}), ("find", {"version": 1})]
+
+class SlowChannels:
+    """Records when each $inc starts and lets the test decide when it lands"""
+
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+
+    async def update_one(self, query, update):
+        self.started.append(update)
+        await self.release.wait()
+
+@pytest.mark.asyncio
+async def test_concurrent_version_bumps_share_one_write():
+    versions = ChannelVersions()
+    channels = SlowChannels()
+    db = SimpleNamespace(channels=channels)
+    channel_id = "665f1c2e9b1e8a0012345678"
+
+    async def settle():
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    first = asyncio.ensure_future(versions.bump(db, channel_id))
+    await settle()
+    assert len(channels.started) == 1
+
+    # Writes that land while a bump is in flight are not covered by it; they share the next one
+    followers = [asyncio.ensure_future(versions.bump(db, channel_id)) for _ in range(20)]
+    await settle()
+    assert len(channels.started) == 1 and not any(follower.done() for follower in followers)
+
+    channels.release.set()
+    await asyncio.gather(first, *followers)
+    assert len(channels.started) == 2
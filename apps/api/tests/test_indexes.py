@@ -0,0 +1,53 @@
+import os
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.indexes import INDEXES, QUERIES, apply_indexes, assert_no_collscans
+
+def _is_range(value):
+    return isinstance(value, dict) and all(key.startswith("$") for key in value)
+
+def _equality_fields(query_filter):
+    return [key for key, value in query_filter.items() if not key.startswith("$") and not _is_range(value)]
+
+def _range_fields(query_filter):
+    return [key for key, value in query_filter.items() if not key.startswith("$") and _is_range(value)]
+
+def _covering_index(query):
+    """Find a registered index whose key prefix serves the filter and sort"""
+    if set(_equality_fields(query.filter)) <= {"_id"} and "$or" not in query.filter:
+        return "_id_"
+    wanted = _equality_fields(query.filter) + [field for field, _ in (query.sort or [])]
+    # Equality, then sort, then range (ESR)
+    wanted += [field for field in _range_fields(query.filter) if field not in wanted]
+    for spec in INDEXES:
+        if spec.collection != query.collection:
+            continue
+        if [field for field, _ in spec.keys[:len(wanted)]] == wanted:
+            return spec.name
+    return None
+
+@pytest.mark.parametrize("query", [q for q in QUERIES if "$or" not in q.filter], ids=lambda q: q.description)
+def test_every_query_shape_has_an_index(query):
+    assert _covering_index(query), f"No registered index serves {query.collection}: {query.description}"
+
+def test_index_names_are_unique_per_collection():
+    names = [(spec.collection, spec.name) for spec in INDEXES]
+    assert len(names) == len(set(names))
+
+@pytest.mark.integration
+@pytest.mark.asyncio
+async def test_registered_queries_never_collscan():
+    url = os.environ.get("TEST_DATABASE_URL", "mongodb://localhost:27017/slack_clone_test")
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=500)
+    try:
+        await client.admin.command("ping")
+    except Exception:
+        pytest.skip("MongoDB is not available")
+    db = client.get_default_database()
+    try:
+        await apply_indexes(db)
+        await assert_no_collscans(db)
+    finally:
+        client.close()
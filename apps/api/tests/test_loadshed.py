@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
+
+from app.core.config import settings
+from app.core.loadshed import (
+    BULK, DEFAULT, INTERACTIVE, AdaptiveLimiter, LoadSheddingMiddleware, classify
+)
+
+def test_classify_routes():
+    assert classify("POST", "/api/v1/messages/channels/abc/messages") is INTERACTIVE
+    assert classify("POST", "/api/v1/messages/messages/abc/reactions") is INTERACTIVE
+    assert classify("GET", "/api/v1/auth/me") is INTERACTIVE
+    assert classify("GET", "/api/v1/files/list") is BULK
+    assert classify("GET", "/api/v1/messages/channels/abc/messages", b"limit=50") is DEFAULT
+    assert classify("GET", "/api/v1/messages/channels/abc/messages", b"limit=1000") is BULK
+    assert classify("GET", "/api/v1/channels/") is DEFAULT
+
+@pytest.mark.asyncio
+async def test_aimd_backs_off_on_slow_requests_and_recovers(monkeypatch):
+    monkeypatch.setattr(settings, "loadshed_initial_limit", 10)
+    monkeypatch.setattr(settings, "loadshed_queue_interval_ms", 0)
+    limiter = AdaptiveLimiter()
+
+    for _ in range(5):
+        assert (await limiter.acquire(DEFAULT))[0]
+        limiter.release(DEFAULT, 10.0)
+    assert limiter.limit == pytest.approx(10 * 0.9 ** 5)
+
+    lowered = limiter.limit
+    for _ in range(5):
+        await limiter.acquire(DEFAULT)
+    for _ in range(5):
+        limiter.release(DEFAULT, 0.001)
+    assert limiter.limit > lowered
+
+@pytest.mark.asyncio
+async def test_expensive_requests_are_shed_before_interactive_ones(monkeypatch):
+    monkeypatch.setattr(settings, "loadshed_initial_limit", 4)
+    monkeypatch.setattr(settings, "loadshed_max_queue", 4)
+    monkeypatch.setattr(settings, "loadshed_max_wait_ms", 50)
+    limiter = AdaptiveLimiter()
+
+    # Bulk may only use half the limit
+    assert (await limiter.acquire(BULK))[0]
+    assert (await limiter.acquire(BULK))[0]
+    assert await limiter.acquire(BULK) == (False, "timeout")
+
+    # Interactive calls still get the remaining slots
+    assert (await limiter.acquire(INTERACTIVE))[0]
+    assert (await limiter.acquire(INTERACTIVE))[0]
+
+    # A full limit queues interactive work and hands it the next free slot
+    waiting = asyncio.ensure_future(limiter.acquire(INTERACTIVE))
+    await asyncio.sleep(0)
+    limiter.release(BULK, 0.001)
+    assert await waiting == (True, "queued")
+
+@pytest.mark.asyncio
+async def test_middleware_returns_503_with_retry_after(monkeypatch):
+    monkeypatch.setattr(settings, "loadshed_initial_limit", 1)
+    monkeypatch.setattr(settings, "loadshed_max_wait_ms", 20)
+    limiter = AdaptiveLimiter()
+    release = asyncio.Event()
+
+    app = FastAPI()
+    app.add_middleware(LoadSheddingMiddleware, limiter=limiter)
+
+    @app.get("/slow")
+    async def slow():
+        await release.wait()
+        return {"ok": True}
+
+    @app.get("/metrics")
+    async def metrics():
+        return {"ok": True}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        first = asyncio.ensure_future(client.get("/slow"))
+        await asyncio.sleep(0.01)
+
+        shed = await client.get("/slow")
+        assert shed.status_code == 503
+        assert shed.headers["retry-after"] == "1"
+
+        # Exempt paths and OPTIONS requests bypass the limiter
+        assert (await client.get("/metrics")).status_code == 200
+        assert (await client.options("/slow")).status_code == 405
+
+        release.set()
+        assert (await first).status_code == 200
+    assert limiter.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_shed_responses_are_readable_cross_origin(monkeypatch):
+    monkeypatch.setattr(settings, "loadshed_initial_limit", 1)
+    monkeypatch.setattr(settings, "loadshed_max_wait_ms", 20)
+    limiter = AdaptiveLimiter()
+    release = asyncio.Event()
+
+    app = FastAPI()
+    app.add_middleware(LoadSheddingMiddleware, limiter=limiter)
+    app.add_middleware(CORSMiddleware, allow_origins=["http://localhost:3000"], allow_methods=["*"])
+
+    @app.get("/slow")
+    async def slow():
+        await release.wait()
+        return {"ok": True}
+
+    origin = {"Origin": "http://localhost:3000"}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        first = asyncio.ensure_future(client.get("/slow", headers=origin))
+        await asyncio.sleep(0.01)
+
+        shed = await client.get("/slow", headers=origin)
+        assert shed.status_code == 503
+        assert shed.headers["access-control-allow-origin"] == "http://localhost:3000"
+
+        # Preflights are answered even while every slot is taken
+        preflight = await client.options("/slow", headers={**origin, "Access-Control-Request-Method": "GET"})
+        assert preflight.status_code == 200
+
+        release.set()
+        assert (await first).status_code == 200
+    assert limiter.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_slow_clients_do_not_lower_the_limit(monkeypatch):
+    monkeypatch.setattr(settings, "loadshed_initial_limit", 8)
+    monkeypatch.setattr(settings, "loadshed_queue_interval_ms", 0)
+    monkeypatch.setattr(settings, "loadshed_bulk_target_ms", 100)
+    limiter = AdaptiveLimiter()
+
+    app = FastAPI()
+    app.add_middleware(LoadSheddingMiddleware, limiter=limiter)
+
+    @app.get("/api/v1/files/{name}")
+    async def download(name: str):
+        async def chunks():
+            for _ in range(3):
+                await asyncio.sleep(0.05)
+                yield b"chunk"
+        return StreamingResponse(chunks())
+
+    @app.post("/api/v1/files/upload")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.get("/api/v1/files/slow/render")
+    async def render():
+        await asyncio.sleep(0.15)
+        return {"ok": True}
+
+    async def trickle():
+        for _ in range(3):
+            await asyncio.sleep(0.05)
+            yield b"part"
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        assert (await client.get("/api/v1/files/report.pdf")).content == b"chunk" * 3
+        assert (await client.post("/api/v1/files/upload", content=trickle())).json() == {"size": 12}
+        assert limiter.limit == 8
+
+        # Time the server spends before responding still counts
+        assert (await client.get("/api/v1/files/slow/render")).status_code == 200
+        assert limiter.limit < 8
+    assert limiter.in_flight == 0
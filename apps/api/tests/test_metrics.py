@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.api.v1.api import api_router
+from app.core.metrics import MetricsMiddleware, Registry, http_requests_total
+from app.websocket.manager import ConnectionManager
+
+class FakeWebSocket:
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        if self.fail:
+            raise RuntimeError("connection closed")
+        self.sent.append(data)
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(("/a",), 0.05)
+    histogram.observe(("/a",), 0.5)
+    histogram.observe(("/a",), 5.0)
+
+    output = registry.render()
+
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in output
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in output
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in output
+    assert 'latency_seconds_count{route="/a"} 3' in output
+
+@pytest.mark.asyncio
+async def test_middleware_labels_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"id": item_id}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.get("/items/1")
+        await client.get("/items/2")
+
+    assert http_requests_total.value(("GET", "/items/{item_id}", "200")) >= 2
+
+@pytest.mark.asyncio
+async def test_pool_diagnostics_require_a_signed_in_user():
+    app = FastAPI()
+    app.include_router(api_router, prefix="/api/v1")
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/api/v1/diagnostics/pools")
+
+    # HTTPBearer rejects a missing token with 403 (401 in newer FastAPI)
+    assert response.status_code in (401, 403)
+
+@pytest.mark.asyncio
+async def test_manager_counts_sent_and_dropped_frames(monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "ws_send_queue_size", 2)
+
+    manager = ConnectionManager()
+    healthy = FakeWebSocket()
+    await manager.connect(healthy)
+
+    for i in range(3):
+        await manager.broadcast(f"frame {i}")
+
+    assert manager.frames_dropped["queue_full"] == 1
+    assert manager.pending_frames() == 2
+
+    await asyncio.sleep(0.01)
+
+    assert healthy.sent == ["frame 0", "frame 1"]
+    assert manager.frames_sent == 2
+
+@pytest.mark.asyncio
+async def test_manager_forgets_broken_connections():
+    manager = ConnectionManager()
+    broken = FakeWebSocket(fail=True)
+    await manager.connect(broken)
+
+    await manager.broadcast("hello")
+    await asyncio.sleep(0.01)
+
+    assert broken not in manager.active_connections
+    assert manager.pending_frames() == 0
@@ -0,0 +1,36 @@
+import inspect
+
+from minio import Minio
+
+from app.core import multipart
+from app.core.metrics import InstrumentedMinio, minio_operation_duration_seconds, minio_transfer_bytes_total
+from app.core.profiling import ProfiledMinio
+
+def test_private_multipart_calls_match_the_pinned_sdk():
+    # The positional parameters app/core/multipart.py passes, in order
+    expected = {
+        "_create_multipart_upload": ["bucket_name", "object_name", "headers"],
+        "_upload_part": ["bucket_name", "object_name", "data", "headers", "upload_id", "part_number"],
+        "_complete_multipart_upload": ["bucket_name", "object_name", "upload_id", "parts"],
+        "_abort_multipart_upload": ["bucket_name", "object_name", "upload_id"],
+    }
+    assert set(expected) | {"_list_multipart_uploads"} == multipart.MULTIPART_METHODS
+    for name, params in expected.items():
+        assert list(inspect.signature(getattr(Minio, name)).parameters)[1:] == params, name
+
+    listing = inspect.signature(Minio._list_multipart_uploads).parameters
+    assert list(listing)[1] == "bucket_name"
+    assert {"prefix", "key_marker", "upload_id_marker"} <= set(listing)
+
+class RecordingClient:
+    def _upload_part(self, bucket, key, data, headers, upload_id, part_number):
+        return "etag"
+
+def test_multipart_calls_are_instrumented():
+    client = ProfiledMinio(InstrumentedMinio(RecordingClient()))
+    uploaded = minio_transfer_bytes_total.value(("upload",))
+
+    assert multipart.upload_part(client, "bucket", "key", "upload-1", 1, b"12345") == "etag"
+
+    assert minio_operation_duration_seconds.count(("upload_part",)) >= 1
+    assert minio_transfer_bytes_total.value(("upload",)) == uploaded + 5
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from fakeredis import aioredis
+
+from app.core.metrics import merge_snapshots
+from app.core.redis import redis_state
+from app.websocket.manager import ConnectionManager
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+@pytest_asyncio.fixture
+async def workers(monkeypatch):
+    """Two managers sharing one Redis, as two worker processes would"""
+    monkeypatch.setattr(redis_state, "client", aioredis.FakeRedis())
+    managers = [ConnectionManager(), ConnectionManager()]
+    yield managers
+    for manager in managers:
+        await manager.shutdown()
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+@pytest.mark.asyncio
+async def test_broadcast_reaches_sockets_on_every_worker_once(workers):
+    a, b = workers
+    on_a, on_b = FakeWebSocket(), FakeWebSocket()
+    await a.connect(on_a)
+    await b.connect(on_b)
+
+    await a.broadcast("hello")
+    await settle()
+
+    assert on_a.sent == ["hello"]
+    assert on_b.sent == ["hello"]
+
+@pytest.mark.asyncio
+async def test_user_and_channel_messages_cross_workers(workers):
+    a, b = workers
+    socket = FakeWebSocket()
+    await b.connect(socket, "user-1")
+    await b.subscribe_to_channel("general", socket)
+    await settle()
+
+    await a.send_to_user("user-1", {"type": "dm"})
+    await a.broadcast_to_channel("general", {"type": "message"})
+    await a.broadcast_to_channel("random", {"type": "message"})
+    await settle()
+
+    assert [json.loads(frame)["type"] for frame in socket.sent] == ["user_online", "dm", "message"]
+
+    await b.unsubscribe_from_channel("general", socket)
+    assert "channel:general" not in b._redis_channels
+
+@pytest.mark.asyncio
+async def test_presence_is_shared_between_workers(workers):
+    a, b = workers
+    watcher = FakeWebSocket()
+    await a.connect(watcher)
+    first, second = FakeWebSocket(), FakeWebSocket()
+
+    await a.connect(first, "user-1")
+    await b.connect(second, "user-1")
+    await settle()
+    assert await a.online_users() == ["user-1"]
+
+    await a.disconnect(first)
+    await settle()
+    assert await b.online_users() == ["user-1"]
+
+    await b.disconnect(second)
+    await settle()
+    assert await a.online_users() == []
+
+    events = [json.loads(frame)["type"] for frame in watcher.sent]
+    assert events == ["user_online", "user_offline"]
+
+def test_merge_snapshots_labels_samples_by_worker():
+    family = ["# HELP hits_total Hits", "# TYPE hits_total counter", 'hits_total{route="/a"} 3', "up 1"]
+    output = merge_snapshots({"w1": {"hits_total": family[:3], "up": family[3:]}, "w2": {"hits_total": family[:3]}})
+
+    assert output.count("# TYPE hits_total counter") == 1
+    assert 'hits_total{worker="w1",route="/a"} 3' in output
+    assert 'hits_total{worker="w2",route="/a"} 3' in output
+    assert 'up{worker="w1"} 1' in output
@@ -0,0 +1,133 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+from app.api.v1.endpoints.messages import create_message
+from app.api.v1.endpoints.notifications import list_notifications
+from app.core import jobs
+from app.core.config import settings
+from app.core.jobs import JobQueue
+from app.crud.notifications import deliver_mentions, notification_jobs
+from app.crud.read_state import get_unread_counts
+from app.models.message import MessageCreate
+
+class FakeManager:
+    def __init__(self, online=()):
+        self.online = list(online)
+        self.direct = []
+        self.broadcasts = []
+
+    async def online_users(self):
+        return self.online
+
+    async def send_to_user(self, user_id, data):
+        self.direct.append((user_id, data))
+
+    async def broadcast_json(self, data):
+        self.broadcasts.append(data)
+
+@pytest_asyncio.fixture
+async def workspace(messaging, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "notification_batch_size", 2)
+    db = messaging
+    await db.notifications.create_index([("user_id", 1), ("message_id", 1)], unique=True)
+    users = {}
+    for name in ("alice", "bob", "carol", "dave", "erin"):
+        users[name] = SimpleNamespace(
+            id=str((await db.users.insert_one({"username": name, "avatar": None})).inserted_id),
+            username=name, avatar=None
+        )
+    channel_id = str((await db.channels.insert_one({
+        "name": "general", "created_by": users["alice"].id, "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+    })).inserted_id)
+    return db, users, channel_id
+
+@pytest.mark.asyncio
+async def test_failed_jobs_are_retried_with_backoff_then_dead_lettered(fake_redis, monkeypatch):
+    queue = JobQueue("test")
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    monkeypatch.setattr(settings, "job_max_attempts", 2)
+    monkeypatch.setattr(settings, "job_retry_base_seconds", 10)
+    seen = []
+
+    async def flaky(payload):
+        seen.append(payload["n"])
+        raise RuntimeError("mongo unavailable")
+
+    await queue.enqueue({"n": 1})
+    assert await queue.work_once(flaky, 10) == 1
+    # Backing off: not claimable yet
+    now[0] += 5
+    assert await queue.work_once(flaky, 10) == 0
+    now[0] += 6
+    assert await queue.work_once(flaky, 10) == 1
+    assert seen == [1, 1]
+
+    [dead] = await fake_redis.lrange(queue.dead_key, 0, -1)
+    dead = json.loads(dead)
+    assert dead["attempts"] == 2 and dead["error"] == "mongo unavailable"
+    assert await fake_redis.zcard(queue.scheduled_key) == 0
+
+@pytest.mark.asyncio
+async def test_jobs_held_by_a_dead_worker_are_redelivered(fake_redis, monkeypatch):
+    queue = JobQueue("test")
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    await queue.enqueue({"n": 1})
+
+    [claimed] = await queue.claim(10, visibility_seconds=60)
+    assert await queue.claim(10, visibility_seconds=60) == []
+    now[0] += 61
+    assert await queue.claim(10, visibility_seconds=60) == [claimed]
+    await queue.ack(claimed)
+    now[0] += 61
+    assert await queue.claim(10, visibility_seconds=60) == []
+
+@pytest.mark.asyncio
+async def test_posting_queues_mentions_for_the_worker(workspace):
+    db, users, channel_id = workspace
+    alice, bob = users["alice"], users["bob"]
+
+    await create_message(channel_id, MessageCreate(content="no mentions here"), current_user=alice)
+    message = await create_message(channel_id, MessageCreate(content="@bob @channel ship it"), current_user=alice)
+    assert await db.notifications.count_documents({}) == 0
+    [raw] = await notification_jobs.claim(10, 60)
+    job = json.loads(raw)["payload"]
+    assert job["usernames"] == ["bob"] and job["channel"] and not job["here"]
+
+    manager = FakeManager()
+    await deliver_mentions(db, manager, job)
+    # Redelivery changes nothing
+    await deliver_mentions(db, manager, job)
+
+    reasons = {doc["user_id"]: doc["reason"] async for doc in db.notifications.find({})}
+    assert reasons == {
+        bob.id: "mention", users["carol"].id: "channel", users["dave"].id: "channel", users["erin"].id: "channel"
+    }
+    assert [user_id for user_id, _ in manager.direct] == [bob.id, bob.id]
+    assert manager.direct[0][1]["preview"] == "@bob @channel ship it"
+    assert manager.broadcasts[0] == {
+        "type": "mention", "reason": "channel", "channel_id": channel_id,
+        "message_id": message.id, "seq": 2, "author_id": alice.id,
+    }
+
+    counts = {count["channel_id"]: count for count in await get_unread_counts(db, bob.id)}
+    assert counts[channel_id]["mention_count"] == 1
+    [notification] = await list_notifications(limit=50, current_user=bob)
+    assert notification.message_id == message.id and notification.reason == "mention"
+
+@pytest.mark.asyncio
+async def test_here_notifies_online_users_only(workspace):
+    db, users, channel_id = workspace
+    await create_message(channel_id, MessageCreate(content="@here standup"), current_user=users["alice"])
+    [raw] = await notification_jobs.claim(10, 60)
+
+    manager = FakeManager(online=[users["alice"].id, users["carol"].id])
+    await deliver_mentions(db, manager, json.loads(raw)["payload"])
+
+    assert [doc["user_id"] async for doc in db.notifications.find({})] == [users["carol"].id]
+    assert manager.direct == [] and manager.broadcasts[0]["reason"] == "here"
@@ -0,0 +1,76 @@
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.core.config import settings
+from app.core.profiling import (
+    ProfilingMiddleware,
+    RequestProfile,
+    mongo_command_shape,
+    record_operation,
+)
+
+def test_mongo_command_shape_ignores_literal_values():
+    first = mongo_command_shape("find", {"find": "users", "filter": {"_id": "a"}})
+    second = mongo_command_shape("find", {"find": "users", "filter": {"_id": "b"}})
+
+    assert first == second
+    assert first[0] == "users"
+
+def test_mongo_command_shape_distinguishes_filters():
+    by_id = mongo_command_shape("find", {"find": "messages", "filter": {"_id": 1}})
+    by_thread = mongo_command_shape("find", {"find": "messages", "filter": {"thread_id": 1}})
+
+    assert by_id != by_thread
+
+def test_profile_flags_repeated_queries_and_budget(monkeypatch):
+    monkeypatch.setattr(settings, "profiling_repeat_threshold", 3)
+    monkeypatch.setattr(settings, "profiling_op_budget", 4)
+
+    profile = RequestProfile("GET", "/")
+    for _ in range(5):
+        profile.record("mongo find users {}", 0.001)
+    profile.record("mongo find channels {}", 0.01)
+
+    assert profile.count == 6
+    assert profile.slowest == "mongo find channels {}"
+    assert profile.repeated_shapes() == {"mongo find users {}": 5}
+    assert profile.flags() == ["budget", "repeated"]
+
+@pytest.mark.asyncio
+async def test_middleware_exposes_headers(monkeypatch):
+    monkeypatch.setattr(settings, "profiling_sample_rate", 1.0)
+    monkeypatch.setattr(settings, "profiling_repeat_threshold", 2)
+
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/n-plus-one")
+    async def n_plus_one():
+        for _ in range(3):
+            record_operation("mongo find users {\"_id\": \"?\"}", 0.002)
+        return {}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/n-plus-one")
+
+    assert response.headers["x-db-ops"] == "3"
+    assert response.headers["x-db-flags"] == "repeated"
+    assert "mongo find users" in response.headers["x-db-slowest"]
+
+@pytest.mark.asyncio
+async def test_unsampled_requests_are_not_profiled(monkeypatch):
+    monkeypatch.setattr(settings, "profiling_sample_rate", 0.0)
+
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/")
+    async def index():
+        record_operation("mongo find users {}", 0.001)
+        return {}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/")
+
+    assert "x-db-ops" not in response.headers
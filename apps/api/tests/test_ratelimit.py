@@ -0,0 +1,89 @@
+import pytest
+from fakeredis import aioredis
+from fastapi import HTTPException
+
+from app.core import ratelimit
+from app.core.config import settings
+from app.core.ratelimit import TokenBucketLimiter, enforce, limiter, parse_limit
+from app.core.redis import redis_state
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = aioredis.FakeRedis()
+    monkeypatch.setattr(redis_state, "client", client)
+    return client
+
+def test_parse_limit():
+    assert parse_limit("30/10") == (30, 3.0)
+    assert parse_limit("") is None
+    assert parse_limit("0/10") is None
+
+@pytest.mark.asyncio
+async def test_bucket_denies_after_capacity(fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_local_fraction", 0.4)
+    bucket = TokenBucketLimiter()
+
+    results = [await bucket.acquire("rl:test", 5, 0.5) for _ in range(6)]
+
+    assert [allowed for allowed, _, _ in results] == [True] * 5 + [False]
+    assert results[-1][1] > 0
+
+@pytest.mark.asyncio
+async def test_local_lease_avoids_redis_round_trips(fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_local_fraction", 0.5)
+    bucket = TokenBucketLimiter()
+    remote_calls = []
+    take_remote = bucket._take_remote
+
+    async def counting_take_remote(*args):
+        remote_calls.append(args)
+        return await take_remote(*args)
+
+    monkeypatch.setattr(bucket, "_take_remote", counting_take_remote)
+
+    for _ in range(10):
+        await bucket.acquire("rl:lease", 10, 1.0)
+    # Denials are remembered locally until the bucket refills
+    for _ in range(5):
+        allowed, _, source = await bucket.acquire("rl:lease", 10, 1.0)
+        assert not allowed
+
+    # One single-token lease while the key is cold, two batches, one denial
+    assert len(remote_calls) == 4
+
+@pytest.mark.asyncio
+async def test_sparse_callers_get_the_whole_bucket(fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_local_fraction", 0.1)
+    monkeypatch.setattr(settings, "rate_limit_lease_seconds", 1.0)
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    bucket = TokenBucketLimiter()
+
+    allowed = []
+    # One request per lease period, then pairs whose second request leases a
+    # batch that expires half spent
+    for burst in [1] * 10 + [2] * 5:
+        for _ in range(burst):
+            allowed.append((await bucket.acquire("rl:upload", 20, 20 / 60))[0])
+        now[0] += 2 * settings.rate_limit_lease_seconds
+
+    assert allowed == [True] * 20
+    assert not (await bucket.acquire("rl:upload", 20, 20 / 60))[0]
+
+@pytest.mark.asyncio
+async def test_enforce_raises_429_with_retry_after(fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_create_message_user", "2/60")
+    monkeypatch.setattr(settings, "rate_limit_create_message_channel", "")
+    monkeypatch.setattr(settings, "rate_limit_local_fraction", 0.0)
+    monkeypatch.setattr(limiter, "_local", {})
+
+    await enforce("create_message", "user-1", "channel-1")
+    await enforce("create_message", "user-1", "channel-1")
+    with pytest.raises(HTTPException) as exc_info:
+        await enforce("create_message", "user-1", "channel-1")
+
+    assert exc_info.value.status_code == 429
+    assert int(exc_info.value.headers["Retry-After"]) >= 1
+
+    # Other users have their own bucket
+    await enforce("create_message", "user-2", "channel-1")
@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import pytest
+from bson.timestamp import Timestamp
+from fakeredis import aioredis
+from pymongo.read_preferences import SecondaryPreferred
+
+from app.core import read_routing
+from app.core.config import settings
+from app.core.database import db as database
+from app.core.read_routing import (
+    ReadRoutingMiddleware, SessionDatabase, WriteTimeListener, get_read_db, read_preference, set_request_user,
+    tracked_writes
+)
+from app.core.redis import redis_state
+
+class FakeSession:
+    def __init__(self):
+        self.cluster_time = None
+        self.operation_time = None
+        self.ended = False
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+    def advance_operation_time(self, operation_time):
+        self.operation_time = operation_time
+
+    async def end_session(self):
+        self.ended = True
+
+class FakeClient:
+    def __init__(self):
+        self.sessions = []
+
+    async def start_session(self, causal_consistency=False):
+        assert causal_consistency
+        session = FakeSession()
+        self.sessions.append(session)
+        return session
+
+class FakeDatabase:
+    def __init__(self, client, read_preference=None):
+        self.client = client
+        self.read_preference = read_preference
+
+    def with_options(self, read_preference=None):
+        return FakeDatabase(self.client, read_preference)
+
+@pytest.fixture
+def routing(monkeypatch):
+    monkeypatch.setattr(redis_state, "client", aioredis.FakeRedis())
+    monkeypatch.setattr(database, "db", FakeDatabase(FakeClient()))
+    monkeypatch.setattr(settings, "read_routing_enabled", True)
+    monkeypatch.setattr(settings, "read_your_writes_mode", "session")
+    return database.db
+
+WRITE_TIME = Timestamp(1700000000, 7)
+
+async def write_as(user_id, reply=None):
+    """Run a request through the middleware that authenticates as ``user_id`` and writes once"""
+    listener = WriteTimeListener()
+    sent = []
+
+    async def app(scope, receive, send):
+        set_request_user(user_id)
+        listener.succeeded(SimpleNamespace(command_name="insert", reply=reply or {}))
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        sent.append(message)
+
+    await ReadRoutingMiddleware(app)({"type": "http"}, None, send)
+    return sent
+
+def test_read_preference_carries_max_staleness():
+    preference = read_preference("secondaryPreferred")
+    assert isinstance(preference, SecondaryPreferred)
+    assert preference.max_staleness == settings.read_max_staleness_seconds
+    with pytest.raises(ValueError):
+        read_preference("closest")
+
+@pytest.mark.asyncio
+async def test_reads_go_to_secondaries_without_a_recent_write(routing, monkeypatch):
+    monkeypatch.setattr(settings, "read_preference_get_messages", "secondaryPreferred")
+    monkeypatch.setattr(settings, "read_preference_get_channel", "primary")
+
+    routed = await get_read_db("get_messages", "user-1")
+    assert isinstance(routed.read_preference, SecondaryPreferred)
+    assert await get_read_db("get_channel", "user-1") is routing
+
+@pytest.mark.asyncio
+async def test_author_reads_wait_for_their_write_in_a_causal_session(routing):
+    cluster_time = {"clusterTime": WRITE_TIME, "signature": {}}
+    await write_as("user-1", {"operationTime": WRITE_TIME, "$clusterTime": cluster_time})
+
+    routed = await get_read_db("get_messages", "user-1")
+    assert isinstance(routed, SessionDatabase)
+    session = routing.client.sessions[0]
+    assert session.cluster_time == cluster_time
+    assert session.operation_time == WRITE_TIME
+
+    # Other users are not held back by user-1's write
+    assert not isinstance(await get_read_db("get_messages", "user-2"), SessionDatabase)
+
+@pytest.mark.asyncio
+async def test_author_reads_go_to_primary_after_write(routing, monkeypatch):
+    # A standalone server reports no cluster time, so there is nothing to wait on
+    await write_as("user-1")
+    assert await get_read_db("get_messages", "user-1") is routing
+
+    monkeypatch.setattr(settings, "read_your_writes_mode", "primary")
+    await write_as("user-2", {"operationTime": WRITE_TIME, "$clusterTime": {"clusterTime": WRITE_TIME}})
+    assert await get_read_db("get_messages", "user-2") is routing
+    assert routing.client.sessions == []
+
+    assert await read_routing.recent_write("user-3") is None
+
+@pytest.mark.asyncio
+async def test_writes_outside_http_requests_are_recorded(routing):
+    cluster_time = {"clusterTime": WRITE_TIME, "signature": {}}
+    async with tracked_writes("user-1"):
+        WriteTimeListener().succeeded(SimpleNamespace(command_name="update", reply={"$clusterTime": cluster_time}))
+    async with tracked_writes("user-2"):
+        pass
+
+    assert (await read_routing.recent_write("user-1"))["clusterTime"] == cluster_time
+    assert await read_routing.recent_write("user-2") is None
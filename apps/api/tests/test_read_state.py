@@ -0,0 +1,85 @@
+import pytest
+from bson import ObjectId
+
+from app.api.v1.endpoints import messages as messages_endpoint
+from app.api.v1.endpoints.messages import create_message, delete_message
+from app.core.database import db as database
+from app.crud.read_state import ReadMarkerBuffer, add_mention_seqs, get_unread_counts, parse_mentions, read_markers
+from app.crud.sync import allocate_rev
+from app.models.message import MessageCreate
+
+def test_parse_mentions():
+    assert parse_mentions("hey @alice and @bob.smith, see email@example.com") == {"alice", "bob.smith"}
+
+async def next_seq(mongo, channel_id):
+    revision = await allocate_rev(mongo, channel_id, message_seq=True)
+    return revision["seq"] if revision else None
+
+@pytest.mark.asyncio
+async def test_seq_allocation_requires_existing_channel(mongo):
+    channel_id = (await mongo.channels.insert_one({"name": "general"})).inserted_id
+
+    assert await next_seq(mongo, str(channel_id)) == 1
+    assert await next_seq(mongo, str(channel_id)) == 2
+    assert await next_seq(mongo, str(ObjectId())) is None
+
+@pytest.mark.asyncio
+async def test_unread_and_mention_counts(mongo):
+    reader = str((await mongo.users.insert_one({"username": "alice"})).inserted_id)
+    general = str((await mongo.channels.insert_one({"name": "general"})).inserted_id)
+    random = str((await mongo.channels.insert_one({"name": "random"})).inserted_id)
+
+    for _ in range(5):
+        seq = await next_seq(mongo, general)
+    await add_mention_seqs(mongo, general, 2, [reader])
+    await add_mention_seqs(mongo, general, 4, [reader])
+    await next_seq(mongo, random)
+
+    buffer = ReadMarkerBuffer()
+    buffer.mark(reader, general, 3)
+    buffer.mark(reader, general, 1)  # Older positions never move the cursor back
+    await buffer.flush()
+
+    counts = {count["channel_id"]: count for count in await get_unread_counts(mongo, reader)}
+
+    assert counts[general]["unread_count"] == seq - 3
+    assert counts[general]["mention_count"] == 1
+    assert counts[random]["unread_count"] == 1
+    assert counts[random]["mention_count"] == 0
+
+@pytest.mark.asyncio
+async def test_unflushed_marks_count_as_read(mongo):
+    channel_id = str((await mongo.channels.insert_one({"name": "general", "last_seq": 10})).inserted_id)
+    user_id = str(ObjectId())
+
+    read_markers.mark(user_id, channel_id, 10)
+    try:
+        counts = await get_unread_counts(mongo, user_id)
+        assert counts[0]["unread_count"] == 0
+    finally:
+        await read_markers.close()
+    assert (await mongo.read_markers.find_one({"user_id": user_id}))["last_read_seq"] == 10
+
+@pytest.mark.asyncio
+async def test_deleted_and_unwritten_messages_are_not_unread(channel, fake_redis, monkeypatch):
+    channel_id, alice = channel
+    reader = str(ObjectId())
+    posted = [
+        await create_message(channel_id, MessageCreate(content=f"@{name}"), current_user=alice)
+        for name in ("bob", "bob", "carol")
+    ]
+    await add_mention_seqs(database.db, channel_id, posted[1].seq, [reader])
+
+    class BrokenMessages:
+        async def insert_one(self, document):
+            raise ConnectionError("primary stepped down")
+
+    monkeypatch.setattr(messages_endpoint, "messages_collection", lambda: BrokenMessages())
+    with pytest.raises(ConnectionError):
+        await create_message(channel_id, MessageCreate(content="lost"), current_user=alice)
+    monkeypatch.setattr(messages_endpoint, "messages_collection", lambda: database.db.messages)
+    await delete_message(posted[1].id, current_user=alice)
+
+    counts = await get_unread_counts(database.db, reader)
+    assert counts[0]["last_seq"] == 4
+    assert counts[0]["unread_count"] == 2 and counts[0]["mention_count"] == 0
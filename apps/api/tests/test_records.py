@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pydantic import BaseModel, ValidationError
+
+from app.models.message import Message, MessageInDB, Reaction
+from app.models.object_id import PyObjectId
+from app.models.records import MessageRecord, UserRef, encode
+
+def message_document(content, **extra):
+    document = {
+        "_id": ObjectId(),
+        "channel_id": "c1",
+        "user_id": ObjectId(),
+        "content": content,
+        "reactions": [{"_id": ObjectId(), "emoji": "👍", "count": 2, "users": ["u1", "u2"]}],
+        "seq": 7,
+        "created_at": datetime(2024, 5, 1, 12, 30, 15, 123000),
+        "updated_at": datetime(2024, 5, 1, 12, 31),
+    }
+    document.update(extra)
+    return document
+
+def test_records_encode_like_the_message_schema():
+    user = {"_id": ObjectId(), "username": "alice", "avatar": None}
+    author = UserRef.from_document(user)
+    reply = message_document("reply")
+    message = message_document("hello")
+    record = MessageRecord.from_document(message, author, [MessageRecord.from_document(reply, author)])
+
+    wire = record.to_wire()
+    expected = Message(
+        id=str(message["_id"]), content="hello", channel_id="c1", user=author.to_wire(),
+        reactions=message["reactions"], seq=7, created_at=message["created_at"], updated_at=message["updated_at"],
+        thread=[Message(
+            id=str(reply["_id"]), content="reply", channel_id="c1", user=author.to_wire(),
+            reactions=reply["reactions"], seq=7, created_at=reply["created_at"], updated_at=reply["updated_at"],
+        )],
+    ).model_dump(mode="json")
+    # Records carry the stored reaction ids; the schema model never read them
+    for payload in (expected, expected["thread"][0]):
+        payload["reactions"][0].pop("id")
+    for payload, document in ((wire, message), (wire["thread"][0], reply)):
+        assert payload["reactions"][0].pop("id") == str(document["reactions"][0]["_id"])
+    assert wire == expected
+    assert encode([record]).startswith(b'[{"id":"')
+
+def test_records_are_slotted():
+    record = MessageRecord.from_document(message_document("hi"), None)
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        record.extra = 1
+
+def test_object_ids_default_per_instance_and_validate():
+    assert Reaction(emoji="👍").id != Reaction(emoji="👍").id
+
+    class Ref(BaseModel):
+        id: PyObjectId
+
+    object_id = ObjectId()
+    assert Ref(id=str(object_id)).id == object_id
+    assert Ref(id=object_id).model_dump(mode="json") == {"id": str(object_id)}
+    with pytest.raises(ValidationError):
+        Ref(id="not-an-id")
+    assert MessageInDB(content="x", channel_id="c1", user_id=str(object_id),
+                       created_at=datetime.utcnow(), updated_at=datetime.utcnow()).user_id == object_id
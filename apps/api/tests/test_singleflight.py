@@ -0,0 +1,114 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Request, Response
+
+from app.api.v1.endpoints import messages as messages_endpoint
+from app.api.v1.endpoints.messages import create_message, get_messages
+from app.core.read_routing import SessionDatabase
+from app.core.singleflight import SingleFlight, read_key, singleflight_calls_total
+from app.models.message import MessageCreate
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_flight():
+    flights = SingleFlight("test_shared")
+    release = asyncio.Event()
+    calls = []
+
+    async def load(key):
+        calls.append(key)
+        await release.wait()
+        return [key]
+
+    waiting = [asyncio.ensure_future(flights.do(("page", 1), lambda: load(1))) for _ in range(5)]
+    other = asyncio.ensure_future(flights.do(("page", 2), lambda: load(2)))
+    await asyncio.sleep(0)
+    assert len(flights) == 2
+    release.set()
+    results = await asyncio.gather(*waiting)
+
+    assert calls == [1, 2]
+    assert all(result is results[0] for result in results)
+    assert await other == [2]
+    assert len(flights) == 0
+    assert singleflight_calls_total.value(("test_shared", "shared")) == 4
+
+    # Landed flights are not cached
+    assert await flights.do(("page", 1), lambda: load(1)) == [1]
+    assert calls == [1, 2, 1]
+
+@pytest.mark.asyncio
+async def test_followers_outlive_a_cancelled_leader_and_share_its_errors():
+    flights = SingleFlight("test_cancel")
+    release = asyncio.Event()
+
+    async def load():
+        await release.wait()
+        return "page"
+
+    leader = asyncio.ensure_future(flights.do("key", load))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flights.do("key", load))
+    await asyncio.sleep(0)
+    leader.cancel()
+    release.set()
+    assert await follower == "page"
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise RuntimeError("primary stepped down")
+
+    results = await asyncio.gather(flights.do("boom", fail), flights.do("boom", fail), return_exceptions=True)
+    assert [str(result) for result in results] == ["primary stepped down"] * 2
+
+def test_causal_sessions_are_never_shared():
+    assert read_key(SessionDatabase(None, None), "c1") is None
+    assert read_key(SimpleNamespace(read_preference=SimpleNamespace(name="secondaryPreferred")), "c1") == (
+        "secondaryPreferred", "c1"
+    )
+
+@pytest.mark.asyncio
+async def test_history_reads_coalesce_per_channel_version(channel, monkeypatch):
+    channel_id, user = channel
+    await create_message(channel_id, MessageCreate(content="announcement"), current_user=user)
+
+    loads = []
+    gate = asyncio.Event()
+    load_history = messages_endpoint.load_history
+
+    async def counting_load_history(*args):
+        loads.append(args)
+        await gate.wait()
+        return await load_history(*args)
+
+    async def until_loads(count):
+        while len(loads) < count:
+            await asyncio.sleep(0)
+        # Give every other reader time to reach the flight
+        for _ in range(50):
+            await asyncio.sleep(0)
+
+    monkeypatch.setattr(messages_endpoint, "load_history", counting_load_history)
+
+    async def read():
+        return await get_messages(channel_id, Request({"type": "http", "headers": []}), Response(), current_user=user)
+
+    burst = [asyncio.ensure_future(read()) for _ in range(20)]
+    await until_loads(1)
+    gate.set()
+    pages = await asyncio.gather(*burst)
+    assert len(loads) == 1
+    assert [message["content"] for message in json.loads(pages[-1].body)] == ["announcement"]
+
+    # A reader that has seen a newer version does not join an older flight
+    gate.clear()
+    stale = asyncio.ensure_future(read())
+    await until_loads(2)
+    await create_message(channel_id, MessageCreate(content="follow-up"), current_user=user)
+    fresh = asyncio.ensure_future(read())
+    await until_loads(3)
+    gate.set()
+    await stale
+    assert [message["content"] for message in json.loads((await fresh).body)] == ["announcement", "follow-up"]
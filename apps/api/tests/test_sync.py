@@ -0,0 +1,66 @@
+import pytest
+
+from app.api.v1.endpoints.channels import update_channel
+from app.api.v1.endpoints.messages import add_reaction, create_message, delete_message, update_message
+from app.api.v1.endpoints.sync import sync
+from app.core.config import settings
+from app.models.channel import ChannelUpdate
+from app.models.message import MessageCreate, MessageUpdate, ReactionCreate
+from app.models.sync import SyncRequest
+
+@pytest.fixture(autouse=True)
+def settle_immediately(monkeypatch):
+    monkeypatch.setattr(settings, "sync_settle_seconds", 0)
+
+async def resume(user, cursors):
+    return await sync(SyncRequest(channels=cursors), current_user=user)
+
+@pytest.mark.asyncio
+async def test_resume_returns_only_what_changed(channel):
+    channel_id, user = channel
+    kept = await create_message(channel_id, MessageCreate(content="one"), current_user=user)
+    doomed = await create_message(channel_id, MessageCreate(content="two"), current_user=user)
+
+    first = await resume(user, {})
+    [entry] = first["channels"]
+    assert entry["reset"] and entry["channel"]["name"] == "general"
+    cursor = entry["cursor"]
+
+    await update_message(kept.id, MessageUpdate(content="one, edited"), current_user=user)
+    await add_reaction(kept.id, ReactionCreate(emoji="👍"), current_user=user)
+    await delete_message(doomed.id, current_user=user)
+    await update_channel(channel_id, ChannelUpdate(description="talk"), current_user=user)
+    await create_message(channel_id, MessageCreate(content="three"), current_user=user)
+
+    [entry] = (await resume(user, {channel_id: cursor}))["channels"]
+    assert not entry["reset"]
+    assert entry["channel"]["description"] == "talk"
+    assert [(m["content"], len(m["reactions"])) for m in entry["messages"]] == [("one, edited", 1), ("three", 0)]
+    assert entry["messages"][0]["user"]["username"] == "alice"
+    assert entry["deleted_message_ids"] == [doomed.id]
+
+    assert (await resume(user, {channel_id: entry["cursor"]}))["channels"] == []
+
+@pytest.mark.asyncio
+async def test_cursors_hold_back_unsettled_changes(channel, monkeypatch):
+    channel_id, user = channel
+    cursor = (await resume(user, {}))["channels"][0]["cursor"]
+    monkeypatch.setattr(settings, "sync_settle_seconds", 3600)
+    await create_message(channel_id, MessageCreate(content="fresh"), current_user=user)
+
+    [entry] = (await resume(user, {channel_id: cursor}))["channels"]
+    assert [m["content"] for m in entry["messages"]] == ["fresh"]
+    # Sent again next time, in case an older write is still landing
+    assert entry["cursor"] == cursor
+
+@pytest.mark.asyncio
+async def test_large_gaps_reset_and_deleted_channels_are_reported(channel, monkeypatch):
+    channel_id, user = channel
+    cursor = (await resume(user, {}))["channels"][0]["cursor"]
+    monkeypatch.setattr(settings, "sync_max_changes", 2)
+    for i in range(3):
+        await create_message(channel_id, MessageCreate(content=f"m{i}"), current_user=user)
+
+    result = await resume(user, {channel_id: cursor, "0" * 24: 7})
+    assert [(entry["reset"], entry["messages"]) for entry in result["channels"]] == [(True, [])]
+    assert result["deleted_channel_ids"] == ["0" * 24]
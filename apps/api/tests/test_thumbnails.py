@@ -0,0 +1,86 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.endpoints.files import get_thumbnail
+from app.core.config import settings
+from app.core.storage import storage
+from app.core.thumbnails import ThumbnailPipeline, render_thumbnails, thumbnail_key, wants_thumbnails
+
+class FakeMinio:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, bucket, key, data, length, content_type=None):
+        self.objects[key] = data.read()
+
+    def get_object(self, bucket, key):
+        return FakeObject(self.objects[key])
+
+class FakeObject(io.BytesIO):
+    def release_conn(self):
+        pass
+
+def make_jpeg(width, height):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 40, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def test_only_media_gets_thumbnails():
+    assert wants_thumbnails("image/png")
+    assert not wants_thumbnails("application/pdf")
+    assert not wants_thumbnails(None)
+
+@pytest.mark.asyncio
+async def test_unknown_thumbnail_size_is_not_found():
+    with pytest.raises(HTTPException) as error:
+        await get_thumbnail("photo.jpg", 17, current_user=SimpleNamespace(id="user-1"))
+    assert error.value.status_code == 404
+
+def test_render_fits_every_size():
+    Image = pytest.importorskip("PIL.Image")
+
+    rendered = render_thumbnails(make_jpeg(2000, 1000), "image/jpeg", (64, 320))
+    sizes = {size: Image.open(io.BytesIO(data)).size for size, data in rendered.items()}
+    assert sizes == {64: (64, 32), 320: (320, 160)}
+
+@pytest.mark.asyncio
+async def test_pipeline_renders_off_loop_and_stores_next_to_original(monkeypatch):
+    pytest.importorskip("PIL")
+    monkeypatch.setattr(storage, "client", FakeMinio())
+    monkeypatch.setattr(settings, "thumbnail_workers", 1)
+    pipeline = ThumbnailPipeline()
+    try:
+        assert pipeline.enqueue("abc.jpg", make_jpeg(800, 600), "image/jpeg")
+        await pipeline.join()
+    finally:
+        await pipeline.close()
+
+    assert sorted(storage.client.objects) == sorted(thumbnail_key("abc.jpg", size) for size in settings.thumbnail_sizes)
+
+@pytest.mark.asyncio
+async def test_pipeline_reads_stored_content_and_reports_completion(monkeypatch):
+    pytest.importorskip("PIL")
+    monkeypatch.setattr(storage, "client", FakeMinio())
+    monkeypatch.setattr(settings, "thumbnail_workers", 1)
+    storage.client.objects["blobs/abc"] = make_jpeg(800, 600)
+    stored = []
+
+    async def on_stored():
+        stored.append("abc")
+
+    pipeline = ThumbnailPipeline()
+    try:
+        assert pipeline.enqueue("abc", None, "image/jpeg", source="blobs/abc", on_stored=on_stored)
+        # Already queued: not rendered twice
+        assert pipeline.enqueue("abc", None, "image/jpeg", source="blobs/abc", on_stored=on_stored)
+        await pipeline.join()
+    finally:
+        await pipeline.close()
+
+    assert stored == ["abc"]
+    assert thumbnail_key("abc", settings.thumbnail_sizes[0]) in storage.client.objects
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from fakeredis import aioredis
+
+from app.core.config import settings
+from app.core.redis import redis_state
+from app.websocket.manager import ConnectionManager
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+@pytest_asyncio.fixture
+async def workers(monkeypatch):
+    monkeypatch.setattr(redis_state, "client", aioredis.FakeRedis())
+    # Ticks are driven by the tests
+    monkeypatch.setattr(settings, "typing_interval_ms", 60000)
+    managers = [ConnectionManager(), ConnectionManager()]
+    yield managers
+    for manager in managers:
+        await manager.shutdown()
+
+def typing_frames(socket):
+    return [frame for frame in map(json.loads, socket.sent) if frame["type"] == "typing"]
+
+async def subscribed(manager, channel_id):
+    socket = FakeWebSocket()
+    await manager.connect(socket)
+    await manager.subscribe_to_channel(channel_id, socket)
+    return socket
+
+async def tick(*managers):
+    for manager in managers:
+        await manager.typing.flush()
+    # Let the sender tasks write the frames
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+@pytest.mark.asyncio
+async def test_typing_is_aggregated_across_workers_into_one_frame_per_tick(workers):
+    a, b = workers
+    typist = await subscribed(a, "general")
+    watcher = await subscribed(b, "general")
+
+    for user in ("u1", "u2", "u3"):
+        for _ in range(10):
+            a.typing.ping(typist, user, "general")
+    b.typing.ping(watcher, "u4", "general")
+    await tick(a, b)
+    await tick(a, b)
+
+    assert typing_frames(watcher) == [{"type": "typing", "channel_id": "general", "user_ids": ["u1", "u2", "u3", "u4"]}]
+
+    a.typing.ping(typist, "u1", "general", typing=False)
+    await tick(a, b)
+    assert typing_frames(watcher)[-1]["user_ids"] == ["u2", "u3", "u4"]
+
+@pytest.mark.asyncio
+async def test_pings_are_throttled_per_user_and_expire(workers, monkeypatch):
+    a, _ = workers
+    watcher = await subscribed(a, "general")
+
+    assert a.typing.ping(watcher, "u1", "general")
+    assert not a.typing.ping(watcher, "u1", "general")
+    assert a.typing.ping(watcher, "u2", "general")
+    await tick(a)
+
+    monkeypatch.setattr(settings, "typing_ttl_seconds", 0)
+    await redis_state.client.zadd("typing:general", {"u1": 0, "u2": 0})
+    await tick(a)
+    assert [frame["user_ids"] for frame in typing_frames(watcher)] == [["u1", "u2"], []]
+    # Nothing is stored once a channel is quiet
+    await tick(a)
+    assert len(typing_frames(watcher)) == 2
+
+@pytest.mark.asyncio
+async def test_pings_need_a_subscription_to_the_channel(workers):
+    a, _ = workers
+    socket = await subscribed(a, "general")
+
+    for i in range(100):
+        assert not a.typing.ping(socket, "u1", f"made-up-{i}")
+    await a.unsubscribe_from_channel("general", socket)
+    assert not a.typing.ping(socket, "u1", "general")
+    await tick(a)
+
+    assert await redis_state.client.keys("typing:*") == []
+    assert not a.typing._accepted and not a.typing._pending
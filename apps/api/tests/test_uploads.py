@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import io
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.endpoints.files import create_upload, get_upload
+from app.core.config import settings
+from app.core.redis import redis_state
+from app.core.storage import storage
+from app.crud import uploads
+from app.crud.files import blob_key
+from app.crud.uploads import (
+    collect_abandoned_uploads, complete_session, get_session, put_part, resumable_upload_hashes_total
+)
+from app.models.file import UploadSessionCreate
+
+class FakeObject(io.BytesIO):
+    def stream(self, amount):
+        while chunk := self.read(amount):
+            yield chunk
+
+    def release_conn(self):
+        pass
+
+class FakeMinio:
+    """Just enough of the multipart API"""
+
+    def __init__(self):
+        self.objects = {}
+        self.multipart = {}
+        self.initiated = {}
+        self.reads = 0
+
+    def _create_multipart_upload(self, bucket, key, headers):
+        upload_id = f"mp-{len(self.initiated)}"
+        self.multipart[upload_id] = {}
+        self.initiated[upload_id] = (key, datetime.now(timezone.utc))
+        return upload_id
+
+    def _upload_part(self, bucket, key, data, headers, upload_id, part_number):
+        self.multipart[upload_id][part_number] = data
+        # Like S3: the ETag of a part is the MD5 of its bytes
+        return hashlib.md5(data).hexdigest()
+
+    def _complete_multipart_upload(self, bucket, key, upload_id, parts):
+        received = self.multipart.pop(upload_id)
+        self.objects[key] = b"".join(received[part.part_number] for part in parts)
+        del self.initiated[upload_id]
+
+    def _abort_multipart_upload(self, bucket, key, upload_id):
+        self.multipart.pop(upload_id)
+        del self.initiated[upload_id]
+
+    def _list_multipart_uploads(self, bucket, prefix=None, key_marker=None, upload_id_marker=None):
+        return SimpleNamespace(is_truncated=False, uploads=[
+            SimpleNamespace(object_name=key, upload_id=upload_id, initiated_time=initiated)
+            for upload_id, (key, initiated) in self.initiated.items()
+        ])
+
+    def list_objects(self, bucket, prefix="", recursive=False):
+        return []
+
+    def get_object(self, bucket, key):
+        self.reads += 1
+        return FakeObject(self.objects[key])
+
+    def copy_object(self, bucket, key, source):
+        self.objects[key] = self.objects[source.object_name]
+
+    def remove_object(self, bucket, key):
+        self.objects.pop(key, None)
+
+@pytest.fixture
+def env(mongo, fake_redis, monkeypatch):
+    monkeypatch.setattr(storage, "client", FakeMinio())
+    monkeypatch.setattr(uploads, "MIN_PART_SIZE", 4)
+    monkeypatch.setattr(settings, "upload_chunk_size", 4)
+    return mongo, storage.client
+
+USER = SimpleNamespace(id="user-1")
+DATA = b"0123456789"
+
+@pytest.mark.asyncio
+async def test_parts_arrive_in_any_order_and_resume(env):
+    db, minio = env
+    started = await create_upload(UploadSessionCreate(filename="big.bin", size=len(DATA)), current_user=USER)
+    assert (started["chunk_size"], started["parts"]) == (4, 3)
+    session = await get_session(started["upload_id"], USER.id)
+
+    await asyncio.gather(put_part(session, 3, DATA[8:]), put_part(session, 1, DATA[:4]))
+    status = await get_upload(started["upload_id"], current_user=USER)
+    assert status["parts_received"] == [1, 3]
+
+    with pytest.raises(HTTPException) as error:
+        await complete_session(db, session)
+    assert error.value.detail["missing_parts"] == [2]
+    with pytest.raises(HTTPException):
+        await put_part(session, 2, b"short")
+
+    await put_part(session, 2, DATA[4:8])
+    read_backs = resumable_upload_hashes_total.value(("read_back",))
+    document, deduplicated = await complete_session(db, session)
+
+    digest = hashlib.sha256(DATA).hexdigest()
+    assert document["sha256"] == digest and not deduplicated
+    # Out of order: hashed by reading the assembled object back
+    assert resumable_upload_hashes_total.value(("read_back",)) == read_backs + 1
+    assert minio.objects == {blob_key(digest): DATA}
+    with pytest.raises(HTTPException) as error:
+        await get_session(started["upload_id"], USER.id)
+    assert error.value.status_code == 404
+
+@pytest.mark.asyncio
+async def test_sequential_parts_are_hashed_as_they_arrive(env):
+    db, minio = env
+    started = await create_upload(UploadSessionCreate(filename="big.bin", size=len(DATA)), current_user=USER)
+    session = await get_session(started["upload_id"], USER.id)
+    await put_part(session, 1, DATA[:4])
+    await put_part(session, 2, b"XXXX")
+    await put_part(session, 3, DATA[8:])
+
+    # A re-sent part replaces what was hashed, so that upload is read back instead
+    await put_part(session, 2, DATA[4:8])
+    document, _ = await complete_session(db, session)
+    assert document["sha256"] == hashlib.sha256(DATA).hexdigest() and minio.reads == 1
+
+    started = await create_upload(UploadSessionCreate(filename="copy.bin", size=len(DATA)), current_user=USER)
+    session = await get_session(started["upload_id"], USER.id)
+    for number in range(3):
+        await put_part(session, number + 1, DATA[number * 4:number * 4 + 4])
+    document, deduplicated = await complete_session(db, session)
+    assert document["sha256"] == hashlib.sha256(DATA).hexdigest() and deduplicated
+    assert minio.reads == 1
+
+@pytest.mark.asyncio
+async def test_failed_completion_can_be_retried(env, monkeypatch):
+    db, minio = env
+    started = await create_upload(UploadSessionCreate(filename="big.bin", size=len(DATA)), current_user=USER)
+    session = await get_session(started["upload_id"], USER.id)
+    for number in range(3):
+        await put_part(session, number + 1, DATA[number * 4:number * 4 + 4])
+
+    complete = minio._complete_multipart_upload
+
+    def flaky_complete(*args):
+        monkeypatch.setattr(minio, "_complete_multipart_upload", complete)
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(minio, "_complete_multipart_upload", flaky_complete)
+    with pytest.raises(ConnectionError):
+        await complete_session(db, session)
+
+    document, _ = await complete_session(db, session)
+    assert document["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+@pytest.mark.asyncio
+async def test_completion_failing_after_assembly_keeps_the_upload(env, monkeypatch):
+    db, minio = env
+    started = await create_upload(UploadSessionCreate(filename="big.bin", size=len(DATA)), current_user=USER)
+    session = await get_session(started["upload_id"], USER.id)
+    for number in range(3):
+        await put_part(session, number + 1, DATA[number * 4:number * 4 + 4])
+    digest = hashlib.sha256(DATA).hexdigest()
+
+    def copy_fails(*args):
+        raise ConnectionError("connection reset")
+
+    copy, create_file = minio.copy_object, uploads.create_file
+    monkeypatch.setattr(minio, "copy_object", copy_fails)
+    with pytest.raises(ConnectionError):
+        await complete_session(db, session)
+    assert minio.objects == {session["key"]: DATA}
+    assert await get_session(started["upload_id"], USER.id)
+    monkeypatch.setattr(minio, "copy_object", copy)
+
+    def create_fails(*args):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(uploads, "create_file", create_fails)
+    with pytest.raises(ConnectionError):
+        await complete_session(db, session)
+    # The reference store_content took is given back
+    assert await db.file_objects.count_documents({}) == 0
+    monkeypatch.setattr(uploads, "create_file", create_file)
+
+    # The retry neither needs the parts again nor assembles twice
+    document, _ = await complete_session(db, session)
+    assert document["sha256"] == digest
+    assert minio.objects == {blob_key(digest): DATA}
+
+@pytest.mark.asyncio
+async def test_known_content_skips_the_upload(env):
+    db, minio = env
+    digest = hashlib.sha256(DATA).hexdigest()
+    await db.file_objects.insert_one({"_id": digest, "key": blob_key(digest), "size": 10, "content_type": None, "refs": 1, "ready": True})
+
+    result = await create_upload(
+        UploadSessionCreate(filename="again.bin", size=len(DATA), sha256=digest), current_user=USER
+    )
+    assert result["status"] == "complete" and result["deduplicated"]
+    assert minio.initiated == {}
+    assert (await db.file_objects.find_one({"_id": digest}))["refs"] == 2
+
+@pytest.mark.asyncio
+async def test_abandoned_uploads_are_aborted(env, monkeypatch):
+    db, minio = env
+    live = await create_upload(UploadSessionCreate(filename="a.bin", size=len(DATA)), current_user=USER)
+    abandoned = await create_upload(UploadSessionCreate(filename="b.bin", size=len(DATA)), current_user=USER)
+    await redis_state.client.delete(f"upload:{abandoned['upload_id']}")
+    monkeypatch.setattr(settings, "upload_session_ttl_seconds", -1)
+
+    assert await collect_abandoned_uploads() == 1
+    assert [key for key, _ in minio.initiated.values()] == [f"uploads/{live['upload_id']}"]
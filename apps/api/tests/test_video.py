@@ -0,0 +1,144 @@
+import base64
+import hashlib
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import jwt
+import pytest
+from fakeredis import aioredis
+from fastapi import FastAPI
+
+from app.api.v1.endpoints import video
+from app.core import livekit
+from app.api.v1.endpoints.video import TokenBatchRequest, get_active_rooms, get_room_participants, get_video_tokens
+from app.core.config import settings
+from app.core.livekit import VideoTokens, WebhookError, room_index, verify_webhook
+from app.core.redis import redis_state
+
+USER = SimpleNamespace(id="user-1", username="ada")
+
+def signed(event: dict, secret: str = None):
+    """A webhook request body and Authorization header as LiveKit would send them"""
+    body = json.dumps(event).encode()
+    now = int(time.time())
+    token = jwt.encode(
+        {"iss": settings.livekit_api_key, "nbf": now, "exp": now + 300,
+         "sha256": base64.b64encode(hashlib.sha256(body).digest()).decode()},
+        secret or settings.livekit_api_secret, algorithm="HS256"
+    )
+    return body, token
+
+def participant_event(kind, identity, sid, event_id, room="channel_c1"):
+    return {
+        "event": kind,
+        "id": event_id,
+        "room": {"name": room, "sid": "RM_1"},
+        "participant": {"identity": identity, "sid": sid, "name": identity.upper(), "joinedAt": "1700000000"},
+    }
+
+@pytest.fixture
+def pushed(monkeypatch):
+    monkeypatch.setattr(redis_state, "client", aioredis.FakeRedis())
+    events = []
+
+    async def broadcast_to_channel(channel_id, data):
+        events.append((channel_id, data))
+
+    monkeypatch.setattr(video.manager, "broadcast_to_channel", broadcast_to_channel)
+    return events
+
+def test_webhook_signature_covers_the_body():
+    body, token = signed({"event": "room_started", "room": {"name": "channel_c1"}})
+    assert verify_webhook(body, f"Bearer {token}")["event"] == "room_started"
+    with pytest.raises(WebhookError):
+        verify_webhook(body.replace(b"c1", b"c2"), token)
+    with pytest.raises(WebhookError):
+        verify_webhook(body, signed({}, secret="wrong")[1])
+
+@pytest.mark.asyncio
+async def test_webhooks_feed_participants_and_push_call_state(pushed):
+    app = FastAPI()
+    app.include_router(video.router, prefix="/video")
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        for event in (
+            participant_event("participant_joined", "u1", "PA_1", "EV_1"),
+            participant_event("participant_joined", "u2", "PA_2", "EV_2"),
+            participant_event("participant_left", "u1", "PA_1", "EV_3"),
+        ):
+            body, token = signed(event)
+            response = await client.post("/video/webhook", content=body, headers={"Authorization": token})
+            assert response.status_code == 200
+
+        body, _ = signed(participant_event("participant_joined", "u3", "PA_3", "EV_4"))
+        response = await client.post("/video/webhook", content=body, headers={"Authorization": "forged"})
+        assert response.status_code == 401
+
+    room = await get_room_participants("c1", current_user=USER)
+    assert [p["identity"] for p in room["participants"]] == ["u2"]
+    assert (await get_active_rooms(current_user=USER))["rooms"] == [
+        {"channel_id": "c1", "room_name": "channel_c1", "participant_count": 1}
+    ]
+    assert [(channel, data["active"], data["participant_count"]) for channel, data in pushed] == [
+        ("c1", True, 1), ("c1", True, 2), ("c1", True, 1)
+    ]
+
+@pytest.mark.asyncio
+async def test_retried_and_late_events_do_not_resurrect_participants(pushed):
+    assert await room_index.apply(participant_event("participant_joined", "u1", "PA_1", "EV_1")) == ("channel_c1", 1)
+    assert await room_index.apply(participant_event("participant_joined", "u1", "PA_1", "EV_1")) is None
+
+    # The leave overtook the join of a second session
+    await room_index.apply(participant_event("participant_left", "u2", "PA_2", "EV_3"))
+    assert await room_index.apply(participant_event("participant_joined", "u2", "PA_2", "EV_2")) is None
+
+    # A stale leave for u1's earlier session does not remove the current one
+    await room_index.apply(participant_event("participant_left", "u1", "PA_0", "EV_4"))
+    assert [p["identity"] for p in await room_index.participants("channel_c1")] == ["u1"]
+
+    finished = {"event": "room_finished", "id": "EV_5", "room": {"name": "channel_c1", "sid": "RM_1"}}
+    assert await room_index.apply(finished) == ("channel_c1", 0)
+    assert await room_index.apply(participant_event("participant_joined", "u3", "PA_3", "EV_6")) is None
+    assert await room_index.participants("channel_c1") == []
+    assert await room_index.active_rooms() == {}
+
+@pytest.mark.asyncio
+async def test_events_that_fail_to_apply_are_accepted_on_retry(pushed, monkeypatch):
+    script = room_index._script
+    calls = []
+
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("redis went away")
+
+    def flaky_script(name, source):
+        calls.append(name)
+        return unavailable if len(calls) == 1 else script(name, source)
+
+    monkeypatch.setattr(room_index, "_script", flaky_script)
+    with pytest.raises(ConnectionError):
+        await room_index.apply(participant_event("participant_joined", "u1", "PA_1", "EV_1"))
+    assert await room_index.apply(participant_event("participant_joined", "u1", "PA_1", "EV_1")) == ("channel_c1", 1)
+
+def test_tokens_are_cached_until_close_to_expiry(monkeypatch):
+    tokens = VideoTokens()
+    token, expires_at = tokens.issue("user-1", "ada", "channel_c1")
+    claims = jwt.decode(token, settings.livekit_api_secret, algorithms=["HS256"], issuer=settings.livekit_api_key)
+    assert claims["sub"] == "user-1" and claims["exp"] == expires_at
+    assert claims["video"] == {"room": "channel_c1", "roomJoin": True, "canPublish": True,
+                               "canSubscribe": True, "canPublishData": True}
+
+    assert tokens.issue("user-1", "ada", "channel_c1") == (token, expires_at)
+    assert tokens.issue("user-1", "ada", "channel_c1", {"roomJoin": True})[0] != token
+
+    later = time.time() + settings.video_token_ttl_seconds - settings.video_token_refresh_seconds + 1
+    monkeypatch.setattr(livekit.time, "time", lambda: later)
+    assert tokens.issue("user-1", "ada", "channel_c1")[1] > expires_at
+
+@pytest.mark.asyncio
+async def test_batch_issues_one_token_per_channel():
+    result = await get_video_tokens(TokenBatchRequest(channel_ids=["c1", "c2", "c1"]), current_user=USER)
+    assert [entry["room_name"] for entry in result["tokens"]] == ["channel_c1", "channel_c2"]
+    for entry in result["tokens"]:
+        claims = jwt.decode(entry["token"], settings.livekit_api_secret, algorithms=["HS256"])
+        assert claims["video"]["room"] == entry["room_name"] and claims["name"] == "ada"
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+
+from app.core.config import settings
+from app.core.database import db as database
+from app.core.security import create_access_token
+from app.websocket.rpc import RpcSession
+
+@pytest_asyncio.fixture
+async def env(messaging, fake_redis):
+    db = messaging
+    users = {}
+    for name in ("alice", "bob"):
+        users[name] = str((await db.users.insert_one({
+            "username": name, "email": f"{name}@example.com", "avatar": None,
+            "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+        })).inserted_id)
+    channel_id = str((await db.channels.insert_one({
+        "name": "general", "created_by": users["alice"], "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+    })).inserted_id)
+    return users, channel_id
+
+def rpc(id, method, **params):
+    return {"type": "rpc", "id": id, "method": method, "params": params}
+
+@pytest.mark.asyncio
+async def test_commands_are_acked_with_the_rest_results(env):
+    users, channel_id = env
+    session = await RpcSession.open(create_access_token({"sub": users["alice"]}))
+    assert session.user.username == "alice"
+
+    posted = await session.call(rpc("c1", "post", channel_id=channel_id, content="hello @bob"))
+    assert posted["type"] == "rpc_result" and posted["id"] == "c1" and posted["ok"]
+    message = posted["result"]
+    assert message["content"] == "hello @bob" and message["seq"] == 1
+    assert message["user"]["username"] == "alice"
+
+    edited = await session.call(rpc("c2", "edit", message_id=message["id"], content="hi @bob"))
+    assert edited["id"] == "c2" and edited["result"]["content"] == "hi @bob"
+
+    reacted = await session.call(rpc(3, "react", message_id=message["id"], emoji="👍"))
+    assert reacted["id"] == 3 and reacted["result"]["reactions"][0]["users"] == [users["alice"]]
+
+    read = await session.call(rpc("c4", "mark_read", channel_id=channel_id))
+    assert read["result"] == {"channel_id": channel_id, "last_read_seq": 1}
+
+    stored = await database.db.messages.find_one({})
+    assert stored["content"] == "hi @bob"
+
+@pytest.mark.asyncio
+async def test_errors_are_replied_not_raised(env, monkeypatch):
+    users, channel_id = env
+    alice = await RpcSession.open(create_access_token({"sub": users["alice"]}))
+    bob = await RpcSession.open(create_access_token({"sub": users["bob"]}))
+    message_id = (await alice.call(rpc("p", "post", channel_id=channel_id, content="mine")))["result"]["id"]
+
+    assert (await bob.call(rpc("e", "edit", message_id=message_id, content="yours")))["error"]["status"] == 403
+    assert (await alice.call(rpc("u", "delete_everything")))["error"]["status"] == 404
+    assert (await alice.call(rpc("m", "post", content="where?")))["error"]["status"] == 400
+    invalid = await alice.call(rpc("v", "post", channel_id=channel_id, content=""))
+    assert invalid["id"] == "v" and not invalid["ok"] and invalid["error"]["status"] == 422
+    assert (await RpcSession().call(rpc("a", "post", channel_id=channel_id, content="hi")))["error"]["status"] == 401
+
+    monkeypatch.setattr(settings, "rate_limit_create_message_user", "1/10")
+    assert (await bob.call(rpc("r1", "post", channel_id=channel_id, content="one")))["ok"]
+    limited = await bob.call(rpc("r2", "post", channel_id=channel_id, content="two"))
+    assert limited["error"]["status"] == 429 and limited["error"]["retry_after"] > 0
+
+@pytest.mark.asyncio
+async def test_expired_sockets_renew_with_an_auth_frame(env):
+    users, channel_id = env
+    session = await RpcSession.open(create_access_token({"sub": users["alice"]}))
+    session.expires_at = 0
+
+    assert (await session.call(rpc("1", "mark_read", channel_id=channel_id)))["error"]["detail"] == "Token expired"
+
+    other = await session.authenticate({"type": "auth", "token": create_access_token({"sub": users["bob"]})})
+    assert not other["ok"] and other["error"]["status"] == 403
+
+    renewed = await session.authenticate({"type": "auth", "token": create_access_token(
+        {"sub": users["alice"]}, expires_delta=timedelta(minutes=5)
+    )})
+    assert renewed["ok"] and renewed["expires_at"] > 0
+    assert (await session.call(rpc("2", "mark_read", channel_id=channel_id)))["ok"]
+
+@pytest.mark.asyncio
+async def test_commands_are_shed_with_http_traffic(env, monkeypatch):
+    from app.core.loadshed import INTERACTIVE, AdaptiveLimiter
+    from app.websocket import rpc as rpc_module
+
+    users, channel_id = env
+    monkeypatch.setattr(settings, "loadshed_initial_limit", 1)
+    monkeypatch.setattr(settings, "loadshed_max_wait_ms", 20)
+    limiter = AdaptiveLimiter()
+    monkeypatch.setattr(rpc_module, "limiter", limiter)
+    session = await RpcSession.open(create_access_token({"sub": users["alice"]}))
+
+    # An HTTP request holds the only slot
+    assert (await limiter.acquire(INTERACTIVE))[0]
+    shed = await session.call(rpc("s", "post", channel_id=channel_id, content="hello"))
+    assert shed["error"]["status"] == 503 and shed["error"]["retry_after"] == 1
+    assert await database.db.messages.count_documents({}) == 0
+
+    limiter.release(INTERACTIVE, 0.001)
+    assert (await session.call(rpc("t", "post", channel_id=channel_id, content="hello")))["ok"]
+    assert limiter.in_flight == 0
+
+class ScriptedWebSocket:
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def receive(self):
+        if not self.frames:
+            raise RuntimeError("connection reset")
+        return self.frames.pop(0)
+
+    async def close(self, code=1000):
+        pass
+
+@pytest.mark.asyncio
+async def test_sockets_leave_presence_however_the_loop_ends(env, monkeypatch):
+    import main
+    from app.websocket.manager import ConnectionManager
+
+    users, channel_id = env
+    manager = ConnectionManager()
+    monkeypatch.setattr(main, "manager", manager)
+    socket = ScriptedWebSocket([
+        {"type": "websocket.receive", "bytes": b"\x00\x01"},
+        {"type": "websocket.receive", "text": '{"type": "subscribe", "channel_id": "%s"}' % channel_id},
+    ])
+
+    with pytest.raises(RuntimeError):
+        await main.websocket_endpoint(socket, create_access_token({"sub": users["alice"]}))
+
+    assert socket not in manager.socket_users
+    assert users["alice"] not in manager.user_connections
+    assert channel_id not in manager.channel_subscribers
+    assert await manager.online_users() == []
+    await manager.shutdown()